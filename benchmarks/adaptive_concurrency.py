@@ -0,0 +1,84 @@
+"""Compare fixed and adaptive concurrency for submissions to an overloaded server.
+
+Proposals are submitted with `submit_many` by a large number of worker threads to the stand-in for the SALT API,
+which answers requests beyond its capacity with a 429 status code. The submissions are made once without a limiter
+(so that all the workers send requests at the same time and rely on retries) and once with an adaptive concurrency
+window (as with SALT_API_MAX_CONCURRENCY). The wall-clock time, the number of successful submissions per second, the
+number of rejected requests and the final window size are reported as JSON.
+
+Example:
+
+    python benchmarks/adaptive_concurrency.py --submissions 200 --workers 32 --capacity 4 --output limits.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zipfile
+
+import requests
+
+import salt_api
+from salt_api import limits
+from salt_api.limits import AdaptiveConcurrency, ClientLimiter
+from salt_api.proposals import submit_many
+from salt_api.testing import StandInServer
+
+
+def measure(path, limiter, submissions, workers, capacity, latency):
+    limits.set_limiter(limiter)
+    salt_api._session = requests.Session()
+
+    with StandInServer(latency=latency, capacity=capacity) as server:
+        os.environ['SALT_API_PROPOSALS_BASE_URL'] = server.base_url
+        start = time.perf_counter()
+        results = submit_many([(path, '2018-1-SCI-042')] * submissions, max_workers=workers, max_per_host=workers)
+        wall_time = time.perf_counter() - start
+    salt_api._session.close()
+
+    succeeded = sum(1 for result in results if result.exception is None)
+    report = dict(wall_seconds=wall_time, succeeded=succeeded, submissions_per_second=succeeded / wall_time,
+                  requests=len(server.requests), rejected=len(server.requests) - succeeded,
+                  max_in_flight=server.max_in_flight)
+    if limiter:
+        report['final_window'] = limiter.concurrency.window
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare fixed and adaptive concurrency for submissions.')
+    parser.add_argument('--submissions', type=int, default=200, help='number of submissions')
+    parser.add_argument('--workers', type=int, default=32, help='number of worker threads')
+    parser.add_argument('--capacity', type=int, default=4, help='number of requests the server handles at a time')
+    parser.add_argument('--latency', type=float, default=0.02, help='latency added to every response in seconds')
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('SALT_API_MAX_RETRIES', '20')
+    os.environ.pop('SALT_API_SUBMIT_MANIFEST', None)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'proposal.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('Proposal.xml', '<Proposal/>')
+        results = dict(
+            fixed=measure(path, None, args.submissions, args.workers, args.capacity, args.latency),
+            adaptive=measure(path, ClientLimiter(concurrency=AdaptiveConcurrency(maximum=args.workers)),
+                             args.submissions, args.workers, args.capacity, args.latency))
+
+    report = dict(environment=dict(python=sys.version, platform=platform.platform(), timestamp=time.time()),
+                  settings=dict(submissions=args.submissions, workers=args.workers, capacity=args.capacity,
+                                latency=args.latency, max_retries=os.environ['SALT_API_MAX_RETRIES']),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Compare block downloads over HTTP/1.1 and multiplexed HTTP/2.
+
+Blocks are downloaded concurrently with `download_many`, which resolves every block name and then downloads the
+block, first from the HTTP/1.1 stand-in for the SALT API and then from the HTTP/2 stand-in (with SALT_API_HTTP2 set
+to 'prior-knowledge'). Both servers add the same latency to every response. The wall-clock time, request rate and
+number of connections (for HTTP/2) are reported as JSON. The h2 and httpx packages are required.
+
+Example:
+
+    python benchmarks/http2_blocks.py --blocks 200 --concurrency 32 --latency 0.02 --output http2.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import requests
+
+import salt_api
+from salt_api.adapters import configure_session
+from salt_api.proposals import download_many, get_block_ids
+from salt_api.testing import HTTP2StandInServer, StandInServer
+
+
+def measure(server, http2, blocks, concurrency, block_size):
+    if http2:
+        os.environ['SALT_API_HTTP2'] = 'prior-knowledge'
+    else:
+        os.environ.pop('SALT_API_HTTP2', None)
+    session = requests.Session()
+    configure_session(session, pool_maxsize=concurrency)
+    salt_api._session = session
+    get_block_ids().invalidate()
+
+    with server:
+        os.environ['SALT_API_PROPOSALS_BASE_URL'] = server.base_url
+        server.content = b'PK\x05\x06' + bytes(18) + bytes(block_size)
+        downloads = [('2018-1-SCI-042', 'block', 'Block {i}'.format(i=i)) for i in range(blocks)]
+        start = time.perf_counter()
+        results = download_many(downloads, max_workers=concurrency, max_per_host=concurrency)
+        wall_time = time.perf_counter() - start
+    session.close()
+
+    errors = [str(result.exception) for result in results if result.exception]
+    for result in results:
+        if result.result:
+            os.remove(result.result)
+    report = dict(wall_seconds=wall_time, requests=len(server.requests),
+                  requests_per_second=len(server.requests) / wall_time, errors=errors)
+    if http2:
+        report['connections'] = server.connections
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare block downloads over HTTP/1.1 and HTTP/2.')
+    parser.add_argument('--blocks', type=int, default=200, help='number of blocks to download')
+    parser.add_argument('--concurrency', type=int, default=32, help='number of concurrent downloads')
+    parser.add_argument('--latency', type=float, default=0.02, help='latency added to every response in seconds')
+    parser.add_argument('--block-size', type=int, default=16 * 1024, help='size of a block zip file in bytes')
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    os.environ.pop('SALT_API_DOWNLOAD_CACHE', None)
+    results = dict(
+        http1=measure(StandInServer(latency=args.latency), False, args.blocks, args.concurrency, args.block_size),
+        http2=measure(HTTP2StandInServer(latency=args.latency), True, args.blocks, args.concurrency,
+                      args.block_size))
+
+    report = dict(environment=dict(python=sys.version, platform=platform.platform(), timestamp=time.time()),
+                  settings=dict(blocks=args.blocks, concurrency=args.concurrency, latency=args.latency,
+                                block_size=args.block_size),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Benchmarks for salt_api, run against a local stand-in for the SALT API.
+
+The throughput, median (p50) and 99th percentile (p99) latency and peak memory of `submit`, `download` and
+`zip_proposal_content` are measured for various payload sizes and concurrency levels. The stand-in server can add
+latency, limit the bandwidth and inject errors. The results are written as JSON, so that runs can be compared.
+
+Example:
+
+    python benchmarks/run_benchmarks.py --sizes 1M 16M --concurrency 1 8 --latency 0.05 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import salt_api
+from salt_api import SaltApiException
+from salt_api.adapters import configure_session
+from salt_api.proposals import download, submit, zip_proposal_content
+from salt_api.testing import StandInServer
+
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+PROPOSAL_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Proposal xmlns="http://www.salt.ac.za/PIPT/Proposal/Phase2/4.8">
+    <Code>2018-1-SCI-042</Code>
+    <Block>
+        <Name>Benchmark block</Name>
+        <FinderChart>
+            <Path>attachments/finder_chart.txt</Path>
+        </FinderChart>
+        <Attachment>
+            <Path>attachments/data.fits</Path>
+        </Attachment>
+    </Block>
+</Proposal>
+"""
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile
+    values = sorted(values)
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def make_zip(directory, size):
+    path = os.path.join(directory, 'proposal-{size}.zip'.format(size=size))
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as z:
+        with z.open('data.bin', 'w', force_zip64=True) as member:
+            remaining = size
+            while remaining > 0:
+                chunk = os.urandom(min(remaining, 1024 * 1024))
+                member.write(chunk)
+                remaining -= len(chunk)
+    return path
+
+
+def make_proposal_dir(directory, size):
+    proposal_dir = os.path.join(directory, 'proposal-{size}'.format(size=size))
+    os.makedirs(os.path.join(proposal_dir, 'attachments'))
+    with open(os.path.join(proposal_dir, 'Proposal.xml'), 'w') as f:
+        f.write(PROPOSAL_XML)
+    with open(os.path.join(proposal_dir, 'attachments', 'finder_chart.txt'), 'w') as f:
+        f.write('Finder chart\n' * 1000)
+    # half random, half zeros, so that compression is neither trivial nor pointless
+    with open(os.path.join(proposal_dir, 'attachments', 'data.fits'), 'wb') as f:
+        f.write(os.urandom(size // 2))
+        f.write(bytes(size - size // 2))
+    return proposal_dir
+
+
+def run_scenario(operation, payload_size, concurrency, iterations):
+    # Run `iterations` calls of the operation on `concurrency` threads and return the statistics.
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            operation(i)
+        except (SaltApiException, requests.RequestException):
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(timed, range(iterations)):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+    duration = time.perf_counter() - start
+
+    # peak memory is measured in a separate run, as tracing slows down the operation considerably
+    tracemalloc.start()
+    try:
+        operation(iterations)
+    except (SaltApiException, requests.RequestException):
+        pass
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(payload_size=payload_size,
+                concurrency=concurrency,
+                iterations=iterations,
+                errors=errors,
+                duration=duration,
+                throughput=payload_size * len(latencies) / duration if duration else None,
+                requests_per_second=len(latencies) / duration if duration else None,
+                p50_latency=percentile(latencies, 0.5),
+                p99_latency=percentile(latencies, 0.99),
+                peak_memory=peak_memory)
+
+
+def benchmark_submit(server, directory, size, concurrency, iterations):
+    path = make_zip(directory, size)
+    try:
+        return run_scenario(lambda i: submit(path, '2018-1-SCI-{i:03d}'.format(i=i)), size, concurrency, iterations)
+    finally:
+        os.remove(path)
+
+
+def benchmark_download(server, directory, size, concurrency, iterations):
+    server.content = b'PK' + os.urandom(size - 2)
+
+    def operation(i):
+        os.remove(download('2018-1-SCI-{i:03d}'.format(i=i), 'Proposal'))
+
+    try:
+        return run_scenario(operation, size, concurrency, iterations)
+    finally:
+        server.content = b''
+
+
+def benchmark_zip(server, directory, size, concurrency, iterations):
+    proposal_dir = make_proposal_dir(directory, size)
+    xml = os.path.join(proposal_dir, 'Proposal.xml')
+
+    def operation(i):
+        with tempfile.TemporaryFile() as zip:
+            zip_proposal_content(zip, xml, parent_dir=proposal_dir)
+
+    try:
+        return run_scenario(operation, size, concurrency, iterations)
+    finally:
+        shutil.rmtree(proposal_dir)
+
+
+BENCHMARKS = dict(submit=benchmark_submit, download=benchmark_download, zip_proposal_content=benchmark_zip)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark salt_api against a local stand-in server.')
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS),
+                        help='benchmarks to run')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[parse_size(s) for s in ('64K', '1M', '16M')],
+                        help='payload sizes, such as 64K or 16M')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16],
+                        help='numbers of concurrent operations')
+    parser.add_argument('--iterations', type=int, default=20, help='operations per scenario')
+    parser.add_argument('--latency', type=float, default=0, help='latency added by the server, in seconds')
+    parser.add_argument('--bandwidth', type=parse_size, default=None,
+                        help='bandwidth per connection, in bytes per second (such as 10M)')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with a 503 error')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the error injection')
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    # The stand-in server doesn't check tokens, so that the benchmarks don't need credentials.
+    session = requests.Session()
+    configure_session(session)
+    salt_api._session = session
+
+    # caches and manifests would turn the measured operations into no-ops
+    for name in ('SALT_API_ATTACHMENT_CACHE', 'SALT_API_DOWNLOAD_CACHE', 'SALT_API_SUBMIT_MANIFEST'):
+        os.environ.pop(name, None)
+
+    results = []
+    with StandInServer(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                       seed=args.seed) as server:
+        os.environ['SALT_API_PROPOSALS_BASE_URL'] = server.base_url
+        directory = tempfile.mkdtemp()
+        try:
+            for name in args.benchmarks:
+                for size in args.sizes:
+                    for concurrency in args.concurrency:
+                        result = BENCHMARKS[name](server, directory, size, concurrency, args.iterations)
+                        result['benchmark'] = name
+                        results.append(result)
+                        print('{benchmark} size={payload_size} concurrency={concurrency}: '
+                              'p50={p50_latency} p99={p99_latency} errors={errors}'.format(**result), file=sys.stderr)
+        finally:
+            shutil.rmtree(directory)
+
+    report = dict(environment=dict(python=sys.version,
+                                   platform=platform.platform(),
+                                   cpu_count=os.cpu_count(),
+                                   timestamp=time.time()),
+                  settings=dict(latency=args.latency,
+                                bandwidth=args.bandwidth,
+                                error_rate=args.error_rate,
+                                iterations=args.iterations),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare the client CPU time of memory-mapped and buffered uploads.
+
+A zip file of the given size is submitted to a local stand-in for the SALT API, once with memory mapping enabled and
+once with SALT_API_MEMORY_MAP=0 (which reads the file in chunks). The CPU time of the submitting thread (the stand-in
+server runs in other threads) is reported per uploaded GB, as JSON.
+
+Example:
+
+    python benchmarks/upload_cpu.py --size 1G --repeat 3 --output upload_cpu.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import requests
+
+import salt_api
+from salt_api.adapters import configure_session
+from salt_api.proposals import submit
+from salt_api.testing import StandInServer
+
+from run_benchmarks import make_zip, parse_size
+
+
+GB = 1024 * 1024 * 1024
+
+
+def measure(path, memory_map, repeat):
+    # CPU and wall-clock seconds per GB, for each repetition
+    if memory_map:
+        os.environ.pop('SALT_API_MEMORY_MAP', None)
+    else:
+        os.environ['SALT_API_MEMORY_MAP'] = '0'
+
+    size = os.path.getsize(path)
+    cpu_times = []
+    wall_times = []
+    for _ in range(repeat):
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        submit(path, '2018-1-SCI-042')
+        cpu_times.append((time.thread_time() - cpu_start) * GB / size)
+        wall_times.append((time.perf_counter() - wall_start) * GB / size)
+    return dict(cpu_seconds_per_gb=min(cpu_times), wall_seconds_per_gb=min(wall_times), runs=cpu_times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the CPU time of memory-mapped and buffered uploads.')
+    parser.add_argument('--size', type=parse_size, default=parse_size('256M'), help='size of the uploaded zip file')
+    parser.add_argument('--chunk-size', type=parse_size, default=None, help='chunk size for buffered uploads')
+    parser.add_argument('--repeat', type=int, default=3, help='uploads per upload path')
+    parser.add_argument('--output', default=None, help='JSON file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    session = requests.Session()
+    configure_session(session)
+    salt_api._session = session
+    os.environ.pop('SALT_API_SUBMIT_MANIFEST', None)
+    if args.chunk_size:
+        os.environ['SALT_API_CHUNK_SIZE'] = str(args.chunk_size)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_zip(directory, args.size)
+        with StandInServer() as server:
+            os.environ['SALT_API_PROPOSALS_BASE_URL'] = server.base_url
+            results = dict(memory_mapped=measure(path, True, args.repeat),
+                           buffered=measure(path, False, args.repeat))
+    finally:
+        shutil.rmtree(directory)
+
+    report = dict(environment=dict(python=sys.version, platform=platform.platform(), timestamp=time.time()),
+                  settings=dict(size=args.size, chunk_size=args.chunk_size, repeat=args.repeat),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
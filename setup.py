@@ -21,9 +21,17 @@ setup(
     long_description=read('README.rst'),
     packages=find_packages(where='src'),
     package_dir={'': 'src'},
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=['token_auth_requests'],
-    tests_require=['pytest', 'httpretty'],
+    extras_require={
+        'aio': ['aiohttp'],
+        'http2': ['httpx[http2]'],
+        'zstd': ['zstandard'],
+    },
+    entry_points={
+        'console_scripts': ['salt-api = salt_api.cli:main'],
+    },
+    tests_require=['pytest', 'httpretty', 'aiohttp'],
     classifiers=[
         'Development Status :: 4 - Beta',
         'Framework :: Pytest',
@@ -31,7 +39,7 @@ setup(
         'Topic :: Software Development :: Testing',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Operating System :: OS Independent',
         'License :: OSI Approved :: MIT License',
     ],
@@ -1,4 +1,88 @@
-from token_auth_requests import auth_session
+import os
+import threading
 
 
-session = auth_session()
\ No newline at end of file
+class SaltApiException(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+_session = None
+
+_session_lock = threading.Lock()
+
+_thread_local = threading.local()
+
+_token_manager = None
+
+_token_manager_lock = threading.Lock()
+
+
+def get_session():
+    """Return the session used for requests to the SALT API.
+
+    By default there is a single session per process, which is shared by all threads; its connection pool is
+    thread-safe. If the environment variable `SALT_API_SESSION_SCOPE` is 'thread', every thread has its own session
+    instead. A child process created with `fork` creates new sessions rather than using the parent's connections.
+    """
+
+    # The session is created when it is first needed, as creating it (and importing token_auth_requests and
+    # requests) takes time which processes not making any requests shouldn't have to spend.
+    global _session
+    if os.environ.get('SALT_API_SESSION_SCOPE') == 'thread':
+        session = getattr(_thread_local, 'session', None)
+        if session is None:
+            session = _thread_local.session = _create_session()
+        return session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _create_session():
+    # If a username is defined by the environment, tokens are managed by salt_api.tokens rather than
+    # token_auth_requests, and all the sessions of a process share the same token manager.
+    global _token_manager
+    from salt_api.adapters import configure_session
+    from salt_api.tokens import default_token_manager, TokenAuth
+
+    with _token_manager_lock:
+        if _token_manager is None:
+            _token_manager = default_token_manager()
+    if _token_manager:
+        import requests
+        session = requests.Session()
+        session.auth = TokenAuth(_token_manager)
+    else:
+        from token_auth_requests import auth_session
+        session = auth_session()
+    configure_session(session)
+    return session
+
+
+def _reset_after_fork():
+    # Sockets inherited from the parent process must not be used by the child, as both would read from and write to
+    # the same connections. Locks might have been held by threads which don't exist in the child, and the token
+    # manager's refresh thread doesn't exist either.
+    global _session, _session_lock, _thread_local, _token_manager, _token_manager_lock
+    _session = None
+    _session_lock = threading.Lock()
+    _thread_local = threading.local()
+    _token_manager = None
+    _token_manager_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def __getattr__(name):
+    # salt_api.session is kept for backwards compatibility
+    if name == 'session':
+        return get_session()
+    raise AttributeError('module {module!r} has no attribute {name!r}'.format(module=__name__, name=name))
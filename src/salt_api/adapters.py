@@ -0,0 +1,63 @@
+import os
+
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+
+DEFAULT_POOL_MAXSIZE = 10
+
+DEFAULT_CONNECT_TIMEOUT = 10
+
+DEFAULT_READ_TIMEOUT = 60
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTP adapter which uses a default timeout for requests which don't specify one.
+
+    `timeout` is a (connect timeout, read timeout) tuple in seconds.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def make_adapter(pool_connections=None, pool_maxsize=None, timeout=None):
+    """Create a `TimeoutHTTPAdapter`.
+
+    Unless they are passed, the number of connection pools (i.e. hosts) to cache, the maximum number of connections
+    per host and the (connect, read) timeouts are read from the environment variables `SALT_API_POOL_CONNECTIONS`,
+    `SALT_API_POOL_MAXSIZE`, `SALT_API_CONNECT_TIMEOUT` and `SALT_API_READ_TIMEOUT`.
+    """
+
+    if timeout is None:
+        timeout = (float(os.environ.get('SALT_API_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+                   float(os.environ.get('SALT_API_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)))
+    return TimeoutHTTPAdapter(
+        timeout=timeout,
+        pool_connections=pool_connections or int(os.environ.get('SALT_API_POOL_CONNECTIONS',
+                                                                DEFAULT_POOL_CONNECTIONS)),
+        pool_maxsize=pool_maxsize or int(os.environ.get('SALT_API_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE)))
+
+
+def configure_session(session, **kwargs):
+    """Mount an adapter created with `make_adapter` for all HTTP and HTTPS requests made with a session.
+
+    If the environment variable `SALT_API_HTTP2` is '1', the adapter is wrapped in an `HTTP2Adapter`, which uses
+    HTTP/2 for HTTPS requests to servers supporting it. If the variable is 'prior-knowledge', plain HTTP requests use
+    HTTP/2 as well.
+    """
+
+    adapter = make_adapter(**kwargs)
+    http2 = os.environ.get('SALT_API_HTTP2', '0')
+    if http2 != '0':
+        from salt_api.http2 import HTTP2Adapter
+        adapter = HTTP2Adapter(fallback=adapter, prior_knowledge=http2 == 'prior-knowledge')
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
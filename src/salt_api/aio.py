@@ -0,0 +1,322 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import tempfile
+import time
+import weakref
+
+import aiohttp
+
+from salt_api import limits, metrics, SaltApiException
+from salt_api.adapters import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from salt_api.encoding import compressor, request_encoding
+from salt_api.files import is_path, is_xml, is_zip, open_binary
+from salt_api.http import default_chunk_size, default_max_resumes, proposals_base_url
+from salt_api.proposals import DEFAULT_MAX_PER_HOST, zip_proposal_content
+from salt_api.tokens import REFRESH_AHEAD, REFRESH_RETRY_INTERVAL, TOKEN_EXPIRY_MARGIN, default_token_store, store_key
+from salt_api.tokens import token_url as default_token_url
+
+
+DEFAULT_MAX_CONNECTIONS = 100
+
+# exceptions which decrease the concurrency window of the shared limiter
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+class AuthClientSession:
+    """An asyncio HTTP session with token based authentication.
+
+    The session requests a token from the token URL by posting the username and password, and it adds an
+    `Authentication: Token ...` header to all other requests. The token is refreshed in the background before it
+    expires, and once more if the server responds with a 401 status code. Connections are pooled by a non-blocking
+    aiohttp connector. All requests other than token requests go through the shared limiter of the `limits` module.
+
+    The username, password and token URL default to the environment variables `SALT_API_USERNAME`,
+    `SALT_API_PASSWORD` and `SALT_API_TOKEN_URL`. If the latter isn't set, the token URL is `{base_url}/token`. If a
+    `TokenStore` is passed (or defined by the environment variable `SALT_API_TOKEN_STORE`), tokens are shared with
+    other processes via the store.
+    """
+
+    def __init__(self, username=None, password=None, token_url=None, max_connections=None, max_per_host=None,
+                 token_store=None):
+        self.username = username if username is not None else os.environ.get('SALT_API_USERNAME')
+        self.password = password if password is not None else os.environ.get('SALT_API_PASSWORD')
+        self.token_url = token_url or default_token_url()
+        self.token_store = token_store or default_token_store()
+        connector = aiohttp.TCPConnector(
+            limit=max_connections or int(os.environ.get('SALT_API_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+            limit_per_host=max_per_host or int(os.environ.get('SALT_API_MAX_PER_HOST', DEFAULT_MAX_PER_HOST)))
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=float(os.environ.get('SALT_API_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+            sock_read=float(os.environ.get('SALT_API_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)))
+        self.client_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._token = None
+        self._token_expiry = 0
+        self._token_lock = asyncio.Lock()
+        self._refresh_handle = None
+
+    async def request(self, method, url, headers=None, **kwargs):
+        # A request body which can only be read once can't be sent again after a 401 response.
+        can_resend = not hasattr(kwargs.get('data'), '__aiter__')
+        response = await self._request(method, url, headers, **kwargs)
+        if response.status == 401 and can_resend:
+            response.release()
+            await self._refresh_token(time.time() + TOKEN_EXPIRY_MARGIN, invalid_token=self._token)
+            response = await self._request(method, url, headers, **kwargs)
+        return response
+
+    async def close(self):
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+        await self.client_session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _request(self, method, url, headers, **kwargs):
+        if not self._token or time.time() >= self._token_expiry - TOKEN_EXPIRY_MARGIN:
+            await self._refresh_token(time.time() + TOKEN_EXPIRY_MARGIN)
+        headers = dict(headers or {})
+        headers['Authentication'] = 'Token {token}'.format(token=self._token)
+        return await limits.send_async(lambda: self.client_session.request(method, url, headers=headers, **kwargs),
+                                       CONNECTION_ERRORS)
+
+    async def _refresh_token(self, valid_until, invalid_token=None):
+        # Make sure that the token doesn't expire before valid_until (a Unix time) and isn't invalid_token.
+        # Concurrent requests wait for a single token request rather than making their own.
+        async with self._token_lock:
+            if self._token and self._token != invalid_token and self._token_expiry > valid_until:
+                return
+            if self.token_store:
+                # The store's lock is held by an executor thread while the token is requested on the event loop, so
+                # that other processes wait for the token rather than requesting their own.
+                loop = asyncio.get_running_loop()
+                key = store_key(self.username, self.token_url)
+
+                def fetch():
+                    return asyncio.run_coroutine_threadsafe(self._fetch(), loop).result()
+
+                self._token, self._token_expiry = await loop.run_in_executor(
+                    None, contextvars.copy_context().run, self.token_store.get_or_fetch, key, fetch, valid_until,
+                    invalid_token)
+            else:
+                self._token, self._token_expiry = await self._fetch()
+            self._schedule_refresh(self._token_expiry - min(REFRESH_AHEAD, (self._token_expiry - time.time()) / 2))
+
+    async def _fetch(self):
+        with metrics.phase('token'):
+            async with self.client_session.post(self.token_url, json=dict(username=self.username,
+                                                                          password=self.password)) as response:
+                await _check_response(response)
+                content = await response.json()
+        return content['token'], time.time() + content['expires_in']
+
+    def _schedule_refresh(self, refresh_at):
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._refresh_handle = loop.call_later(max(refresh_at - time.time(), 0),
+                                               lambda: loop.create_task(self._refresh_in_background()))
+
+    async def _refresh_in_background(self):
+        # Only a token expiring later than the current one is accepted.
+        try:
+            await self._refresh_token(self._token_expiry)
+        except Exception:
+            self._schedule_refresh(time.time() + REFRESH_RETRY_INTERVAL)
+
+
+def get_session():
+    # aiohttp sessions are bound to an event loop, so there is one default session per loop. It must be closed with
+    # close_session.
+    loop = asyncio.get_running_loop()
+    if loop not in _sessions:
+        _sessions[loop] = AuthClientSession()
+    return _sessions[loop]
+
+
+async def close_session():
+    """Close the default session of the running event loop, if there is one.
+
+    Callers which let `submit` and `download` use the default session must await this before the event loop is
+    closed, as the session's connections and token refresh would be leaked otherwise.
+    """
+
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session:
+        await session.close()
+
+
+async def submit(filename, proposal_code=None, chunk_size=None, session=None):
+    with metrics.measure('submit'):
+        async with limits.async_operation():
+            return await _submit(filename, proposal_code, chunk_size, session)
+
+
+async def download(proposal_code, content_type, name=None, chunk_size=None, max_resumes=None, session=None):
+    with metrics.measure('download'):
+        async with limits.async_operation():
+            return await _download(proposal_code, content_type, name, chunk_size, max_resumes, session)
+
+
+async def _submit(filename, proposal_code, chunk_size, session):
+    session = session or get_session()
+    base_url = proposals_base_url()
+    chunk_size = chunk_size or default_chunk_size()
+    loop = asyncio.get_running_loop()
+
+    async with _zip_content(filename, loop) as f:
+        headers = {'Content-Type': 'application/zip'}
+        encoding = await loop.run_in_executor(None, request_encoding, f)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            data = _compress_chunks(_read_in_chunks(f, chunk_size), encoding)
+        else:
+            data = _read_in_chunks(f, chunk_size)
+        if proposal_code:
+            url = '{base_url}/proposals/{proposal_code}'.format(base_url=base_url, proposal_code=proposal_code)
+            response = await session.request('PUT', url, data=data, headers=headers)
+        else:
+            url = '{base_url}/proposals'.format(base_url=base_url)
+            response = await session.request('POST', url, data=data, headers=headers)
+
+    async with response:
+        metrics.set_status(response.status)
+        await _check_response(response)
+        return await response.read()
+
+
+@contextlib.asynccontextmanager
+async def _zip_content(filename, loop):
+    # As in the proposals module, an XML file is zipped together with the files it references. The zip file is built
+    # on the default executor, in a copy of the current context so that the scan and zip phases are measured.
+    with open_binary(filename) as f:
+        if await loop.run_in_executor(None, is_zip, f):
+            yield f
+        elif await loop.run_in_executor(None, is_xml, f):
+            parent_dir = os.path.dirname(os.path.abspath(filename)) if is_path(filename) else None
+            zip_file = await loop.run_in_executor(None, contextvars.copy_context().run, zip_proposal_content, None, f,
+                                                  parent_dir)
+            with zip_file:
+                yield zip_file
+        else:
+            raise ValueError('The submitted content must be a zip file or an XML file.')
+
+
+async def _download(proposal_code, content_type, name, chunk_size, max_resumes, session):
+    content_type = content_type.lower()
+    if content_type not in ('proposal', 'block'):
+        raise ValueError('The content type must be "proposal" or "block".')
+    if content_type != 'proposal' and not name:
+        raise ValueError('A name must be supplied for a block.')
+
+    session = session or get_session()
+    base_url = proposals_base_url()
+    chunk_size = chunk_size or default_chunk_size()
+    max_resumes = max_resumes if max_resumes is not None else default_max_resumes()
+
+    if content_type == 'proposal':
+        url = '{base_url}/proposals/{proposal_code}'.format(base_url=base_url, proposal_code=proposal_code)
+    else:
+        resolve_url = '{base_url}/proposals/{proposal_code}/blocks/resolve'.format(base_url=base_url,
+                                                                                   proposal_code=proposal_code)
+        async with await session.request('GET', resolve_url, params={'name': name}) as response:
+            await _check_response(response)
+            block_id = (await response.json())['code']
+        url = '{base_url}/proposals/{proposal_code}/blocks/{block_id}'.format(base_url=base_url,
+                                                                              proposal_code=proposal_code,
+                                                                              block_id=block_id)
+
+    loop = asyncio.get_running_loop()
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            await _download_to_file(session, url, f, chunk_size, max_resumes, loop)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return os.path.abspath(path)
+
+
+async def _download_to_file(session, url, f, chunk_size, max_resumes, loop):
+    # See salt_api.proposals._download_to_file.
+    resumes = 0
+    etag = None
+    encoded = False
+    while True:
+        if encoded:
+            f.seek(0)
+            f.truncate()
+        written = f.tell()
+        headers = {'Accept': 'application/zip'}
+        if written:
+            headers['Range'] = 'bytes={written}-'.format(written=written)
+            if etag:
+                headers['If-Range'] = etag
+
+        try:
+            async with await session.request('GET', url, headers=headers) as response:
+                metrics.set_status(response.status)
+                await _check_response(response)
+                if written and response.status != 206:
+                    f.seek(0)
+                    f.truncate()
+                etag = etag or response.headers.get('ETag')
+                encoded = 'Content-Encoding' in response.headers
+                expected_size = None
+                if response.content_length is not None and 'Content-Encoding' not in response.headers:
+                    expected_size = f.tell() + response.content_length
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await loop.run_in_executor(None, f.write, chunk)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+            if resumes >= max_resumes:
+                raise
+            resumes += 1
+            continue
+
+        if expected_size is not None and f.tell() < expected_size:
+            if resumes >= max_resumes:
+                raise SaltApiException('The download of {url} is incomplete.'.format(url=url))
+            resumes += 1
+            continue
+
+        return
+
+
+async def _read_in_chunks(f, chunk_size):
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, f.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _compress_chunks(chunks, encoding):
+    # salt_api.encoding.compress for an asynchronous iterable of chunks
+    c = compressor(encoding)
+    async for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    yield c.flush()
+
+
+async def _check_response(response):
+    if response.status < 400:
+        return
+
+    try:
+        message = (await response.json(content_type=None))['error']
+    except (ValueError, KeyError, TypeError):
+        message = await response.text() or 'The server responded with status code {status_code}.'.format(
+            status_code=response.status)
+
+    raise SaltApiException(message, status_code=response.status)
@@ -0,0 +1,284 @@
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+
+
+LOCAL_FILE_HEADER = b'PK\x03\x04'
+
+DATA_DESCRIPTOR = b'PK\x07\x08'
+
+# zip flag bits
+ENCRYPTED = 0x01
+HAS_DATA_DESCRIPTOR = 0x08
+
+ZIP64_EXTRA_ID = 0x0001
+
+COPY_SIZE = 1024 * 1024
+
+
+class ProposalArchive:
+    """A read-only view of a zip file, whose members are read when they are needed.
+
+    Only the central directory is read when the archive is opened. The file is memory-mapped, so that reading a
+    member doesn't require any further system calls. The archive should be closed (or used as a context manager); if
+    `delete` is true, the zip file is deleted when the archive is closed.
+    """
+
+    def __init__(self, path, delete=False):
+        self.path = path
+        self.delete = delete
+        self._file = open(path, 'rb')
+        try:
+            self._map = _MappedFile(self._file) if os.fstat(self._file.fileno()).st_size else None
+            self._zip = zipfile.ZipFile(self._map or self._file)
+        except BaseException:
+            self._close_files()
+            raise
+
+    def names(self):
+        return self._zip.namelist()
+
+    def open(self, name):
+        return self._zip.open(name)
+
+    def read(self, name):
+        return self._zip.read(name)
+
+    @property
+    def xml_name(self):
+        # The name of the proposal (or block) XML file, i.e. the only XML file outside a directory.
+        names = [name for name in self.names() if '/' not in name and name.lower().endswith('.xml')]
+        if len(names) != 1:
+            raise KeyError('There is no unique XML file at the top level of the archive.')
+        return names[0]
+
+    def xml(self):
+        return self.read(self.xml_name)
+
+    def extract(self, name, directory):
+        return self._zip.extract(name, directory)
+
+    def extractall(self, directory):
+        self._zip.extractall(directory)
+
+    def close(self):
+        self._zip.close()
+        self._close_files()
+        if self.delete:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _close_files(self):
+        if getattr(self, '_map', None):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _MappedFile:
+    # A seekable read-only file object backed by a memory map. (ZipFile requires a seekable attribute, which mmap
+    # objects lack.)
+
+    def __init__(self, f):
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, size=-1):
+        return self._map.read(size if size is not None and size >= 0 else None)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._map.close()
+
+
+class StreamingNotSupported(Exception):
+    """Raised by `stream_extract` if a zip member can't be extracted without knowing its size in advance."""
+
+
+def stream_extract(chunks, directory):
+    """Extract a zip file from an iterable of byte chunks into a directory, as the chunks arrive.
+
+    The local file headers are read in the order of the members, so that the zip file never has to be stored. This
+    works for deflated members and for stored members whose size is given in their local file header. If a member
+    can't be extracted (because it is encrypted, compressed with another method, or stored with a data descriptor),
+    `StreamingNotSupported` is raised. Member names are sanitized, so that no file is written outside the directory.
+
+    The list of extracted member names is returned.
+    """
+
+    reader = _ChunkReader(chunks)
+    names = []
+    while True:
+        signature = reader.read(4, allow_end=True)
+        if signature != LOCAL_FILE_HEADER:
+            # the central directory (or the end of the file) has been reached
+            reader.drain()
+            return names
+
+        (version, flags, method, mod_time, mod_date, crc, compress_size, file_size, name_length,
+         extra_length) = struct.unpack('<HHHHHIIIHH', reader.read(26))
+        name = reader.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = reader.read(extra_length)
+        zip64 = compress_size == 0xFFFFFFFF or file_size == 0xFFFFFFFF
+        if zip64:
+            file_size, compress_size = _zip64_sizes(extra, file_size, compress_size)
+
+        if flags & ENCRYPTED:
+            raise StreamingNotSupported('{name} is encrypted.'.format(name=name))
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise StreamingNotSupported('{name} uses an unsupported compression method.'.format(name=name))
+        if method == zipfile.ZIP_STORED and flags & HAS_DATA_DESCRIPTOR:
+            raise StreamingNotSupported('The size of {name} is unknown.'.format(name=name))
+
+        path = _member_path(directory, name)
+        if path is None or name.endswith('/'):
+            out = None
+            if path:
+                os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = open(path, 'wb')
+        try:
+            if method == zipfile.ZIP_DEFLATED:
+                actual_crc = _inflate(reader, out)
+            else:
+                actual_crc = _copy(reader, out, compress_size)
+        finally:
+            if out:
+                out.close()
+
+        if flags & HAS_DATA_DESCRIPTOR:
+            crc = _read_data_descriptor(reader, zip64)
+        if actual_crc != crc:
+            raise zipfile.BadZipFile('Bad CRC-32 for {name}.'.format(name=name))
+        names.append(name)
+
+
+class _ChunkReader:
+    # Reads exact numbers of bytes from an iterable of chunks. Bytes read too many can be pushed back.
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._offset = 0
+
+    def read(self, size, allow_end=False):
+        # If allow_end is true, fewer bytes are returned if the chunks end before the first byte.
+        while len(self._buffer) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer = self._buffer[self._offset:] + chunk
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        if len(data) < size and not (allow_end and not data):
+            raise zipfile.BadZipFile('The zip file is truncated.')
+        return data
+
+    def read_chunk(self):
+        # The next available bytes, however many there are.
+        if self._offset < len(self._buffer):
+            data = self._buffer[self._offset:]
+            self._buffer, self._offset = b'', 0
+            return data
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise zipfile.BadZipFile('The zip file is truncated.')
+        return bytes(chunk)
+
+    def unread(self, data):
+        self._buffer = data + self._buffer[self._offset:]
+        self._offset = 0
+
+    def drain(self):
+        self._buffer, self._offset = b'', 0
+        for _ in self._chunks:
+            pass
+
+
+def _zip64_sizes(extra, file_size, compress_size):
+    # The sizes in the ZIP64 extra field are only included for the sizes set to 0xFFFFFFFF in the header.
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[position:position + 4])
+        data = extra[position + 4:position + 4 + size]
+        if header_id == ZIP64_EXTRA_ID:
+            values = list(struct.unpack('<{n}Q'.format(n=len(data) // 8), data[:len(data) // 8 * 8]))
+            if file_size == 0xFFFFFFFF and values:
+                file_size = values.pop(0)
+            if compress_size == 0xFFFFFFFF and values:
+                compress_size = values.pop(0)
+            break
+        position += 4 + size
+    return file_size, compress_size
+
+
+def _inflate(reader, out):
+    # Decompress a deflated member, which ends where its deflate stream ends.
+    decompressor = zlib.decompressobj(-15)
+    crc = 0
+    while not decompressor.eof:
+        data = decompressor.decompress(reader.read_chunk(), COPY_SIZE)
+        while True:
+            crc = zlib.crc32(data, crc)
+            if out:
+                out.write(data)
+            if not decompressor.unconsumed_tail:
+                break
+            data = decompressor.decompress(decompressor.unconsumed_tail, COPY_SIZE)
+    reader.unread(decompressor.unused_data)
+    return crc
+
+
+def _copy(reader, out, size):
+    crc = 0
+    remaining = size
+    while remaining > 0:
+        data = reader.read_chunk()
+        if len(data) > remaining:
+            reader.unread(data[remaining:])
+            data = data[:remaining]
+        crc = zlib.crc32(data, crc)
+        if out:
+            out.write(data)
+        remaining -= len(data)
+    return crc
+
+
+def _read_data_descriptor(reader, zip64):
+    # The signature of a data descriptor is optional.
+    data = reader.read(4)
+    if data == DATA_DESCRIPTOR:
+        data = reader.read(4)
+    crc, = struct.unpack('<I', data)
+    reader.read(16 if zip64 else 8)
+    return crc
+
+
+def _member_path(directory, name):
+    # The path of a member in the directory, with absolute paths, drive letters and parent directory references
+    # removed (as ZipFile.extract does). None is returned if nothing is left of the name.
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if parts and len(parts[0]) == 2 and parts[0][1] == ':':
+        parts = parts[1:]
+    if not parts:
+        return None
+    return os.path.join(directory, *parts)
@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+TEMP_PREFIX = '.tmp-'
+
+
+class FileCache:
+    """A size-limited cache of files in a directory, which may be shared between processes.
+
+    Every entry is a single file containing a line of JSON metadata followed by the cached data. Entries are written
+    to a temporary file first and then moved into place, so that other processes never see a partially written entry.
+    The modification time of an entry is updated whenever it is read, and if the total size of the entries exceeds
+    `max_size` bytes, the least recently used entries are removed.
+
+    So that putting an entry doesn't require scanning the directory, the cache keeps track of the total size found by
+    the last scan plus the sizes of the entries put since then. The directory is only scanned (and entries evicted)
+    when this total exceeds `max_size`. Entries put by other processes are only taken into account by the next scan.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        # An open file is returned rather than a path, as the entry might be evicted by another process at any time.
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None, None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        metadata = json.loads(f.readline().decode('utf-8'))
+        return metadata, f
+
+    def get_metadata(self, key):
+        metadata, f = self.get(key)
+        if f:
+            f.close()
+        return metadata
+
+    def put(self, key, metadata, f=None):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(json.dumps(metadata).encode('utf-8') + b'\n')
+                if f:
+                    shutil.copyfileobj(f, out)
+                size = out.tell()
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            if self._size is None or self._size > self.max_size:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another process has evicted the entry already
+                pass
+            total_size -= size
+        self._size = total_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+
+class TTLCache:
+    """A thread-safe in-memory cache whose entries expire after `ttl` seconds.
+
+    At most `max_size` entries are kept; if there are more, the least recently used ones are discarded. Concurrent
+    calls of `get_or_load` for the same missing key are merged, so that the value is only loaded once.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._loading.get(key)
+            if future is not None:
+                loading = False
+            else:
+                loading = True
+                future = self._loading[key] = Future()
+                generation = self._generation
+
+        if not loading:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            # a value loaded while the cache was invalidated might be out of date already
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, predicate=None):
+        # Remove all entries, or only those whose key satisfies the predicate.
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if predicate is None or predicate(key)]:
+                del self._entries[key]
+
+    def after_fork(self):
+        # In a child process created with fork, the lock might be held and values might be loaded by threads which
+        # only exist in the parent process.
+        self._lock = threading.Lock()
+        self._loading = {}
@@ -0,0 +1,248 @@
+"""The `salt-api` command.
+
+    salt-api submit DIRECTORY [--jobs N] [--state FILE] [--force]
+    salt-api download ITEM ... [--from-file FILE] [--output DIRECTORY] [--extract] [--jobs N]
+
+`submit` submits every proposal XML file and zip file in a directory tree, skipping files which haven't changed since
+their last successful submission. `download` downloads proposals (given by their proposal code) and blocks (given as
+`{proposal_code}:{block_name}`). Progress is printed as items finish, followed by a timing summary.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import as_completed, ThreadPoolExecutor
+
+from salt_api import files, metrics
+from salt_api.proposal_xml import rewrite_paths
+from salt_api.proposals import download, submit
+from salt_api.zipping import default_cache
+
+
+DEFAULT_JOBS = 4
+
+# the file recording the submitted files, relative to the submitted directory
+DEFAULT_STATE_FILE = '.salt-api-sync.json'
+
+SUBMITTED_EXTENSIONS = ('.xml', '.zip')
+
+
+class SyncState:
+    """A record of the files submitted successfully, stored as a JSON file.
+
+    For every file path the modification time, size and content digest at the time of the last successful
+    submission are recorded. For an XML file the digest covers the files it references, too. The state is thread-safe,
+    and it is saved after every change, so that an interrupted sync doesn't lose the files submitted already.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = files.JsonFile(path)
+        self._files = self._file.read()
+
+    def get(self, path):
+        with self._lock:
+            return self._files.get(path)
+
+    def set(self, path, mtime, size, digest):
+        with self._lock:
+            self._files[path] = dict(mtime=mtime, size=size, digest=digest)
+            self._file.write(self._files)
+
+
+class Progress:
+    """A metrics sink which reports every finished item and the throughput so far, and summarizes the timings."""
+
+    def __init__(self, total, out=None):
+        self.total = total
+        self.out = out or sys.stderr
+        self.collector = metrics.HistogramCollector()
+        self.counts = dict(done=0, skipped=0, failed=0)
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self._last = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, measurement):
+        self.collector(measurement)
+        self._last.measurement = measurement
+
+    def last_measurement(self):
+        # The measurement of the last operation finished in the calling thread.
+        measurement, self._last.measurement = getattr(self._last, 'measurement', None), None
+        return measurement
+
+    def report(self, name, status, measurement=None, message=None):
+        with self._lock:
+            self.counts[status] += 1
+            transferred = measurement.bytes_sent + measurement.bytes_received if measurement else 0
+            self.bytes += transferred
+            finished = sum(self.counts.values())
+            elapsed = time.perf_counter() - self.start
+            line = '[{finished}/{total}] {status} {name}'.format(finished=finished, total=self.total, status=status,
+                                                                 name=name)
+            if measurement and measurement.duration is not None:
+                line += ' ({size} in {seconds:.2f} s)'.format(size=format_size(transferred),
+                                                              seconds=measurement.duration)
+            if message:
+                line += ': ' + message
+            line += ', {rate}/s overall'.format(rate=format_size(self.bytes / elapsed if elapsed else 0))
+            print(line, file=self.out, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        lines = ['{done} done, {skipped} unchanged, {failed} failed in {seconds:.2f} s ({size}, {rate}/s)'.format(
+            seconds=elapsed, size=format_size(self.bytes), rate=format_size(self.bytes / elapsed if elapsed else 0),
+            **self.counts)]
+        for name, histogram in sorted(self.collector.summary()['histograms'].items()):
+            if name.endswith(('.bytes_sent', '.bytes_received', '.retries')):
+                continue
+            lines.append('  {name}: n={count} mean={mean:.3f} s p50<={p50:.3f} s p90<={p90:.3f} s '
+                         'max={max:.3f} s'.format(name=name, **histogram))
+        return '\n'.join(lines)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{size:.1f} {unit}'.format(size=size, unit=unit)
+        size /= 1024
+
+
+def find_submissions(directory, exclude=()):
+    # The XML and zip files in a directory tree, in sorted order. Hidden files and directories are ignored.
+    exclude = {os.path.abspath(path) for path in exclude}
+    paths = []
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(filenames):
+            path = os.path.join(root, name)
+            if (not name.startswith('.') and name.lower().endswith(SUBMITTED_EXTENSIONS)
+                    and os.path.abspath(path) not in exclude):
+                paths.append(path)
+    return paths
+
+
+def file_digest(path):
+    # Zip files are hashed as they are. For XML files the digest of the rewritten XML is used, which includes the
+    # digests of the referenced files.
+    with open(path, 'rb') as f:
+        if files.is_zip(f):
+            return files.file_digest(f)
+        with rewrite_paths(f, os.path.dirname(os.path.abspath(path)), default_cache()) as rewritten:
+            return rewritten.digest
+
+
+def submit_file(path, state, force=False):
+    """Submit a file unless it is unchanged since its last successful submission. Return whether it was submitted.
+
+    A zip file is unchanged if its modification time and size are the same as recorded in the state. An XML file may
+    reference files which have changed, so its digest is compared in any case.
+    """
+
+    key = os.path.abspath(path)
+    st = os.stat(path)
+    previous = None if force else state.get(key)
+    is_xml = path.lower().endswith('.xml')
+    if previous and not is_xml and previous['mtime'] == st.st_mtime and previous['size'] == st.st_size:
+        return False
+    digest = file_digest(path)
+    if previous and previous['digest'] == digest:
+        state.set(key, st.st_mtime, st.st_size, digest)
+        return False
+
+    submit(path)
+    state.set(key, st.st_mtime, st.st_size, digest)
+    return True
+
+
+def download_item(item, output, extract=False):
+    """Download a proposal (`{proposal_code}`) or block (`{proposal_code}:{block_name}`) into a directory.
+
+    The content is saved as `{proposal_code}.zip` or `{proposal_code}-{block_name}.zip`, or it is extracted into a
+    directory with the same name (without extension) if `extract` is true. The path of the file or directory is
+    returned.
+    """
+
+    proposal_code, _, block_name = item.partition(':')
+    name = proposal_code + ('-' + re.sub(r'[^\w.-]+', '_', block_name) if block_name else '')
+    content_type = 'block' if block_name else 'proposal'
+    if extract:
+        return download(proposal_code, content_type, block_name or None, extract_to=os.path.join(output, name))
+    path = os.path.join(output, name + '.zip')
+    shutil.move(download(proposal_code, content_type, block_name or None), path)
+    return path
+
+
+def run(func, items, jobs, progress, names):
+    # Call the function for every item on a thread pool, reporting every item as it finishes. The function returns
+    # whether the item was processed (rather than skipped).
+    def call(item):
+        try:
+            status = 'done' if func(item) else 'skipped'
+            return status, progress.last_measurement(), None
+        except Exception as e:
+            return 'failed', progress.last_measurement(), str(e) or type(e).__name__
+
+    metrics.add_sink(progress)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(call, item): item for item in items}
+            for future in as_completed(futures):
+                status, measurement, message = future.result()
+                progress.report(names(futures[future]), status, measurement, message)
+    finally:
+        metrics.remove_sink(progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='salt-api', description='Submit and download SALT proposals.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    submit_parser = subparsers.add_parser('submit', help='submit the proposal XML and zip files in a directory tree')
+    submit_parser.add_argument('directory', help='directory to search for XML and zip files')
+    submit_parser.add_argument('--state', default=None,
+                               help='file recording the submitted files (default: {name} in the directory)'.format(
+                                   name=DEFAULT_STATE_FILE))
+    submit_parser.add_argument('--force', action='store_true', help='submit unchanged files as well')
+
+    download_parser = subparsers.add_parser('download', help='download proposals and blocks')
+    download_parser.add_argument('items', nargs='*', help='proposal codes, or {proposal_code}:{block_name} for blocks')
+    download_parser.add_argument('--from-file', default=None, help='file listing the items to download, one per line')
+    download_parser.add_argument('--output', default='.', help='directory for the downloaded files')
+    download_parser.add_argument('--extract', action='store_true', help='extract the downloaded zip files')
+
+    for subparser in (submit_parser, download_parser):
+        subparser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS, help='number of parallel jobs')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        state_path = args.state or os.path.join(args.directory, DEFAULT_STATE_FILE)
+        state = SyncState(state_path)
+        paths = find_submissions(args.directory, exclude=[state_path])
+        progress = Progress(len(paths))
+        run(lambda path: submit_file(path, state, args.force), paths, args.jobs, progress,
+            lambda path: os.path.relpath(path, args.directory))
+    else:
+        items = list(args.items)
+        if args.from_file:
+            with open(args.from_file) as f:
+                items.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith('#'))
+        os.makedirs(args.output, exist_ok=True)
+        progress = Progress(len(items))
+        run(lambda item: download_item(item, args.output, args.extract) is not None, items, args.jobs, progress,
+            lambda item: item)
+
+    print(progress.summary(), file=progress.out)
+    return 1 if progress.counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import os
+import zipfile
+import zlib
+
+from salt_api.zipping import COMPRESSED_EXTENSIONS, DEFAULT_MIN_SAVING, SAMPLE_SIZE
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+# content codings for request bodies
+ENCODINGS = ('identity', 'gzip', 'zstd', 'auto')
+
+GZIP_LEVEL = 6
+
+ZSTD_LEVEL = 3
+
+
+def request_encoding(f, encoding=None, min_saving=None):
+    """Return the content coding to use for sending the rest of a file as request body, or None for no coding.
+
+    Unless it is passed, the coding is read from the environment variable `SALT_API_REQUEST_ENCODING`, which may be
+    'identity' (the default, no compression), 'gzip', 'zstd' or 'auto' (zstd if the zstandard package is installed,
+    and gzip otherwise). 'zstd' falls back to gzip if zstandard isn't installed.
+
+    No coding is used if compressing the body would reduce its size by less than the fraction `min_saving`. For a zip
+    file, only its uncompressed members can shrink, so that a zip file whose members are compressed already is sent
+    as is. A sample of the largest uncompressed member (or of the body, if it isn't a zip file) is compressed to
+    estimate the saving.
+    """
+
+    encoding = (encoding or os.environ.get('SALT_API_REQUEST_ENCODING') or 'identity').lower()
+    if encoding not in ENCODINGS:
+        raise ValueError('The request encoding must be one of {encodings}.'.format(encodings=', '.join(ENCODINGS)))
+    if encoding == 'identity':
+        return None
+    if encoding in ('auto', 'zstd'):
+        encoding = 'zstd' if zstandard else 'gzip'
+    min_saving = min_saving if min_saving is not None else DEFAULT_MIN_SAVING
+
+    position = f.tell()
+    try:
+        return encoding if _worth_compressing(f, position, min_saving) else None
+    finally:
+        f.seek(position)
+
+
+def compressor(encoding):
+    """Return a compressor object (with `compress` and `flush` methods) for a content coding ('gzip' or 'zstd')."""
+
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError('Unsupported encoding: {encoding}'.format(encoding=encoding))
+
+
+def compress(chunks, encoding):
+    """Compress an iterable of byte chunks with a content coding, as a generator of chunks."""
+
+    c = compressor(encoding)
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    yield c.flush()
+
+
+def accept_encoding():
+    """Return the value for Accept-Encoding headers.
+
+    This is the value of the environment variable `SALT_API_ACCEPT_ENCODING`, or otherwise all the codings which
+    urllib3 can decode (gzip and deflate, plus br and zstd if the respective packages are installed).
+    """
+
+    value = os.environ.get('SALT_API_ACCEPT_ENCODING')
+    if value:
+        return value
+    from urllib3.util.request import ACCEPT_ENCODING
+    return ACCEPT_ENCODING
+
+
+def _worth_compressing(f, position, min_saving):
+    size = f.seek(0, os.SEEK_END) - position
+    if size <= 0:
+        return False
+    f.seek(position)
+
+    # the bytes which might shrink
+    compressible_size = size
+    try:
+        with zipfile.ZipFile(f) as zf:
+            candidates = [info for info in zf.infolist()
+                          if info.compress_type == zipfile.ZIP_STORED and not info.is_dir()
+                          and os.path.splitext(info.filename)[1].lower() not in COMPRESSED_EXTENSIONS]
+            compressible_size = sum(info.file_size for info in candidates)
+            if not candidates or compressible_size < size * min_saving:
+                return False
+            largest = max(candidates, key=lambda info: info.file_size)
+            with zf.open(largest) as member:
+                sample = member.read(SAMPLE_SIZE)
+    except zipfile.BadZipFile:
+        f.seek(position)
+        sample = f.read(SAMPLE_SIZE)
+
+    if not sample:
+        return False
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressible_size * (1 - compressed_size / len(sample)) >= size * min_saving
@@ -0,0 +1,112 @@
+"""Helpers for the files passed to the functions submitting content."""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+
+from salt_api.http import DEFAULT_CHUNK_SIZE
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+@contextlib.contextmanager
+def open_binary(filename):
+    """Open a file path for reading in binary mode. File objects passed instead of a path are used (and left open)."""
+
+    if is_path(filename):
+        with open(filename, 'rb') as f:
+            yield f
+    else:
+        yield filename
+
+
+def is_zip(f):
+    # The file position is left unchanged by this and the following functions.
+    position = f.tell()
+    try:
+        return zipfile.is_zipfile(f)
+    finally:
+        f.seek(position)
+
+
+def is_xml(f):
+    position = f.tell()
+    try:
+        start = f.read(1024).lstrip(b'\xef\xbb\xbf \t\r\n')
+        return start.startswith(b'<')
+    finally:
+        f.seek(position)
+
+
+def file_digest(f):
+    """Return the SHA-256 digest (as a hex string) of the rest of a file."""
+
+    position = f.tell()
+    digest = hashlib.sha256()
+    for chunk in read_in_chunks(f, DEFAULT_CHUNK_SIZE):
+        digest.update(chunk)
+    f.seek(position)
+    return digest.hexdigest()
+
+
+def is_path(filename):
+    return isinstance(filename, (str, bytes, os.PathLike))
+
+
+def read_in_chunks(f, chunk_size):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class JsonFile:
+    """A JSON file which may be shared by several threads and (on POSIX systems) processes.
+
+    Changes should be made while holding the lock of `locked`, which is a thread lock combined with an exclusive lock
+    on the file `{path}.lock`. `write` replaces the file atomically with a file which is only readable by its owner.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        # A missing or corrupt file is read as an empty dictionary.
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self, content):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.{name}-'.format(name=os.path.basename(self.path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
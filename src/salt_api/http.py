@@ -0,0 +1,46 @@
+"""Settings and helpers shared by the modules making requests to the SALT API."""
+
+import os
+
+from salt_api import SaltApiException
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_MAX_RESUMES = 5
+
+
+def proposals_base_url():
+    """Return the base URL of the SALT API, as given by the environment variable `SALT_API_PROPOSALS_BASE_URL`."""
+
+    return os.environ.get('SALT_API_PROPOSALS_BASE_URL', 'http://saltapi.salt.ac.za')
+
+
+def default_chunk_size():
+    """Return the chunk size for sending and receiving content, as given by `SALT_API_CHUNK_SIZE`."""
+
+    return int(os.environ.get('SALT_API_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+
+def default_max_resumes():
+    """Return the maximum number of times a download is resumed, as given by `SALT_API_DOWNLOAD_RESUMES`."""
+
+    return int(os.environ.get('SALT_API_DOWNLOAD_RESUMES', DEFAULT_MAX_RESUMES))
+
+
+def check_response(response):
+    """Raise a `SaltApiException` if a requests response has an error status code.
+
+    If the response is a JSON object with an `error` field, its value is used as the error message.
+    """
+
+    if response.ok:
+        return
+
+    try:
+        message = response.json()['error']
+    except (ValueError, KeyError, TypeError):
+        message = response.text or 'The server responded with status code {status_code}.'.format(
+            status_code=response.status_code)
+
+    raise SaltApiException(message, status_code=response.status_code)
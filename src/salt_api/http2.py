@@ -0,0 +1,214 @@
+import os
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+from requests.adapters import BaseAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ConnectTimeout, ReadTimeout
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+from salt_api.adapters import make_adapter
+
+
+# headers which belong to an HTTP/1.1 connection and must not be sent over HTTP/2
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+# file-like request bodies are read in chunks of this size
+BODY_CHUNK_SIZE = 1024 * 1024
+
+
+class HTTP2Adapter(BaseAdapter):
+    """A transport adapter for requests sessions, which multiplexes the requests to a host over one HTTP/2 connection.
+
+    For HTTPS requests the protocol is negotiated with the server, so that HTTP/1.1 is used if the server doesn't
+    support HTTP/2. Plain HTTP requests are sent with HTTP/1.1 by the `fallback` adapter (by default an adapter created
+    with `make_adapter`), unless `prior_knowledge` is true. In this case HTTP/2 is used without negotiation, provided
+    that the server answers a probe request with HTTP/2; otherwise HTTP/1.1 is used for the host. Requests with a
+    client certificate or via a proxy are sent by the fallback adapter as well.
+
+    Authentication is left to the session, so that it works as with any other adapter. The adapter requires the httpx
+    package with HTTP/2 support (the `http2` extra).
+    """
+
+    def __init__(self, fallback=None, prior_knowledge=False, max_connections=None, timeout=None):
+        super().__init__()
+        self.fallback = fallback or make_adapter(timeout=timeout)
+        self.timeout = timeout if timeout is not None else getattr(self.fallback, 'timeout', None)
+        self.prior_knowledge = prior_knowledge
+        self.max_connections = max_connections
+        self._clients = {}
+        self._protocols = {}
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        timeout = timeout if timeout is not None else self.timeout
+        client = self._client_for(request.url, verify, cert, proxies, timeout)
+        if client is None:
+            return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                      proxies=proxies)
+
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS]
+        try:
+            r = client.send(client.build_request(request.method, request.url, headers=headers,
+                                                 content=_content(request.body), timeout=_httpx_timeout(timeout)),
+                            stream=True)
+        except httpx.ConnectTimeout as e:
+            raise ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=request)
+
+        response = self.build_response(request, r)
+        if not stream:
+            response.content
+        return response
+
+    def build_response(self, request, r):
+        response = Response()
+        response.status_code = r.status_code
+        response.headers = CaseInsensitiveDict()
+        for name, value in r.headers.multi_items():
+            response.headers[name] = response.headers[name] + ', ' + value if name in response.headers else value
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _ResponseStream(r, request)
+        response.reason = r.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def http_version(self, url):
+        """Return the protocol used for a URL ('HTTP/2' or 'HTTP/1.1'), if it is known already, or None."""
+
+        parts = urlsplit(url)
+        if parts.scheme == 'http' and not self.prior_knowledge:
+            return 'HTTP/1.1'
+        return self._protocols.get(_origin(parts))
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+        self.fallback.close()
+
+    def _client_for(self, url, verify, cert, proxies, timeout):
+        # The httpx client for a request, or None if the fallback adapter should send it.
+        if cert or select_proxy(url, proxies or {}):
+            return None
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            return self._client(verify, http1=True)
+        if parts.scheme != 'http' or not self.prior_knowledge:
+            return None
+
+        origin = _origin(parts)
+        client = self._client(True, http1=False)
+        protocol = self._protocols.get(origin)
+        if protocol is None:
+            # concurrent first requests to a host wait for a single probe
+            with self._probe_lock:
+                protocol = self._protocols.get(origin)
+                if protocol is None:
+                    protocol = self._protocols[origin] = self._probe(client, origin, timeout)
+        return client if protocol == 'HTTP/2' else None
+
+    def _client(self, verify, http1):
+        # Clients are created when they are first needed, one for each verify setting and for cleartext HTTP/2.
+        key = (verify, http1)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                limits = httpx.Limits(max_connections=self.max_connections)
+                client = self._clients[key] = httpx.Client(http1=http1, http2=True, verify=_ssl_verify(verify),
+                                                           limits=limits, trust_env=False)
+            return client
+
+    def _probe(self, client, origin, timeout):
+        # An HTTP/1.1 server answers the HTTP/2 connection preface with an HTTP/1.1 response or closes the connection,
+        # both of which are protocol errors for the client. Any HTTP/2 response (even an error) shows that the server
+        # supports HTTP/2. A server which can't be reached is probed again with the next request.
+        try:
+            client.request('OPTIONS', origin + '/', timeout=_httpx_timeout(timeout)).close()
+        except httpx.RemoteProtocolError:
+            return 'HTTP/1.1'
+        except httpx.TransportError as e:
+            raise ConnectionError(e)
+        return 'HTTP/2'
+
+
+class _ResponseStream:
+    # The raw attribute of a requests response for an httpx response. Content codings are decoded, as urllib3 does
+    # for requests' own responses, and httpx exceptions are replaced with the requests exceptions which
+    # Response.iter_content would raise for urllib3.
+
+    def __init__(self, response, request):
+        self._response = response
+        self._request = request
+        self._chunks = None
+        self._buffer = b''
+        self.http_version = response.http_version
+
+    def stream(self, amt=None, decode_content=True):
+        try:
+            yield from self._response.iter_bytes(amt)
+        except httpx.TimeoutException as e:
+            raise ConnectionError(e, request=self._request)
+        except httpx.TransportError as e:
+            raise ChunkedEncodingError(e, request=self._request)
+
+    def read(self, amt=None, decode_content=True):
+        if self._chunks is None:
+            self._chunks = self.stream()
+        while amt is None or len(self._buffer) < amt:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        size = len(self._buffer) if amt is None else amt
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+
+def _content(body):
+    # httpx accepts bytes and iterables of bytes as request content.
+    if body is None or isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if hasattr(body, 'read'):
+        return iter(lambda: body.read(BODY_CHUNK_SIZE), b'')
+    return body
+
+
+def _httpx_timeout(timeout):
+    # requests timeouts are a number or a (connect, read) tuple
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _ssl_verify(verify):
+    # requests allows a path to a CA bundle file or directory
+    if isinstance(verify, str):
+        if os.path.isdir(verify):
+            return ssl.create_default_context(capath=verify)
+        return ssl.create_default_context(cafile=verify)
+    return verify
+
+
+def _origin(parts):
+    return '{scheme}://{netloc}'.format(scheme=parts.scheme, netloc=parts.netloc)
@@ -0,0 +1,310 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from salt_api import metrics
+
+
+DEFAULT_INITIAL_CONCURRENCY = 4
+
+DEFAULT_MIN_CONCURRENCY = 1
+
+# the window shrinks by this factor when the server is overloaded
+DEFAULT_DECREASE_FACTOR = 0.5
+
+# status codes showing that the server is overloaded
+THROTTLE_STATUS_CODES = (429, 502, 503, 504)
+
+# asyncio operations waiting for a slot of the concurrency window check for a free slot at this interval (in seconds)
+SLOT_POLL_INTERVAL = 0.01
+
+_limiter = None
+
+_limiter_lock = threading.Lock()
+
+_in_operation = contextvars.ContextVar('salt_api_in_operation', default=False)
+
+_no_op = contextlib.nullcontext()
+
+
+class TokenBucket:
+    """A token bucket limiting the rate of requests.
+
+    The bucket holds up to `burst` tokens (by default one second's worth, but at least one) and is refilled at `rate`
+    tokens per second. Every request takes a token, waiting until one is available. The bucket is thread-safe, and
+    waiting threads are served in the order in which they arrive.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def reserve(self):
+        # A token is reserved immediately, so that the bucket may go into debt, and the number of seconds the caller
+        # has to wait until the debt has been paid off is returned.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+class AdaptiveConcurrency:
+    """A concurrency window adjusted with additive increase and multiplicative decrease (AIMD).
+
+    At most `window` operations run at the same time. Every successful request increases the window by
+    1 / window, i.e. by about one per window's worth of requests, up to `maximum`. A throttled or failed request
+    multiplies the window by `decrease_factor`, down to `minimum`. As requests which were already running when the
+    window was decreased reflect the load before the decrease, they don't decrease it again.
+    """
+
+    def __init__(self, maximum, minimum=DEFAULT_MIN_CONCURRENCY, initial=None,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_factor = decrease_factor
+        self.window = float(initial if initial is not None else min(DEFAULT_INITIAL_CONCURRENCY, maximum))
+        self.in_flight = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        # Take a slot without waiting. Returns whether a slot was free.
+        with self._condition:
+            if self.in_flight >= int(self.window):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.window = min(self.maximum, self.window + 1 / self.window)
+            self._condition.notify_all()
+
+    def on_throttle(self, started_at):
+        # started_at is the time.monotonic() value at which the throttled request was sent.
+        with self._condition:
+            if started_at < self._decreased_at:
+                return
+            self.window = max(self.minimum, self.window * self.decrease_factor)
+            self._decreased_at = time.monotonic()
+
+    def after_fork(self):
+        # The operations of other threads don't exist in a child process.
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+
+class ClientLimiter:
+    """A limiter for all the submissions and downloads of a process (in the `proposals` and `aio` modules).
+
+    Every submission or download holds a slot of the `AdaptiveConcurrency` window (if `concurrency` is given) while
+    it runs, and every request it makes takes a token from the `TokenBucket` (if `bucket` is given). The responses
+    adjust the window: status codes in `THROTTLE_STATUS_CODES` and connection errors decrease it, and other responses
+    below 500 increase it. Threads and asyncio tasks share the bucket and the window; as a task can't wait for the
+    window's condition without blocking its event loop, it checks for a free slot every `SLOT_POLL_INTERVAL` seconds.
+    """
+
+    def __init__(self, bucket=None, concurrency=None):
+        self.bucket = bucket
+        self.concurrency = concurrency
+
+    @contextlib.contextmanager
+    def operation(self):
+        # Operations started within an operation (such as a download made by download_archive) don't take another
+        # slot, as they might wait for their own caller's slot otherwise.
+        if self.concurrency is None or _in_operation.get():
+            yield
+            return
+        with metrics.phase('queue'):
+            self.concurrency.acquire()
+        token = _in_operation.set(True)
+        try:
+            yield
+        finally:
+            _in_operation.reset(token)
+            self.concurrency.release()
+
+    @contextlib.asynccontextmanager
+    async def async_operation(self):
+        # The asyncio counterpart of operation. asyncio is imported lazily, as it takes a while to import.
+        import asyncio
+        if self.concurrency is None or _in_operation.get():
+            yield
+            return
+        with metrics.phase('queue'):
+            while not self.concurrency.try_acquire():
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+        token = _in_operation.set(True)
+        try:
+            yield
+        finally:
+            _in_operation.reset(token)
+            self.concurrency.release()
+
+    def send(self, request):
+        """Make a request (by calling the function `request`), and adjust the window according to its outcome."""
+
+        if self.bucket is not None:
+            with metrics.phase('queue'):
+                self.bucket.acquire()
+        started_at = time.monotonic()
+        try:
+            response = request()
+        except Exception as e:
+            if _is_connection_error(e):
+                self._adjust(started_at, None)
+            raise
+        self._adjust(started_at, response.status_code)
+        return response
+
+    async def send_async(self, request, connection_errors=()):
+        """Like `send`, for a coroutine function `request` returning an aiohttp response.
+
+        Exceptions in `connection_errors` decrease the window like connection errors of requests.
+        """
+
+        import asyncio
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+            if delay:
+                with metrics.phase('queue'):
+                    await asyncio.sleep(delay)
+        started_at = time.monotonic()
+        try:
+            response = await request()
+        except connection_errors:
+            self._adjust(started_at, None)
+            raise
+        self._adjust(started_at, response.status)
+        return response
+
+    def _adjust(self, started_at, status_code):
+        # A status code of None stands for a connection error.
+        if self.concurrency is None:
+            return
+        if status_code is None or status_code in THROTTLE_STATUS_CODES:
+            self.concurrency.on_throttle(started_at)
+        elif status_code < 500:
+            self.concurrency.on_success()
+
+    def after_fork(self):
+        for part in (self.bucket, self.concurrency):
+            if part is not None:
+                part.after_fork()
+
+
+def get_limiter():
+    """Return the limiter shared by all submissions and downloads, or None if requests aren't limited.
+
+    Unless a limiter has been set with `set_limiter`, it is defined by environment variables. `SALT_API_RATE_LIMIT`
+    is the maximum number of requests per second, with bursts of up to `SALT_API_RATE_BURST` requests.
+    `SALT_API_MAX_CONCURRENCY` is the maximum size of the adaptive concurrency window, and `SALT_API_MIN_CONCURRENCY`
+    its minimum size (1 by default). Requests aren't limited if neither `SALT_API_RATE_LIMIT` nor
+    `SALT_API_MAX_CONCURRENCY` is set.
+    """
+
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = _default_limiter() or False
+    return _limiter or None
+
+
+def set_limiter(limiter):
+    """Set the limiter shared by all submissions and downloads. If None is passed, requests aren't limited."""
+
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter or False
+
+
+def operation():
+    # A context manager holding a concurrency slot of the shared limiter, if there is one.
+    limiter = get_limiter()
+    return limiter.operation() if limiter else _no_op
+
+
+def send(request):
+    # Make a request through the shared limiter, if there is one.
+    limiter = get_limiter()
+    return limiter.send(request) if limiter else request()
+
+
+def async_operation():
+    # The asyncio counterpart of operation.
+    limiter = get_limiter()
+    return limiter.async_operation() if limiter else _unlimited()
+
+
+async def send_async(request, connection_errors=()):
+    # Make a request with an aiohttp session through the shared limiter, if there is one.
+    limiter = get_limiter()
+    if limiter:
+        return await limiter.send_async(request, connection_errors)
+    return await request()
+
+
+@contextlib.asynccontextmanager
+async def _unlimited():
+    # contextlib.nullcontext only supports async with from Python 3.10 on
+    yield
+
+
+def _default_limiter():
+    rate = os.environ.get('SALT_API_RATE_LIMIT')
+    maximum = os.environ.get('SALT_API_MAX_CONCURRENCY')
+    if not rate and not maximum:
+        return None
+    bucket = None
+    if rate:
+        burst = os.environ.get('SALT_API_RATE_BURST')
+        bucket = TokenBucket(float(rate), float(burst) if burst else None)
+    concurrency = None
+    if maximum:
+        concurrency = AdaptiveConcurrency(int(maximum),
+                                          int(os.environ.get('SALT_API_MIN_CONCURRENCY', DEFAULT_MIN_CONCURRENCY)))
+    return ClientLimiter(bucket, concurrency)
+
+
+def _is_connection_error(e):
+    import requests
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def _reset_after_fork():
+    # The limiter's locks might have been held by threads which don't exist in the child process.
+    global _limiter_lock
+    _limiter_lock = threading.Lock()
+    if _limiter:
+        _limiter.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
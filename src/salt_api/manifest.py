@@ -0,0 +1,51 @@
+import os
+
+from salt_api.files import JsonFile
+
+
+class Manifest:
+    """A record of the content last submitted successfully for each proposal.
+
+    The manifest is stored as a JSON file. For each proposal code it contains the digest of the submitted content,
+    the digest of the content without its blocks ("shell") and a dictionary of block names and block digests.
+
+    All changes are made while holding a lock, and the file is replaced atomically, so that the manifest may be shared
+    by several threads and (on POSIX systems) processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = JsonFile(path)
+
+    def get(self, proposal_code):
+        with self._file.locked():
+            return self._file.read().get(proposal_code)
+
+    def set(self, proposal_code, digest, shell=None, blocks=None):
+        with self._file.locked():
+            content = self._file.read()
+            content[proposal_code] = dict(digest=digest, shell=shell, blocks=blocks or {})
+            self._file.write(content)
+
+    def set_block(self, proposal_code, name, digest):
+        # Recording a block invalidates the digest of the whole content.
+        with self._file.locked():
+            content = self._file.read()
+            entry = content.setdefault(proposal_code, dict(digest=None, shell=None, blocks={}))
+            entry['digest'] = None
+            entry['blocks'][name] = digest
+            self._file.write(content)
+
+    def remove(self, proposal_code):
+        with self._file.locked():
+            content = self._file.read()
+            if content.pop(proposal_code, None) is not None:
+                self._file.write(content)
+
+
+def default_manifest():
+    """Return the manifest whose path is given by the environment variable `SALT_API_SUBMIT_MANIFEST`, or None if
+    this variable isn't set."""
+
+    path = os.environ.get('SALT_API_SUBMIT_MANIFEST')
+    return Manifest(path) if path else None
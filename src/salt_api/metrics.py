@@ -0,0 +1,226 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from collections import Counter
+
+
+# upper bounds of the histogram buckets for durations (in seconds)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500)
+
+# upper bounds of the histogram buckets for byte counts
+SIZE_BUCKETS = tuple(4 ** i * 1024 for i in range(13))
+
+# upper bounds of the histogram buckets for retry counts
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+_sinks = []
+
+_sinks_lock = threading.Lock()
+
+_current = contextvars.ContextVar('salt_api_measurement', default=None)
+
+_no_op = contextlib.nullcontext()
+
+
+class Measurement:
+    """The metrics of a single submit or download.
+
+    `operation` is the name of the operation (such as 'submit'), `duration` its total duration in seconds and
+    `phases` a dictionary of the seconds spent in each phase, such as 'scan' (scanning XML), 'zip' (building the zip
+    file), 'upload' (sending the request body), 'wait' (waiting for the server's response), 'transfer' (receiving the
+    response body) and 'backoff' (waiting before retrying). `bytes_sent` and `bytes_received` are the numbers of body
+    bytes sent and received, `retries` and `resumes` the numbers of retried requests and resumed downloads, and
+    `status_code` the status code of the last response. If the operation failed, `error` is the exception raised.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.duration = None
+        self.phases = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.resumes = 0
+        self.status_code = None
+        self.error = None
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+class _Recorder:
+    def __init__(self, operation):
+        self.measurement = Measurement(operation)
+
+    def __enter__(self):
+        self._token = _current.set(self.measurement)
+        self._start = time.perf_counter()
+        return self.measurement
+
+    def __exit__(self, exc_type, exc, tb):
+        self.measurement.duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        if exc is not None:
+            self.measurement.error = exc
+            if self.measurement.status_code is None:
+                self.measurement.status_code = getattr(exc, 'status_code', None)
+        for sink in list(_sinks):
+            sink(self.measurement)
+
+
+class _PhaseTimer:
+    def __init__(self, measurement, name):
+        self.measurement = measurement
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.measurement.add_phase(self.name, time.perf_counter() - self._start)
+
+
+def add_sink(sink):
+    """Register a metrics sink.
+
+    A sink is a callable, which is called with a `Measurement` after every submit and download.
+    """
+
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+def measure(operation):
+    # Measure the operation, unless no sink has been registered or the operation is part of an operation measured
+    # already.
+    if not _sinks or _current.get() is not None:
+        return _no_op
+    return _Recorder(operation)
+
+
+def current():
+    # The measurement of the running operation, or None if it isn't measured.
+    return _current.get()
+
+
+def phase(name):
+    measurement = _current.get()
+    if measurement is None:
+        return _no_op
+    return _PhaseTimer(measurement, name)
+
+
+def add_retry():
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.retries += 1
+
+
+def set_status(status_code):
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.status_code = status_code
+
+
+class Histogram:
+    """A histogram with fixed buckets.
+
+    `buckets` are the upper bounds of the buckets, in ascending order. Values larger than the last bound are counted
+    in an additional overflow bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        # The upper bound of the bucket containing the percentile (or the maximum, for the overflow bucket).
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return dict(count=self.count,
+                    total=self.total,
+                    mean=self.total / self.count if self.count else None,
+                    p50=self.percentile(0.5),
+                    p90=self.percentile(0.9),
+                    p99=self.percentile(0.99),
+                    max=self.max)
+
+
+class HistogramCollector:
+    """A metrics sink aggregating the measurements in histograms in memory.
+
+    There are histograms named `{operation}.duration`, `{operation}.{phase}`, `{operation}.bytes_sent`,
+    `{operation}.bytes_received` and `{operation}.retries`, and the status codes and errors are counted for every
+    operation. The collector is thread-safe.
+
+    Usage:
+
+        collector = HistogramCollector()
+        add_sink(collector)
+        ...
+        print(collector.summary())
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.status_codes = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, measurement):
+        operation = measurement.operation
+        with self._lock:
+            self._observe(operation + '.duration', measurement.duration, DURATION_BUCKETS)
+            for name, seconds in measurement.phases.items():
+                self._observe('{operation}.{phase}'.format(operation=operation, phase=name), seconds,
+                              DURATION_BUCKETS)
+            self._observe(operation + '.bytes_sent', measurement.bytes_sent, SIZE_BUCKETS)
+            self._observe(operation + '.bytes_received', measurement.bytes_received, SIZE_BUCKETS)
+            self._observe(operation + '.retries', measurement.retries, COUNT_BUCKETS)
+            self.status_codes[(operation, measurement.status_code)] += 1
+            if measurement.error is not None:
+                self.errors[(operation, type(measurement.error).__name__)] += 1
+
+    def summary(self):
+        with self._lock:
+            return dict(histograms={name: histogram.summary() for name, histogram in self.histograms.items()},
+                        status_codes={'{operation} {status}'.format(operation=operation, status=status): count
+                                      for (operation, status), count in self.status_codes.items()},
+                        errors={'{operation} {error}'.format(operation=operation, error=error): count
+                                for (operation, error), count in self.errors.items()})
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.status_codes.clear()
+            self.errors.clear()
+
+    def _observe(self, name, value, buckets):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(buckets)
+        self.histograms[name].observe(value)
@@ -0,0 +1,307 @@
+import hashlib
+import io
+import os
+import tempfile
+import xml.sax
+from xml.sax.handler import ContentHandler, feature_external_ges, feature_namespaces, property_lexical_handler
+from xml.sax.saxutils import XMLGenerator
+
+from salt_api.zipping import content_digest
+
+
+# Path elements with these values don't refer to a file
+AUTO_GENERATED_PATHS = ('auto-generated', 'automatic')
+
+# rewritten XML is kept in memory up to this size before it is spilled to a temporary file
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class Block:
+    def __init__(self, name, digest, arcnames, xml_file):
+        self.name = name
+        self.digest = digest
+        self.arcnames = arcnames
+        self.xml_file = xml_file
+
+
+class RewrittenXml:
+    """The result of `rewrite_paths`.
+
+    `root_name` is the local name of the root element, `xml_file` a binary file containing the rewritten XML
+    (positioned at its start), and `files` a list of (path, arcname) tuples for the referenced files. `digest` is the
+    digest of the rewritten XML, and `shell_digest` that of the XML outside the top-level Block elements.
+
+    If blocks were split off, `blocks` is a dictionary of block names and `Block` objects, each with the digest of the
+    block, the arcnames it references and a file with the block as standalone XML document. It is empty if blocks
+    weren't split off or if a top-level block has no (unique) name.
+    """
+
+    def __init__(self, root_name, xml_file, files, digest, shell_digest, blocks):
+        self.root_name = root_name
+        self.xml_file = xml_file
+        self.files = files
+        self.digest = digest
+        self.shell_digest = shell_digest
+        self.blocks = blocks
+
+    def close(self):
+        self.xml_file.close()
+        for block in self.blocks.values():
+            block.xml_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def rewrite_paths(xml_file, parent_dir=None, cache=None, split_blocks=False):
+    """Replace the file paths in the Path elements of proposal XML with paths of the form `Included/{digest}.{ext}`.
+
+    The XML is parsed and rewritten in a single streaming pass, so that only the ancestors of the current element are
+    held in memory, however large the XML is. Relative paths are relative to `parent_dir`. If any of the referenced
+    files doesn't exist, a FileNotFoundError listing all of the missing files is raised.
+
+    Apart from the Path text, the rewritten XML has the same elements, attributes, text, comments and processing
+    instructions as the original. Its serialization may differ in ways which don't change the content: CDATA sections
+    are written as escaped text, empty elements get an end tag, and a DOCTYPE declaration is dropped.
+
+    If `split_blocks` is true, every top-level Block element is written to a separate XML document as well.
+
+    A `RewrittenXml` object is returned, which should be closed (or used as a context manager) once it isn't needed
+    any longer.
+    """
+
+    handler = _PathRewriter(parent_dir, cache, split_blocks)
+    parser = xml.sax.make_parser()
+    parser.setFeature(feature_namespaces, True)
+    parser.setFeature(feature_external_ges, False)
+    parser.setContentHandler(handler)
+    parser.setProperty(property_lexical_handler, handler)
+    try:
+        parser.parse(xml_file)
+        if handler.missing:
+            raise FileNotFoundError('The following files referenced in the XML do not exist: {files}'.format(
+                files=', '.join(handler.missing)))
+    except BaseException:
+        handler.close()
+        raise
+
+    return handler.result()
+
+
+class _DigestWriter(io.TextIOBase):
+    # A text stream writing UTF-8 to a binary file and updating the digests which are active.
+
+    def __init__(self, out, *digests):
+        self.out = out
+        self.digests = list(digests)
+
+    def write(self, s):
+        data = s.encode('utf-8')
+        self.out.write(data)
+        for digest in self.digests:
+            digest.update(data)
+        return len(s)
+
+
+class _BlockWriter:
+    def __init__(self, namespaces):
+        self.xml_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.digest = hashlib.sha256()
+        self.writer = _DigestWriter(self.xml_file, self.digest)
+        self.generator = XMLGenerator(self.writer, 'utf-8')
+        self.namespaces = namespaces
+        self.name = None
+        self.arcnames = set()
+        self.generator.startDocument()
+        for prefix, uri in namespaces:
+            self.generator.startPrefixMapping(prefix, uri)
+
+    def end(self):
+        for prefix, uri in reversed(self.namespaces):
+            self.generator.endPrefixMapping(prefix)
+        self.generator.endDocument()
+        self.xml_file.seek(0)
+        return Block(self.name, self.digest.hexdigest(), self.arcnames, self.xml_file)
+
+
+class _PathRewriter(ContentHandler):
+    # The rewriter is the parser's lexical handler as well, so that comments are kept. XMLGenerator can't write
+    # comments, but as it writes start tags immediately, a comment can be written to its stream directly.
+
+    def __init__(self, parent_dir, cache, split_blocks):
+        super().__init__()
+        self.parent_dir = parent_dir
+        self.cache = cache
+        self.split_blocks = split_blocks
+        self.xml_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.digest = hashlib.sha256()
+        self.shell_digest = hashlib.sha256()
+        self.writer = _DigestWriter(self.xml_file, self.digest, self.shell_digest)
+        self.generator = XMLGenerator(self.writer, 'utf-8')
+        self.root_name = None
+        self.files = []
+        self.arcnames = {}
+        self.missing = []
+        self.namespaces = []
+        self.depth = 0
+        self.path_text = None
+        self.block = None
+        self.block_depth = None
+        self.block_name_text = None
+        self.blocks = []
+        self.in_dtd = False
+
+    def result(self):
+        self.xml_file.seek(0)
+        blocks = {}
+        for block in self.blocks:
+            if not block.name or block.name in blocks:
+                for b in self.blocks:
+                    b.xml_file.close()
+                blocks = {}
+                break
+            blocks[block.name] = block
+        return RewrittenXml(self.root_name, self.xml_file, self.files, self.digest.hexdigest(),
+                            self.shell_digest.hexdigest(), blocks)
+
+    def close(self):
+        self.xml_file.close()
+        for block in self.blocks:
+            block.xml_file.close()
+        if self.block:
+            self.block.xml_file.close()
+
+    def _generators(self):
+        if self.block:
+            return self.generator, self.block.generator
+        return self.generator,
+
+    def startDocument(self):
+        self.generator.startDocument()
+
+    def endDocument(self):
+        self.generator.endDocument()
+
+    def startPrefixMapping(self, prefix, uri):
+        self.namespaces.append((prefix, uri))
+        for generator in self._generators():
+            generator.startPrefixMapping(prefix, uri)
+
+    def endPrefixMapping(self, prefix):
+        self.namespaces.pop()
+        for generator in self._generators():
+            generator.endPrefixMapping(prefix)
+
+    def startElementNS(self, name, qname, attrs):
+        local_name = name[1]
+        self.depth += 1
+        if self.root_name is None:
+            self.root_name = local_name
+
+        if local_name == 'Block' and self.block_depth is None and self.depth > 1:
+            self.block_depth = self.depth
+            self.writer.digests.remove(self.shell_digest)
+            if self.split_blocks:
+                self.block = _BlockWriter(list(self.namespaces))
+        elif local_name == 'Name' and self.block_depth is not None and self.depth == self.block_depth + 1:
+            self.block_name_text = []
+        elif local_name == 'Path':
+            self.path_text = []
+
+        for generator in self._generators():
+            generator.startElementNS(name, qname, attrs)
+
+    def endElementNS(self, name, qname):
+        local_name = name[1]
+        if local_name == 'Path' and self.path_text is not None:
+            text = self._rewrite(''.join(self.path_text))
+            self.path_text = None
+            for generator in self._generators():
+                generator.characters(text)
+        elif local_name == 'Name' and self.block_name_text is not None:
+            if self.block:
+                self.block.name = ''.join(self.block_name_text).strip()
+            self.block_name_text = None
+
+        for generator in self._generators():
+            generator.endElementNS(name, qname)
+
+        if self.depth == self.block_depth:
+            self.block_depth = None
+            self.writer.digests.append(self.shell_digest)
+            if self.block:
+                self.blocks.append(self.block.end())
+                self.block = None
+        self.depth -= 1
+
+    def characters(self, content):
+        if self.path_text is not None:
+            self.path_text.append(content)
+            return
+        if self.block_name_text is not None:
+            self.block_name_text.append(content)
+        for generator in self._generators():
+            generator.characters(content)
+
+    def ignorableWhitespace(self, whitespace):
+        for generator in self._generators():
+            generator.ignorableWhitespace(whitespace)
+
+    def processingInstruction(self, target, data):
+        for generator in self._generators():
+            generator.processingInstruction(target, data)
+
+    def comment(self, content):
+        # Comments in the DTD are dropped with it, and those in a Path element with its original text.
+        if self.in_dtd or self.path_text is not None:
+            return
+        writers = (self.writer, self.block.writer) if self.block else (self.writer,)
+        for writer in writers:
+            writer.write('<!--{content}-->'.format(content=content))
+
+    def startDTD(self, name, public_id, system_id):
+        self.in_dtd = True
+
+    def endDTD(self):
+        self.in_dtd = False
+
+    def startCDATA(self):
+        pass
+
+    def endCDATA(self):
+        pass
+
+    def startEntity(self, name):
+        pass
+
+    def endEntity(self, name):
+        pass
+
+    def _rewrite(self, text):
+        path = text.strip()
+        if not path or path.lower() in AUTO_GENERATED_PATHS:
+            return text
+        if not os.path.isabs(path):
+            if self.parent_dir is None:
+                raise ValueError('Relative file paths such as {path} are not allowed if the parent directory of the '
+                                 'XML file is unknown.'.format(path=path))
+            path = os.path.join(self.parent_dir, path)
+        if not os.path.isfile(path):
+            self.missing.append(path)
+            return text
+
+        # The file names in the zip file are derived from the file content, so that they don't change as long as the
+        # content doesn't. Files referenced more than once are only included once.
+        if path not in self.arcnames:
+            arcname = 'Included/{digest}{ext}'.format(digest=content_digest(path, self.cache),
+                                                      ext=os.path.splitext(path)[1])
+            if arcname not in self.arcnames.values():
+                self.files.append((path, arcname))
+            self.arcnames[path] = arcname
+        arcname = self.arcnames[path]
+        if self.block:
+            self.block.arcnames.add(arcname)
+        return arcname
@@ -1,11 +1,876 @@
+import contextlib
+import contextvars
+import hashlib
+import itertools
+import mmap
 import os
-from salt_api import session
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
+from salt_api import get_session, limits, metrics, SaltApiException
+from salt_api.archive import ProposalArchive, stream_extract, StreamingNotSupported
+from salt_api.cache import FileCache, TTLCache
+from salt_api.encoding import accept_encoding, compress, request_encoding
+from salt_api.files import file_digest, is_path, is_xml, is_zip, open_binary, read_in_chunks
+from salt_api.http import (check_response, default_chunk_size, default_max_resumes, DEFAULT_CHUNK_SIZE,
+                           DEFAULT_MAX_RESUMES, proposals_base_url)
+from salt_api.manifest import default_manifest
+from salt_api.proposal_xml import rewrite_paths
+from salt_api.retry import call_with_retries, RETRY_STATUS_CODES
+from salt_api.zipping import default_cache, write_files
 
-def submit(filename, proposal_code=None):
-    base_url = os.environ.get('SALT_API_PROPOSALS_BASE_URL', 'http://saltapi.salt.ac.za')
 
+DEFAULT_MAX_WORKERS = 8
+
+DEFAULT_DOWNLOAD_CACHE_SIZE = 1024 * 1024 * 1024
+
+DEFAULT_MAX_PER_HOST = 8
+
+# on-disk files are uploaded from memory-mapped windows of this size
+MMAP_WINDOW = 4 * 1024 * 1024
+
+# zip files built for submissions are kept in memory up to this size
+DEFAULT_ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+
+# the number of block zip files built ahead of the upload by submit_blocks
+DEFAULT_BLOCKS_AHEAD = 2
+
+# the chunk size of resumable uploads
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# the number of chunks of a resumable upload sent in parallel
+DEFAULT_UPLOAD_WORKERS = 4
+
+# status codes after which a resumable upload is resumed (the upload has expired or chunks are missing)
+RESUME_STATUS_CODES = RETRY_STATUS_CODES + (404, 409)
+
+DEFAULT_BLOCK_CACHE_SIZE = 1024
+
+DEFAULT_BLOCK_CACHE_TTL = 300
+
+BatchResult = namedtuple('BatchResult', ['item', 'result', 'exception'])
+
+_host_semaphores = {}
+
+_host_semaphores_lock = threading.Lock()
+
+# resolved block ids, keyed by (proposal code, block name)
+_block_ids = None
+
+_block_ids_lock = threading.Lock()
+
+
+def submit(filename, proposal_code=None, chunk_size=None, manifest=None):
+    with metrics.measure('submit'), limits.operation():
+        chunk_size = chunk_size or default_chunk_size()
+        manifest = manifest or default_manifest()
+
+        if manifest and proposal_code:
+            return _submit_changes(filename, proposal_code, chunk_size, manifest)
+
+        with _zip_content(filename) as f:
+            return _upload(f, proposal_code, chunk_size)
+
+
+def zip_proposal_content(zip, xml, parent_dir=None, max_workers=None, min_saving=None, cache=None):
+    # If zip is None, the zip file is built in a spooled temporary file, which is returned (positioned at its start).
+    # The caller must close it.
+    if zip is None:
+        spooled = _spooled_zip_file()
+        try:
+            zip_proposal_content(spooled, xml, parent_dir, max_workers, min_saving, cache)
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
+
+    if parent_dir is None and is_path(xml):
+        parent_dir = os.path.dirname(os.path.abspath(xml))
+    cache = cache or default_cache()
+
+    with open_binary(xml) as f, metrics.phase('scan'):
+        rewritten = rewrite_paths(f, parent_dir, cache)
+    with rewritten:
+        _write_proposal_zip(zip, rewritten.root_name, rewritten.xml_file, rewritten.files,
+                            max_workers=max_workers, min_saving=min_saving, cache=cache)
+
+
+def download(proposal_code, content_type, name=None, chunk_size=None, max_resumes=None, cache=None,
+             extract_to=None):
+    with metrics.measure('download'), limits.operation():
+        return _download(proposal_code, content_type, name, chunk_size, max_resumes, cache, extract_to)
+
+
+def download_archive(proposal_code, content_type, name=None, chunk_size=None, max_resumes=None, cache=None):
+    # The downloaded zip file is deleted when the archive is closed.
+    return ProposalArchive(download(proposal_code, content_type, name, chunk_size, max_resumes, cache), delete=True)
+
+
+def submit_many(submissions, max_workers=None, max_per_host=None):
+    # Each submission is a filename or a tuple of the submit arguments, such as (filename, proposal_code).
+    return _run_batch(submit, submissions, max_workers, max_per_host)
+
+
+def download_many(downloads, max_workers=None, max_per_host=None):
+    # Each download is a tuple of the download arguments, such as (proposal_code, content_type, name).
+    return _run_batch(download, downloads, max_workers, max_per_host)
+
+
+def get_block_ids():
+    """Return the cache of resolved block ids, keyed by (proposal code, block name).
+
+    The cache is created when it is first needed, with the maximum size and time to live given by the environment
+    variables `SALT_API_BLOCK_CACHE_SIZE` and `SALT_API_BLOCK_CACHE_TTL`.
+    """
+
+    global _block_ids
+    if _block_ids is None:
+        with _block_ids_lock:
+            if _block_ids is None:
+                _block_ids = TTLCache(
+                    max_size=int(os.environ.get('SALT_API_BLOCK_CACHE_SIZE', DEFAULT_BLOCK_CACHE_SIZE)),
+                    ttl=float(os.environ.get('SALT_API_BLOCK_CACHE_TTL', DEFAULT_BLOCK_CACHE_TTL)))
+    return _block_ids
+
+
+def submit_blocks(proposal_code, blocks, chunk_size=None, max_ahead=None):
+    # Each block is a zip file or a block XML file, given as a path or file object. All blocks are submitted in a
+    # single multipart request, and a BatchResult is returned for every block, in the order of the blocks.
+    with metrics.measure('submit_blocks'), limits.operation():
+        return _submit_blocks(proposal_code, list(blocks), chunk_size or default_chunk_size(),
+                              max_ahead or int(os.environ.get('SALT_API_BLOCKS_AHEAD', DEFAULT_BLOCKS_AHEAD)))
+
+
+def _download(proposal_code, content_type, name, chunk_size, max_resumes, cache, extract_to):
+    content_type = content_type.lower()
+    if content_type not in ('proposal', 'block'):
+        raise ValueError('The content type must be "proposal" or "block".')
+    if content_type != 'proposal' and not name:
+        raise ValueError('A name must be supplied for a block.')
+
+    base_url = proposals_base_url()
+    chunk_size = chunk_size or default_chunk_size()
+    max_resumes = max_resumes if max_resumes is not None else default_max_resumes()
+    cache = cache or _default_download_cache()
+
+    if content_type == 'proposal':
+        url = '{base_url}/proposals/{proposal_code}'.format(base_url=base_url, proposal_code=proposal_code)
+    else:
+        with metrics.phase('resolve'):
+            block_id = get_block_ids().get_or_load((proposal_code, name), lambda: _resolve_block(proposal_code, name))
+        url = '{base_url}/proposals/{proposal_code}/blocks/{block_id}'.format(base_url=base_url,
+                                                                              proposal_code=proposal_code,
+                                                                              block_id=block_id)
+
+    # Unless the zip file is cached, it is extracted while it is downloaded. If that fails, it is downloaded (with
+    # resumption after connection errors) and extracted afterwards.
+    if extract_to is not None and not cache:
+        import requests
+        try:
+            _stream_extract(url, chunk_size, extract_to)
+            return os.path.abspath(extract_to)
+        except (StreamingNotSupported, zipfile.BadZipFile, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError):
+            pass
+
+    # A cached copy is only downloaded again if it has been modified on the server.
+    metadata, cached = None, None
+    validators = {}
+    if cache:
+        cache_key = 'download-' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+        metadata, cached = cache.get(cache_key)
+        if metadata and metadata.get('etag'):
+            validators['If-None-Match'] = metadata['etag']
+        if metadata and metadata.get('last_modified'):
+            validators['If-Modified-Since'] = metadata['last_modified']
+
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            response = _download_to_file(url, f, chunk_size, max_resumes, validators)
+            if response.status_code == 304:
+                shutil.copyfileobj(cached, f)
+            elif cache and (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+                f.seek(0)
+                cache.put(cache_key, dict(etag=response.headers.get('ETag'),
+                                          last_modified=response.headers.get('Last-Modified')), f)
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        if cached:
+            cached.close()
+
+    if extract_to is not None:
+        with ProposalArchive(path, delete=True) as archive:
+            archive.extractall(extract_to)
+        return os.path.abspath(extract_to)
+
+    return os.path.abspath(path)
+
+
+def _submit_blocks(proposal_code, blocks, chunk_size, max_ahead):
+    # As the parts are built while the request is sent, the request isn't retried.
+    results = [None] * len(blocks)
+    boundary = uuid.uuid4().hex
+    sent = []
+    with ThreadPoolExecutor(max_workers=max_ahead) as executor:
+        parts = _built_parts(executor, blocks, max_ahead, results)
+        try:
+            # the request is only made if at least one part can be sent
+            first_part = next(parts, None)
+            if first_part is None:
+                return results
+            url = '{base_url}/proposals/{proposal_code}'.format(base_url=proposals_base_url(),
+                                                                proposal_code=proposal_code)
+            headers = {'Content-Type': 'multipart/form-data; boundary={boundary}'.format(boundary=boundary)}
+            body = _multipart_body(itertools.chain([first_part], parts), boundary, chunk_size, sent)
+            try:
+                response = limits.send(lambda: get_session().put(url, data=body, headers=headers))
+            finally:
+                get_block_ids().invalidate(lambda key: key[0] == proposal_code)
+        finally:
+            parts.close()
+
+    metrics.set_status(response.status_code)
+    check_response(response)
+    block_results = response.json().get('blocks') or {}
+    for index in sent:
+        results[index] = _block_result(blocks[index], block_results.get(_part_name(index)))
+    return results
+
+
+def _built_parts(executor, blocks, max_ahead, results):
+    # Yields an (index, zip file, owned) tuple for every block, while the zip files of up to max_ahead following
+    # blocks are built on the executor. A block whose zip file can't be built is skipped, and its exception is stored
+    # in the results. Zip files which have been built but not yielded are closed when the generator is closed.
+    futures = ((index, executor.submit(_block_part, block)) for index, block in enumerate(blocks))
+    pending = deque(itertools.islice(futures, max_ahead))
+    try:
+        while pending:
+            index, future = pending.popleft()
+            pending.extend(itertools.islice(futures, 1))
+            try:
+                f, owned = future.result()
+            except Exception as e:
+                results[index] = BatchResult(item=blocks[index], result=None, exception=e)
+                continue
+            yield index, f, owned
+    finally:
+        _close_pending(pending)
+
+
+def _multipart_body(parts, boundary, chunk_size, sent):
+    # The indices of the parts are appended to sent once they have been sent in full.
+    measurement = metrics.current()
+    for index, f, owned in parts:
+        try:
+            yield _part_header(boundary, index)
+            for chunk in read_in_chunks(f, chunk_size):
+                if measurement is not None:
+                    measurement.bytes_sent += len(chunk)
+                yield chunk
+            yield b'\r\n'
+        finally:
+            if owned:
+                f.close()
+        sent.append(index)
+    yield '--{boundary}--\r\n'.format(boundary=boundary).encode('ascii')
+
+
+def _block_part(block):
+    # A (zip file, owned) tuple for a block. Owned files have been opened or built here and must be closed by the
+    # caller.
+    opened = is_path(block)
+    f = open(block, 'rb') if opened else block
+    try:
+        if is_zip(f):
+            return f, opened
+        if not is_xml(f):
+            raise ValueError('A block must be a zip file or an XML file.')
+        parent_dir = os.path.dirname(os.path.abspath(block)) if opened else None
+        zip_file = zip_proposal_content(None, f, parent_dir)
+    except BaseException:
+        if opened:
+            f.close()
+        raise
+    if opened:
+        f.close()
+    return zip_file, True
+
+
+def _part_name(index):
+    return 'block-{index}'.format(index=index)
+
+
+def _part_header(boundary, index):
+    return ('--{boundary}\r\n'
+            'Content-Disposition: form-data; name="{name}"; filename="{name}.zip"\r\n'
+            'Content-Type: application/zip\r\n'
+            '\r\n').format(boundary=boundary, name=_part_name(index)).encode('ascii')
+
+
+def _block_result(block, result):
+    # The server's result for a part is either the result or an object with an error field.
+    if result is None:
+        return BatchResult(item=block, result=None, exception=SaltApiException('The server returned no result.'))
+    if isinstance(result, dict) and 'error' in result:
+        return BatchResult(item=block, result=None,
+                           exception=SaltApiException(result['error'], status_code=result.get('status_code')))
+    return BatchResult(item=block, result=result, exception=None)
+
+
+def _close_pending(pending):
+    for _, future in pending:
+        if future.cancel():
+            continue
+        try:
+            f, owned = future.result()
+        except Exception:
+            continue
+        if owned:
+            f.close()
+
+
+def _run_batch(func, items, max_workers, max_per_host):
+    # The function is called for every item on a bounded thread pool. A BatchResult is returned for every item, in
+    # the order of the items, with either the function's return value or the exception it raised.
+    items = list(items)
+    max_workers = max_workers or int(os.environ.get('SALT_API_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+    max_per_host = max_per_host or int(os.environ.get('SALT_API_MAX_PER_HOST', DEFAULT_MAX_PER_HOST))
+    base_url = proposals_base_url()
+    semaphore = _host_semaphore(base_url, max_per_host)
+    _ensure_pool_size(base_url, min(max_workers, max_per_host))
+
+    def run(item):
+        args = item if isinstance(item, tuple) else (item,)
+        with semaphore:
+            try:
+                return BatchResult(item=item, result=func(*args), exception=None)
+            except Exception as e:
+                return BatchResult(item=item, result=None, exception=e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, items))
+
+
+def _host_semaphore(url, max_per_host):
+    # The semaphore is shared by all batches for the same host and limit, so that concurrent batches don't exceed the
+    # limit together. Batches with another limit use another semaphore.
+    key = (urlsplit(url).netloc, max_per_host)
+    with _host_semaphores_lock:
+        if key not in _host_semaphores:
+            _host_semaphores[key] = threading.BoundedSemaphore(max_per_host)
+        return _host_semaphores[key]
+
+
+def _ensure_pool_size(url, size):
+    # An adapter keeps at most pool_maxsize connections per host and discards any further ones.
+    from salt_api.adapters import make_adapter
+
+    session = get_session()
+    adapter = session.get_adapter(url)
+    if getattr(adapter, '_pool_maxsize', size) < size:
+        session.mount(url, make_adapter(pool_maxsize=size, timeout=getattr(adapter, 'timeout', None)))
+
+
+def _resolve_block(proposal_code, name):
+    url = '{base_url}/proposals/{proposal_code}/blocks/resolve'.format(base_url=proposals_base_url(),
+                                                                       proposal_code=proposal_code)
+    response = call_with_retries(lambda: get_session().get(url, params={'name': name},
+                                                           headers={'Accept-Encoding': accept_encoding()}))
+    check_response(response)
+    return response.json()['code']
+
+
+def _download_to_file(url, f, chunk_size, max_resumes, validators=None):
+    # The response body is written to the file chunk by chunk. If the connection drops, the download is resumed with
+    # a Range request from the number of bytes written so far. The validators (such as If-None-Match) are sent with
+    # the first request only, and nothing is written if the server responds with 304 (Not Modified). The last response
+    # is returned. If the response had a content coding, the bytes written are decoded and can't be mapped to a byte
+    # range of the encoded content, so that the download starts again from scratch instead.
+    import requests
+
+    resumes = 0
+    etag = None
+    encoded = False
+    first_request = True
+    while True:
+        if encoded:
+            f.seek(0)
+            f.truncate()
+        written = f.tell()
+        headers = {'Accept': 'application/zip', 'Accept-Encoding': accept_encoding()}
+        if first_request:
+            headers.update(validators or {})
+            first_request = False
+        if written:
+            headers['Range'] = 'bytes={written}-'.format(written=written)
+            if etag:
+                headers['If-Range'] = etag
+
+        try:
+            # dropped connections and timeouts are handled by resuming the download rather than retrying the request
+            with metrics.phase('wait'):
+                response = call_with_retries(lambda: get_session().get(url, headers=headers, stream=True),
+                                             retry_exceptions=())
+            try:
+                metrics.set_status(response.status_code)
+                check_response(response)
+                if response.status_code == 304:
+                    return response
+                if written and response.status_code != 206:
+                    # the server ignored the Range header and sends everything again
+                    f.seek(0)
+                    f.truncate()
+                etag = etag or response.headers.get('ETag')
+                encoded = bool(response.headers.get('Content-Encoding'))
+                expected_size = _expected_size(response, f.tell())
+                with metrics.phase('transfer'):
+                    start = f.tell()
+                    try:
+                        for chunk in response.iter_content(chunk_size):
+                            f.write(chunk)
+                    finally:
+                        measurement = metrics.current()
+                        if measurement is not None:
+                            measurement.bytes_received += f.tell() - start
+            finally:
+                response.close()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if resumes >= max_resumes:
+                raise
+            resumes += 1
+            _count_resume()
+            continue
+
+        if expected_size is not None and f.tell() < expected_size:
+            if resumes >= max_resumes:
+                raise SaltApiException('The download of {url} is incomplete.'.format(url=url))
+            resumes += 1
+            _count_resume()
+            continue
+
+        return response
+
+
+def _count_resume():
+    measurement = metrics.current()
+    if measurement is not None:
+        measurement.resumes += 1
+
+
+def _stream_extract(url, chunk_size, directory):
+    # The members are extracted into a temporary directory next to the target directory and only moved into it once
+    # the whole zip file has been extracted, so that a failed extraction leaves the target directory unchanged.
+    parent_dir = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.salt-api-extract-')
+    try:
+        _stream_extract_to(url, chunk_size, staging_dir)
+        os.makedirs(directory, exist_ok=True)
+        _move_contents(staging_dir, directory)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _stream_extract_to(url, chunk_size, directory):
+    with metrics.phase('wait'):
+        headers = {'Accept': 'application/zip', 'Accept-Encoding': accept_encoding()}
+        response = call_with_retries(lambda: get_session().get(url, headers=headers, stream=True))
+    try:
+        metrics.set_status(response.status_code)
+        check_response(response)
+        chunks = response.iter_content(chunk_size)
+        measurement = metrics.current()
+        if measurement is not None:
+            chunks = _count_received(chunks, measurement)
+        with metrics.phase('transfer'):
+            stream_extract(chunks, directory)
+    finally:
+        response.close()
+
+
+def _move_contents(source, target):
+    # Move the content of the directory source into the directory target, replacing existing files.
+    for entry in os.scandir(source):
+        destination = os.path.join(target, entry.name)
+        if entry.is_dir(follow_symlinks=False) and os.path.isdir(destination):
+            _move_contents(entry.path, destination)
+        else:
+            os.replace(entry.path, destination)
+
+
+def _count_received(chunks, measurement):
+    for chunk in chunks:
+        measurement.bytes_received += len(chunk)
+        yield chunk
+
+
+def _expected_size(response, offset):
+    # The Content-Length refers to the encoded body, so it can't be compared with the bytes written if the content is
+    # encoded.
+    content_length = response.headers.get('Content-Length')
+    if content_length is None or response.headers.get('Content-Encoding'):
+        return None
+    return offset + int(content_length)
+
+
+def _resumable_upload_size():
+    # Files of at least SALT_API_RESUMABLE_UPLOAD_SIZE bytes are uploaded with the resumable upload protocol. If the
+    # variable isn't set, no files are, as the server must support the protocol.
+    size = os.environ.get('SALT_API_RESUMABLE_UPLOAD_SIZE')
+    return int(size) if size else None
+
+
+def _remaining_size(f):
+    position = f.tell()
+    try:
+        return f.seek(0, os.SEEK_END) - position
+    finally:
+        f.seek(position)
+
+
+def _default_download_cache():
+    directory = os.environ.get('SALT_API_DOWNLOAD_CACHE')
+    if not directory:
+        return None
+    return FileCache(directory, int(os.environ.get('SALT_API_DOWNLOAD_CACHE_SIZE', DEFAULT_DOWNLOAD_CACHE_SIZE)))
+
+
+def _spooled_zip_file():
+    # A temporary file for building a zip file, which is kept in memory until it exceeds SALT_API_ZIP_SPOOL_SIZE
+    # bytes. If this size is 0, the file is written to disk from the start.
+    max_size = int(os.environ.get('SALT_API_ZIP_SPOOL_SIZE', DEFAULT_ZIP_SPOOL_SIZE))
+    if max_size <= 0:
+        # a SpooledTemporaryFile with a maximum size of 0 would never be moved to disk
+        return tempfile.TemporaryFile()
+    return tempfile.SpooledTemporaryFile(max_size=max_size)
+
+
+def _upload(f, proposal_code, chunk_size):
+    resumable_size = _resumable_upload_size()
+    if resumable_size is not None:
+        size = _remaining_size(f)
+        if size >= resumable_size:
+            try:
+                return _resumable_upload(f, proposal_code, size)
+            finally:
+                get_block_ids().invalidate(lambda key: key[0] == proposal_code)
+
+    base_url = proposals_base_url()
+    headers = {'Content-Type': 'application/zip'}
+    session = get_session()
     if proposal_code:
-        session.put('{base_url}/proposals/{proposal_code}'.format(base_url=base_url, proposal_code=proposal_code))
+        # PUT requests are idempotent, so that they can be retried with the file content read again
+        url = '{base_url}/proposals/{proposal_code}'.format(base_url=base_url, proposal_code=proposal_code)
+        position = f.tell()
+
+        def put():
+            f.seek(position)
+            return _send(session.put, url, f, chunk_size, headers)
+
+        try:
+            response = call_with_retries(put)
+        finally:
+            # the submission may have added, removed or renamed blocks
+            get_block_ids().invalidate(lambda key: key[0] == proposal_code)
+    else:
+        url = '{base_url}/proposals'.format(base_url=base_url)
+        response = limits.send(lambda: _send(session.post, url, f, chunk_size, headers))
+
+    metrics.set_status(response.status_code)
+    check_response(response)
+
+    return response
+
+
+def _resumable_upload(f, proposal_code, size):
+    # The file is split into chunks, which are checksummed before anything is sent. The upload is started with the
+    # size and digests, and the server answers with the chunks it has received already (from an earlier, interrupted
+    # upload of the same content), so that only the missing chunks are sent. If the upload fails, it is started again
+    # in the same way, which resumes it from the missing chunks.
+    import requests
+
+    chunk_size = int(os.environ.get('SALT_API_UPLOAD_CHUNK_SIZE', DEFAULT_UPLOAD_CHUNK_SIZE))
+    max_workers = int(os.environ.get('SALT_API_UPLOAD_WORKERS', DEFAULT_UPLOAD_WORKERS))
+    max_resumes = int(os.environ.get('SALT_API_UPLOAD_RESUMES', DEFAULT_MAX_RESUMES))
+    chunks = _FileChunks(f, f.tell(), size, chunk_size)
+    digest, chunk_digests = chunks.digests()
+    description = dict(proposal_code=proposal_code, size=size, chunk_size=chunk_size, sha256=digest,
+                       chunks=chunk_digests)
+    base_url = proposals_base_url()
+
+    resumes = 0
+    while True:
+        try:
+            response = call_with_retries(lambda: get_session().post(base_url + '/uploads', json=description))
+            metrics.set_status(response.status_code)
+            check_response(response)
+            upload = response.json()
+            received = set(upload.get('received') or ())
+            url = '{base_url}/uploads/{id}'.format(base_url=base_url, id=upload['id'])
+            missing = [index for index in range(len(chunk_digests)) if index not in received]
+            with metrics.phase('upload'):
+                _send_chunks(url, chunks, missing, chunk_digests, max_workers)
+            with metrics.phase('wait'):
+                response = call_with_retries(lambda: get_session().post(url + '/complete'))
+            metrics.set_status(response.status_code)
+            check_response(response)
+            return response
+        except (requests.ConnectionError, requests.Timeout, SaltApiException) as e:
+            resumable = not isinstance(e, SaltApiException) or e.status_code in RESUME_STATUS_CODES
+            if resumes >= max_resumes or not resumable:
+                raise
+            resumes += 1
+            _count_resume()
+
+
+def _send_chunks(url, chunks, indices, digests, max_workers):
+    # The chunks are sent in parallel, and every chunk is read when it is sent, so that at most max_workers chunks
+    # are held in memory. If a chunk fails, the other chunks are sent nevertheless, and the first exception is
+    # raised.
+    measurement = metrics.current()
+
+    def send(index):
+        data = chunks.read(index)
+        headers = {'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': digests[index]}
+        chunk_url = '{url}/chunks/{index}'.format(url=url, index=index)
+        response = call_with_retries(lambda: get_session().put(chunk_url, data=data, headers=headers))
+        check_response(response)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # every chunk is sent in a copy of the caller's context, so that retries are measured
+        futures = [executor.submit(contextvars.copy_context().run, send, index) for index in indices]
+    exception = None
+    for future in futures:
+        if future.exception() is not None:
+            exception = exception or future.exception()
+        elif measurement is not None:
+            measurement.bytes_sent += future.result()
+    if exception is not None:
+        raise exception
+
+
+class _FileChunks:
+    # The fixed-size chunks of a file from an offset to its end. Chunks may be read from several threads.
+
+    def __init__(self, f, offset, size, chunk_size):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def read(self, index):
+        with self._lock:
+            self.f.seek(self.offset + index * self.chunk_size)
+            return self.f.read(min(self.chunk_size, self.size - index * self.chunk_size))
+
+    def digests(self):
+        # The SHA-256 digest of the whole content and of every chunk, as hex strings.
+        digest = hashlib.sha256()
+        chunk_digests = []
+        for index in range(len(self)):
+            chunk = self.read(index)
+            digest.update(chunk)
+            chunk_digests.append(hashlib.sha256(chunk).hexdigest())
+        return digest.hexdigest(), chunk_digests
+
+
+def _send(method, url, f, chunk_size, headers):
+    # Regular files are sent from memory-mapped windows, and other files are read in chunks. If a content coding is
+    # used, the chunks are compressed on the fly instead. If the submission is measured, the time until the whole body
+    # has been sent is recorded as the upload phase, and the time from then until the response arrives as the wait
+    # phase.
+    measurement = metrics.current()
+    encoding = request_encoding(f)
+    if encoding:
+        headers = dict(headers, **{'Content-Encoding': encoding})
+        mapped_body = None
+        chunks = compress(read_in_chunks(f, chunk_size), encoding)
     else:
-        session.post('{base_url}/proposals'.format(base_url=base_url))
+        mapped_body = _memory_mapped_body(f, measurement)
+        chunks = read_in_chunks(f, chunk_size)
+    if measurement is None:
+        return method(url, data=mapped_body if mapped_body is not None else chunks, headers=headers)
+
+    body_sent = []
+
+    def body():
+        for chunk in chunks:
+            measurement.bytes_sent += len(chunk)
+            yield chunk
+        body_sent.append(time.perf_counter())
+
+    start = time.perf_counter()
+    try:
+        return method(url, data=mapped_body if mapped_body is not None else body(), headers=headers)
+    finally:
+        end = time.perf_counter()
+        if mapped_body is not None and mapped_body.sent_at:
+            body_sent.append(mapped_body.sent_at)
+        upload_end = body_sent[0] if body_sent else end
+        measurement.add_phase('upload', upload_end - start)
+        measurement.add_phase('wait', end - upload_end)
+
+
+class _MemoryMappedBody:
+    # A request body sent from memory-mapped windows of a file, so that the file content isn't copied by Python. As
+    # the body has a length, requests sends it with a Content-Length header, and urllib3 passes every window to
+    # socket.sendall as it is. The windows are unmapped once they have been sent, so that the resident memory stays
+    # bounded.
+
+    def __init__(self, f, offset, size, measurement=None):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.measurement = measurement
+        self.sent_at = None
+
+    def __len__(self):
+        return self.size - self.offset
+
+    def __iter__(self):
+        fileno = self.f.fileno()
+        position = self.offset
+        while position < self.size:
+            start = position - position % mmap.ALLOCATIONGRANULARITY
+            window = mmap.mmap(fileno, min(MMAP_WINDOW, self.size - start), access=mmap.ACCESS_READ, offset=start)
+            try:
+                view = memoryview(window)[position - start:]
+                position += len(view)
+                yield view
+                if self.measurement is not None:
+                    self.measurement.bytes_sent += len(view)
+                del view
+            finally:
+                try:
+                    window.close()
+                except BufferError:
+                    # the window is still referenced, and it is unmapped when it is garbage collected
+                    pass
+        self.sent_at = time.perf_counter()
+
+
+def _memory_mapped_body(f, measurement):
+    # A _MemoryMappedBody for the rest of the file, or None if the file isn't a regular file on disk or memory mapping
+    # has been disabled by setting SALT_API_MEMORY_MAP to 0. A SpooledTemporaryFile would be moved to disk.
+    if os.environ.get('SALT_API_MEMORY_MAP') == '0' or isinstance(f, tempfile.SpooledTemporaryFile):
+        return None
+    try:
+        f.flush()
+        st = os.fstat(f.fileno())
+        offset = f.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode) or st.st_size <= offset:
+        return None
+    return _MemoryMappedBody(f, offset, st.st_size, measurement)
+
+
+def _submit_changes(filename, proposal_code, chunk_size, manifest):
+    # Content which is the same as that of the last successful submission isn't submitted again. If only some
+    # blocks of a proposal have changed, only these blocks are submitted.
+    previous = manifest.get(proposal_code) or {}
+    with open_binary(filename) as f:
+        if is_zip(f):
+            digest = file_digest(f)
+            if previous.get('digest') == digest:
+                return None
+            response = _upload(f, proposal_code, chunk_size)
+            manifest.set(proposal_code, digest)
+            return response
+        if not is_xml(f):
+            raise ValueError('The submitted content must be a zip file or an XML file.')
+        parent_dir = os.path.dirname(os.path.abspath(filename)) if is_path(filename) else None
+        cache = default_cache()
+        with metrics.phase('scan'):
+            rewritten = rewrite_paths(f, parent_dir, cache, split_blocks=True)
+
+    with rewritten:
+        return _submit_rewritten_changes(rewritten, previous, proposal_code, chunk_size, manifest, cache)
+
+
+def _submit_rewritten_changes(rewritten, previous, proposal_code, chunk_size, manifest, cache):
+    if previous.get('digest') == rewritten.digest:
+        return None
+
+    blocks = rewritten.blocks
+    block_digests = {name: block.digest for name, block in blocks.items()}
+    previous_blocks = previous.get('blocks') or {}
+    changed_blocks = [block for name, block in blocks.items() if previous_blocks.get(name) != block.digest]
+    if (not blocks or not changed_blocks or previous.get('shell') != rewritten.shell_digest
+            or not set(previous_blocks).issubset(blocks)):
+        with _spooled_zip_file() as zip_file:
+            _write_proposal_zip(zip_file, rewritten.root_name, rewritten.xml_file, rewritten.files, cache=cache)
+            zip_file.seek(0)
+            response = _upload(zip_file, proposal_code, chunk_size)
+        manifest.set(proposal_code, rewritten.digest, rewritten.shell_digest, block_digests)
+        return response
+
+    for block in changed_blocks:
+        block_files = [(path, arcname) for path, arcname in rewritten.files if arcname in block.arcnames]
+        with _spooled_zip_file() as zip_file:
+            _write_proposal_zip(zip_file, 'Block', block.xml_file, block_files, cache=cache)
+            zip_file.seek(0)
+            response = _upload(zip_file, proposal_code, chunk_size)
+        # the block is recorded immediately, so that it isn't submitted again if a later block fails
+        manifest.set_block(proposal_code, block.name, block.digest)
+    manifest.set(proposal_code, rewritten.digest, rewritten.shell_digest, block_digests)
+    return response
+
+
+def _write_proposal_zip(zip, root_name, xml_file, files, max_workers=None, min_saving=None, cache=None):
+    with metrics.phase('zip'), zipfile.ZipFile(zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('{name}.xml'.format(name=root_name), 'w') as xml_entry:
+            shutil.copyfileobj(xml_file, xml_entry, DEFAULT_CHUNK_SIZE)
+        write_files(zf, files, max_workers=max_workers, min_saving=min_saving, cache=cache)
+
+
+@contextlib.contextmanager
+def _zip_content(filename):
+    # An XML file is zipped together with the files it references, and the zip file is used instead.
+    with open_binary(filename) as f:
+        if is_zip(f):
+            yield f
+        elif is_xml(f):
+            parent_dir = os.path.dirname(os.path.abspath(filename)) if is_path(filename) else None
+            with zip_proposal_content(None, f, parent_dir) as zip_file:
+                yield zip_file
+        else:
+            raise ValueError('The submitted content must be a zip file or an XML file.')
+
+
+def _reset_after_fork():
+    # The semaphores might have been acquired by threads which don't exist in the child process.
+    global _host_semaphores, _host_semaphores_lock, _block_ids_lock
+    _host_semaphores = {}
+    _host_semaphores_lock = threading.Lock()
+    _block_ids_lock = threading.Lock()
+    if _block_ids is not None:
+        _block_ids.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def __getattr__(name):
+    # salt_api.proposals.session is kept for backwards compatibility
+    if name == 'session':
+        return get_session()
+    raise AttributeError('module {module!r} has no attribute {name!r}'.format(module=__name__, name=name))
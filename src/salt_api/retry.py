@@ -0,0 +1,95 @@
+import email.utils
+import os
+import random
+import time
+
+from salt_api import limits, metrics
+
+
+DEFAULT_MAX_RETRIES = 3
+
+DEFAULT_BACKOFF_FACTOR = 0.5
+
+DEFAULT_BACKOFF_MAX = 30
+
+# if a Retry-After header asks to wait longer than this, the request isn't retried
+RETRY_AFTER_MAX = 300
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+def call_with_retries(request, retry_exceptions=None, max_retries=None, backoff_factor=None, backoff_max=None,
+                      limited=True):
+    """Make a request, retrying it if it fails with a connection error or a temporary server error.
+
+    `request` is a function without arguments making the request and returning the response. It must only make
+    idempotent requests, and it must be possible to call it more than once (so a request body can't be a generator
+    created outside the function).
+
+    The request is retried if it raises one of `retry_exceptions` (by default, connection errors and timeouts) or
+    if the response has one of the status codes in `RETRY_STATUS_CODES`. Before retrying, the function waits for the
+    time given in the response's Retry-After header, or otherwise for a random time between 0 and
+    `backoff_factor * 2 ** attempt` seconds (but at most `backoff_max` seconds). If the Retry-After header asks to
+    wait longer than `RETRY_AFTER_MAX` seconds, the request isn't retried. The response of the last attempt is
+    returned.
+
+    Every attempt goes through the shared limiter of the `limits` module, unless `limited` is false (as for token
+    requests, which shouldn't wait for or adjust the limits of the requests they authenticate).
+
+    Unless they are passed, the maximum number of retries, backoff factor and maximum backoff are read from the
+    environment variables `SALT_API_MAX_RETRIES`, `SALT_API_BACKOFF_FACTOR` and `SALT_API_BACKOFF_MAX`.
+    """
+
+    if retry_exceptions is None:
+        import requests
+        retry_exceptions = (requests.ConnectionError, requests.Timeout)
+    if max_retries is None:
+        max_retries = int(os.environ.get('SALT_API_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+    if backoff_factor is None:
+        backoff_factor = float(os.environ.get('SALT_API_BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR))
+    if backoff_max is None:
+        backoff_max = float(os.environ.get('SALT_API_BACKOFF_MAX', DEFAULT_BACKOFF_MAX))
+
+    attempt = 0
+    while True:
+        try:
+            response = limits.send(request) if limited else request()
+        except retry_exceptions:
+            if attempt >= max_retries:
+                raise
+            delay = backoff(attempt, backoff_factor, backoff_max)
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                return response
+            delay = retry_after(response)
+            if delay is not None and delay > RETRY_AFTER_MAX:
+                return response
+            if delay is None:
+                delay = backoff(attempt, backoff_factor, backoff_max)
+            response.close()
+
+        metrics.add_retry()
+        with metrics.phase('backoff'):
+            time.sleep(delay)
+        attempt += 1
+
+
+def backoff(attempt, backoff_factor, backoff_max):
+    # exponential backoff with "full jitter"
+    return random.uniform(0, min(backoff_max, backoff_factor * 2 ** attempt))
+
+
+def retry_after(response):
+    # Return the number of seconds to wait according to the Retry-After header, or None if there is no (valid) header.
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = date.timestamp() - time.time()
+    return max(delay, 0)
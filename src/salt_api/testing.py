@@ -0,0 +1,450 @@
+import gzip
+import hashlib
+import json
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+
+
+class StandInServer(socketserver.ThreadingMixIn, HTTPServer):
+    """A local HTTP server standing in for the SALT API.
+
+    Request bodies are read (and discarded) in chunks, so that arbitrarily large uploads can be received. For every
+    request the method, path, headers and number of body bytes are recorded in the `requests` list.
+
+    A POST request to /token returns the token in the `token` attribute, which expires after `token_lifetime`
+    seconds. If `check_tokens` is true, all other requests without this token are rejected with a 401 error. A GET
+    request to /proposals/{code}/blocks/resolve returns a block id, and any other GET request returns the bytes in the
+    `content` attribute (or part of them, if there is a Range header). If `compress_responses` is true and the request
+    accepts gzip, the content is sent gzip-encoded in full instead.
+
+    The server implements the resumable upload protocol. A POST request to /uploads with a JSON description of the
+    content starts an upload (or returns the unfinished upload of the same content), PUT requests to
+    /uploads/{id}/chunks/{index} send the chunks, and a POST request to /uploads/{id}/complete completes the upload.
+    The uploads are kept in the `uploads` dictionary, and the content of every completed upload is stored in its
+    `content` item. Unlike other request bodies, chunks are kept in memory.
+
+    Network conditions can be simulated: every response is delayed by `latency` seconds, request and response bodies
+    are transferred at no more than `bandwidth` bytes per second (if given), and a fraction `error_rate` of the
+    requests (other than token requests) is answered with the status code `error_status`. If `capacity` is given,
+    requests arriving while `capacity` requests are being handled already are answered with the status code 429.
+
+    The server is started in a background thread when used as a context manager. Its base URL is available as the
+    `base_url` property.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, error_rate=0, error_status=503, seed=None,
+                 capacity=None):
+        super().__init__((host, port), StandInRequestHandler)
+        self.requests = []
+        self.content = b'PK\x05\x06' + bytes(18)
+        self.token = 'stand-in-token'
+        self.token_lifetime = 3600
+        self.check_tokens = False
+        self.compress_responses = False
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.capacity = capacity
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.uploads = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def inject_error(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def start_request(self):
+        # Whether the server has capacity for another request. Every call must be followed by a call of end_request.
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return not self.capacity or self.in_flight <= self.capacity
+
+    def end_request(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start_upload(self, description):
+        # An unfinished upload of the same content with the same chunk size is resumed.
+        key = tuple(description.get(name) for name in ('proposal_code', 'size', 'chunk_size', 'sha256'))
+        with self._lock:
+            for upload in self.uploads.values():
+                if upload['key'] == key and upload['content'] is None:
+                    return upload
+            upload = dict(id=uuid.uuid4().hex, key=key, description=description, chunks={}, content=None)
+            self.uploads[upload['id']] = upload
+            return upload
+
+    def add_chunk(self, upload_id, index, data, digest):
+        # Returns an error message, or None if the chunk has been stored.
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return 'Unknown upload.'
+            description = upload['description']
+            size, chunk_size, digests = description['size'], description['chunk_size'], description['chunks']
+            if not 0 <= index < len(digests):
+                return 'Invalid chunk index.'
+            if len(data) != min(chunk_size, size - index * chunk_size):
+                return 'The chunk has the wrong size.'
+            if digest != digests[index] or hashlib.sha256(data).hexdigest() != digest:
+                return 'The chunk checksum does not match.'
+            upload['chunks'][index] = data
+
+    def complete_upload(self, upload_id):
+        # Returns a status code and a JSON object. Completing a completed upload returns the same result again.
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return 404, dict(error='Unknown upload.')
+            if upload['content'] is None:
+                digests = upload['description']['chunks']
+                missing = [index for index in range(len(digests)) if index not in upload['chunks']]
+                if missing:
+                    return 409, dict(error='Chunks are missing.', missing=missing)
+                content = b''.join(upload['chunks'][index] for index in range(len(digests)))
+                if hashlib.sha256(content).hexdigest() != upload['description']['sha256']:
+                    upload['chunks'] = {}
+                    return 400, dict(error='The content checksum does not match.')
+                upload['content'], upload['chunks'] = content, {}
+            return 200, dict(received=len(upload['content']))
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # The headers and the body of a response are written separately, and with Nagle's algorithm the body of a small
+    # response would wait for the client's delayed ACK of the headers (about 40 ms).
+    disable_nagle_algorithm = True
+
+    READ_SIZE = 64 * 1024
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        # the bodies of upload requests are kept
+        path = urlsplit(self.path).path
+        self.body = [] if path.startswith('/uploads') else None
+        body_size = self._drain_body()
+        self.server.record(dict(method=self.command, path=self.path, headers=dict(self.headers), body_size=body_size))
+        has_capacity = self.server.start_request()
+        try:
+            self._respond(body_size, has_capacity)
+        finally:
+            self.server.end_request()
+
+    def _respond(self, body_size, has_capacity):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        path = urlsplit(self.path).path
+        if not has_capacity:
+            self._send_json(429, dict(error='Too many requests.'))
+        elif self.command == 'POST' and path == '/token':
+            self._send_json(200, dict(token=self.server.token, expires_in=self.server.token_lifetime))
+        elif self.server.check_tokens and self.headers.get('Authentication') != 'Token ' + self.server.token:
+            self._send_json(401, dict(error='Invalid token.'))
+        elif self.server.inject_error():
+            self._send_json(self.server.error_status, dict(error='Injected error.'))
+        elif path.startswith('/uploads'):
+            self._handle_upload(path)
+        elif self.command == 'GET' and path.endswith('/blocks/resolve'):
+            self._send_json(200, dict(code=1))
+        elif self.command == 'GET':
+            self._send_range(self.server.content)
+        else:
+            self._send_json(200, dict(received=body_size))
+
+    def _handle_upload(self, path):
+        parts = path.strip('/').split('/')
+        if self.command == 'POST' and len(parts) == 1:
+            upload = self.server.start_upload(json.loads(b''.join(self.body)))
+            self._send_json(200, dict(id=upload['id'], received=sorted(upload['chunks'])))
+        elif self.command == 'PUT' and len(parts) == 4 and parts[2] == 'chunks' and parts[3].isdigit():
+            error = self.server.add_chunk(parts[1], int(parts[3]), b''.join(self.body),
+                                          self.headers.get('X-Chunk-SHA256'))
+            if error:
+                self._send_json(404 if error == 'Unknown upload.' else 400, dict(error=error))
+            else:
+                self._send_json(200, dict(received=sum(len(data) for data in self.body)))
+        elif self.command == 'POST' and len(parts) == 3 and parts[2] == 'complete':
+            self._send_json(*self.server.complete_upload(parts[1]))
+        else:
+            self._send_json(404, dict(error='Not found.'))
+
+    def _drain_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return self._drain_chunked_body()
+
+        remaining = int(self.headers.get('Content-Length', 0))
+        size = 0
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, self.READ_SIZE))
+            if not data:
+                break
+            self._throttle(len(data))
+            size += len(data)
+            if self.body is not None:
+                self.body.append(data)
+            remaining -= len(data)
+        return size
+
+    def _drain_chunked_body(self):
+        size = 0
+        while True:
+            chunk_size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+            if chunk_size == 0:
+                # skip trailers up to the terminating empty line
+                while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return size
+            remaining = chunk_size
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, self.READ_SIZE))
+                if not data:
+                    return size
+                self._throttle(len(data))
+                size += len(data)
+                if self.body is not None:
+                    self.body.append(data)
+                remaining -= len(data)
+            self.rfile.readline()
+
+    def _send_range(self, content):
+        if self.server.compress_responses and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self._send_content(200, gzip.compress(content), headers={'Content-Encoding': 'gzip'})
+            return
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and int(match.group(1)) < len(content):
+            start = int(match.group(1))
+            self._send_content(206, content[start:], headers={
+                'Content-Range': 'bytes {start}-{end}/{size}'.format(start=start, end=len(content) - 1,
+                                                                     size=len(content))})
+        else:
+            self._send_content(200, content)
+
+    def _send_content(self, status, content, content_type='application/zip', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        view = memoryview(content)
+        for start in range(0, len(content), self.READ_SIZE):
+            chunk = view[start:start + self.READ_SIZE]
+            self._throttle(len(chunk))
+            self.wfile.write(chunk)
+
+    def _throttle(self, size):
+        if self.server.bandwidth:
+            time.sleep(size / self.server.bandwidth)
+
+    def _send_json(self, status, content):
+        self._send_content(status, json.dumps(content).encode('utf-8'), 'application/json')
+
+
+class HTTP2StandInServer:
+    """A local HTTP/2 server standing in for the SALT API, which requires the h2 package.
+
+    The server speaks HTTP/2 over plain TCP without negotiation (h2c with prior knowledge). It answers token, block
+    resolution, GET, POST and PUT requests like `StandInServer` (but doesn't support Range headers), and it records
+    the requests in the same way. Each connection is served by its own thread, and the requests on a connection are
+    answered concurrently after `latency` seconds, so that they are multiplexed. The number of accepted connections
+    is available as the `connections` attribute.
+
+    The server is started in a background thread when used as a context manager.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        self.requests = []
+        self.content = b'PK\x05\x06' + bytes(18)
+        self.token = 'stand-in-token'
+        self.token_lifetime = 3600
+        self.latency = latency
+        self.connections = 0
+        # socket.create_server would require Python 3.8
+        family, type_, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        self._socket = socket.socket(family, type_, proto)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(address)
+        self._socket.listen()
+        self._socket.settimeout(0.1)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._socket.getsockname()[:2]
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def respond(self, method, path, body_size):
+        # The (status code, content type, content) of the response to a request.
+        path = urlsplit(path).path
+        if method == 'POST' and path == '/token':
+            content = dict(token=self.token, expires_in=self.token_lifetime)
+        elif method == 'GET' and path.endswith('/blocks/resolve'):
+            content = dict(code=1)
+        elif method == 'GET':
+            return 200, 'application/zip', self.content
+        else:
+            content = dict(received=body_size)
+        return 200, 'application/json', json.dumps(content).encode('utf-8')
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                sock, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            # as for StandInServer, frames aren't delayed by Nagle's algorithm
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=_HTTP2Connection(self, sock).serve, daemon=True).start()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._closed = True
+        self._thread.join()
+        self._socket.close()
+
+
+class _HTTP2Connection:
+    # The server side of an HTTP/2 connection. Frames are read in the connection's thread, and responses are sent
+    # from one thread per request. The h2 connection state is guarded by a condition, which is notified whenever
+    # frames have been received, so that responses waiting for the flow control window can continue.
+
+    def __init__(self, server, sock):
+        import h2.config
+        import h2.connection
+
+        self.server = server
+        self.sock = sock
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        self.condition = threading.Condition()
+        self.streams = {}
+        self.closed = False
+
+    def serve(self):
+        import h2.events
+        import h2.exceptions
+
+        try:
+            with self.condition:
+                self.conn.initiate_connection()
+                self.sock.sendall(self.conn.data_to_send())
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    return
+                with self.condition:
+                    for event in self.conn.receive_data(data):
+                        if isinstance(event, h2.events.RequestReceived):
+                            self.streams[event.stream_id] = dict(headers=dict(event.headers), body_size=0)
+                        elif isinstance(event, h2.events.DataReceived):
+                            self.streams[event.stream_id]['body_size'] += len(event.data)
+                            self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                        elif isinstance(event, h2.events.StreamEnded):
+                            self._start_response(event.stream_id)
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            return
+                    self.sock.sendall(self.conn.data_to_send())
+                    self.condition.notify_all()
+        except (OSError, h2.exceptions.ProtocolError):
+            return
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            self.sock.close()
+
+    def _start_response(self, stream_id):
+        stream = self.streams.pop(stream_id)
+        headers = stream['headers']
+        self.server.record(dict(method=headers[':method'], path=headers[':path'],
+                                headers={name: value for name, value in headers.items() if not name.startswith(':')},
+                                body_size=stream['body_size'], http_version='HTTP/2'))
+        timer = threading.Timer(self.server.latency, self._respond,
+                                (stream_id, headers[':method'], headers[':path'], stream['body_size']))
+        timer.daemon = True
+        timer.start()
+
+    def _respond(self, stream_id, method, path, body_size):
+        import h2.exceptions
+
+        status, content_type, content = self.server.respond(method, path, body_size)
+        try:
+            with self.condition:
+                self.conn.send_headers(stream_id, [(':status', str(status)), ('content-type', content_type),
+                                                   ('content-length', str(len(content)))],
+                                       end_stream=not content)
+                self.sock.sendall(self.conn.data_to_send())
+            position = 0
+            while position < len(content):
+                with self.condition:
+                    while not self.closed and self.conn.local_flow_control_window(stream_id) <= 0:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    size = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size,
+                               len(content) - position)
+                    self.conn.send_data(stream_id, content[position:position + size],
+                                        end_stream=position + size == len(content))
+                    self.sock.sendall(self.conn.data_to_send())
+                position += size
+        except (OSError, h2.exceptions.ProtocolError):
+            return
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+import requests
+
+from salt_api import metrics
+from salt_api.adapters import configure_session
+from salt_api.files import JsonFile
+from salt_api.http import check_response, proposals_base_url
+from salt_api.retry import call_with_retries
+
+
+# tokens expiring within this many seconds aren't used for requests any longer
+TOKEN_EXPIRY_MARGIN = 30
+
+# tokens are refreshed in the background this many seconds before they expire
+REFRESH_AHEAD = 120
+
+# a failed background refresh is tried again after this many seconds
+REFRESH_RETRY_INTERVAL = 10
+
+
+class TokenStore:
+    """A file shared by several processes for storing tokens.
+
+    Tokens are stored as JSON, together with their expiry time, for each username and token URL. A token is only
+    requested while holding an exclusive lock on the store, so that processes waiting for the lock use the token
+    requested by the first process rather than requesting their own. The file is replaced atomically and is only
+    readable by its owner.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = JsonFile(path)
+
+    def get(self, key):
+        # The stored (token, expiry time) tuple, or None if there is none.
+        with self._file.locked():
+            entry = self._file.read().get(key)
+        return (entry['token'], entry['expires_at']) if entry else None
+
+    def put(self, key, token, expires_at):
+        with self._file.locked():
+            content = self._file.read()
+            content[key] = dict(token=token, expires_at=expires_at)
+            self._file.write(content)
+
+    def get_or_fetch(self, key, fetch, valid_until, invalid_token=None):
+        """Return a (token, expiry time) tuple for a key.
+
+        The stored token is returned if it doesn't expire before `valid_until` (a Unix time) and isn't
+        `invalid_token`. Otherwise a new token is fetched by calling `fetch`, which must return a (token, expiry
+        time) tuple, and it is stored.
+        """
+
+        with self._file.locked():
+            content = self._file.read()
+            entry = content.get(key)
+            if entry and entry['expires_at'] > valid_until and entry['token'] != invalid_token:
+                return entry['token'], entry['expires_at']
+            token, expires_at = fetch()
+            content[key] = dict(token=token, expires_at=expires_at)
+            self._file.write(content)
+            return token, expires_at
+
+
+class TokenManager:
+    """A thread-safe provider of authentication tokens.
+
+    A token is requested by posting the username and password to the token URL. It is refreshed in a background
+    thread `REFRESH_AHEAD` seconds before it expires (or halfway through its lifetime, if that is shorter), so that
+    requests don't have to wait for a new token. If a `TokenStore` is passed, tokens are shared via the store.
+
+    Tokens are requested with the manager's own session, which uses the same adapter (and thus timeouts) as the
+    session for requests to the SALT API, so that a token server which doesn't respond can't block the threads (and,
+    with a token store, processes) waiting for a token indefinitely.
+    """
+
+    def __init__(self, username, password, token_url, store=None, background_refresh=True):
+        self.username = username
+        self.password = password
+        self.token_url = token_url
+        self.store = store
+        self.background_refresh = background_refresh
+        self._token = None
+        self._expires_at = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        configure_session(self._session)
+
+    def token(self, invalid_token=None):
+        # If the server rejected a token, it is passed as invalid_token so that it isn't returned again.
+        with self._lock:
+            if self._token and self._token != invalid_token and time.time() < self._expires_at - TOKEN_EXPIRY_MARGIN:
+                return self._token
+            self._update(*self._new_token(time.time() + TOKEN_EXPIRY_MARGIN, invalid_token))
+            return self._token
+
+    def close(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        self._session.close()
+
+    def _new_token(self, valid_until, invalid_token=None):
+        if self.store:
+            return self.store.get_or_fetch(store_key(self.username, self.token_url), self._fetch, valid_until,
+                                           invalid_token)
+        return self._fetch()
+
+    def _update(self, token, expires_at):
+        self._token, self._expires_at = token, expires_at
+        self._schedule(expires_at - min(REFRESH_AHEAD, (expires_at - time.time()) / 2))
+
+    def _fetch(self):
+        with metrics.phase('token'):
+            response = call_with_retries(lambda: self._session.post(self.token_url,
+                                                                    json=dict(username=self.username,
+                                                                              password=self.password)),
+                                         limited=False)
+        check_response(response)
+        content = response.json()
+        return content['token'], time.time() + content['expires_in']
+
+    def _schedule(self, refresh_at):
+        if not self.background_refresh:
+            return
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(refresh_at - time.time(), 0), self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        # The current token remains in use while the new one is requested. Only a token expiring later than the
+        # current one (possibly requested by another process) is accepted.
+        try:
+            token, expires_at = self._new_token(self._expires_at)
+        except Exception:
+            # if the retries fail as well, the token is requested again when it's needed
+            with self._lock:
+                self._schedule(time.time() + REFRESH_RETRY_INTERVAL)
+            return
+        with self._lock:
+            if expires_at > self._expires_at:
+                self._update(token, expires_at)
+
+
+class TokenAuth(requests.auth.AuthBase):
+    """An authentication handler for requests sessions, which uses the tokens of a `TokenManager`.
+
+    The handler adds an `Authentication: Token ...` header to every request. If the server responds with a 401 status
+    code, the request is sent again with a new token, unless its body is a stream which can't be read again.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __call__(self, r):
+        r.headers['Authentication'] = 'Token {token}'.format(token=self.manager.token())
+        r.register_hook('response', self._handle_401)
+        return r
+
+    def _handle_401(self, response, **kwargs):
+        # This mirrors the way requests' HTTPDigestAuth resends a request.
+        request = response.request
+        if response.status_code != 401 or getattr(request, '_token_resent', False):
+            return response
+        if request.body is not None and not isinstance(request.body, (bytes, str)):
+            return response
+
+        rejected = request.headers['Authentication'][len('Token '):]
+        new_request = request.copy()
+        new_request.headers['Authentication'] = 'Token {token}'.format(token=self.manager.token(rejected))
+        new_request._token_resent = True
+        response.content
+        response.close()
+        new_response = response.connection.send(new_request, **kwargs)
+        new_response.history.append(response)
+        new_response.request = new_request
+        return new_response
+
+
+def default_token_manager():
+    """Return a `TokenManager` defined by environment variables, or None if `SALT_API_USERNAME` isn't set.
+
+    The username, password and token URL are given by `SALT_API_USERNAME`, `SALT_API_PASSWORD` and
+    `SALT_API_TOKEN_URL` (by default `{base_url}/token`), and the path of the token store (if any) by
+    `SALT_API_TOKEN_STORE`.
+    """
+
+    username = os.environ.get('SALT_API_USERNAME')
+    if not username:
+        return None
+    return TokenManager(username, os.environ.get('SALT_API_PASSWORD'), token_url(), default_token_store())
+
+
+def default_token_store():
+    path = os.environ.get('SALT_API_TOKEN_STORE')
+    return TokenStore(path) if path else None
+
+
+def token_url():
+    return os.environ.get('SALT_API_TOKEN_URL', '{}/token'.format(proposals_base_url()))
+
+
+def store_key(username, token_url):
+    return '{username}@{token_url}'.format(username=username, token_url=token_url)
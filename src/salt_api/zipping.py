@@ -0,0 +1,207 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from salt_api.cache import FileCache
+
+
+# files with these extensions are stored without trying to compress them
+COMPRESSED_EXTENSIONS = {'.7z', '.bz2', '.fz', '.gif', '.gz', '.jpeg', '.jpg', '.png', '.tgz', '.xz', '.zip', '.zst'}
+
+# files which would shrink by less than this fraction are stored uncompressed
+DEFAULT_MIN_SAVING = 0.05
+
+# the first bytes of a file are compressed to estimate whether compressing the whole file is worthwhile
+SAMPLE_SIZE = 256 * 1024
+
+READ_SIZE = 1024 * 1024
+
+# compressed content is kept in memory up to this size before it is spilled to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+class _Entry:
+    def __init__(self, zinfo, path, data_file=None):
+        self.zinfo = zinfo
+        self.path = path
+        self.data_file = data_file
+
+
+def write_files(zf, files, max_workers=None, min_saving=None, compresslevel=zlib.Z_DEFAULT_COMPRESSION, cache=None):
+    """Add files to a zip file, compressing them concurrently.
+
+    `files` is a list of (path, arcname) tuples. The files are compressed on a thread pool with `max_workers` threads
+    (zlib releases the GIL, so that several cores are used), and they are written to the zip file in the order given.
+
+    A file is stored uncompressed if its extension is one of `COMPRESSED_EXTENSIONS`, or if compressing it would
+    reduce its size by less than the fraction `min_saving`.
+
+    If a `FileCache` is passed, compressed entries are looked up in the cache by content digest, and files not found
+    are added to the cache after compressing them.
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    min_saving = min_saving if min_saving is not None else DEFAULT_MIN_SAVING
+
+    def prepare(file):
+        path, arcname = file
+        if cache:
+            return _prepare_cached_entry(path, arcname, min_saving, compresslevel, cache)
+        return _prepare_entry(path, arcname, min_saving, compresslevel)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for entry in executor.map(prepare, files):
+            try:
+                _write_entry(zf, entry)
+            finally:
+                if entry.data_file:
+                    entry.data_file.close()
+
+
+def content_digest(path, cache=None):
+    """Return the SHA-256 hex digest of a file's content.
+
+    If a cache is passed, the digest is stored in the cache with the file's path, size and modification time as key,
+    so that the file doesn't have to be read again as long as these don't change.
+    """
+
+    if cache:
+        st = os.stat(path)
+        stat_key = 'digest-' + hashlib.sha1('{path}\0{size}\0{mtime}'.format(
+            path=os.path.abspath(path), size=st.st_size, mtime=st.st_mtime_ns).encode('utf-8')).hexdigest()
+        metadata = cache.get_metadata(stat_key)
+        if metadata:
+            return metadata['digest']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+
+    if cache:
+        cache.put(stat_key, dict(digest=digest))
+    return digest
+
+
+def default_cache():
+    """Return the attachment cache defined by environment variables, or None if there is none.
+
+    The cache directory is given by `SALT_API_ATTACHMENT_CACHE` and its maximum size in bytes by
+    `SALT_API_ATTACHMENT_CACHE_SIZE`.
+    """
+
+    directory = os.environ.get('SALT_API_ATTACHMENT_CACHE')
+    if not directory:
+        return None
+    return FileCache(directory, int(os.environ.get('SALT_API_ATTACHMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE)))
+
+
+def _prepare_cached_entry(path, arcname, min_saving, compresslevel, cache):
+    key = 'entry-{digest}-{compresslevel}-{min_saving:g}'.format(digest=content_digest(path, cache),
+                                                                 compresslevel=compresslevel,
+                                                                 min_saving=min_saving)
+    metadata, data_file = cache.get(key)
+    if metadata:
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        zinfo.compress_type = metadata['compress_type']
+        zinfo.compress_size = metadata['compress_size']
+        zinfo.CRC = metadata['crc']
+        if zinfo.compress_type == zipfile.ZIP_STORED:
+            data_file.close()
+            data_file = None
+        return _Entry(zinfo, path, data_file)
+
+    entry = _prepare_entry(path, arcname, min_saving, compresslevel)
+    zinfo = entry.zinfo
+    cache.put(key, dict(compress_type=zinfo.compress_type, compress_size=zinfo.compress_size, crc=zinfo.CRC),
+              entry.data_file)
+    if entry.data_file:
+        entry.data_file.seek(0)
+    return entry
+
+
+def _prepare_entry(path, arcname, min_saving, compresslevel):
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+
+    if _worth_compressing(path, min_saving, compresslevel):
+        data_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        zinfo.CRC, zinfo.compress_size = _deflate(path, data_file, compresslevel)
+        if zinfo.compress_size <= zinfo.file_size * (1 - min_saving):
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            data_file.seek(0)
+            return _Entry(zinfo, path, data_file)
+        data_file.close()
+    else:
+        zinfo.CRC = _crc32(path)
+
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.compress_size = zinfo.file_size
+    return _Entry(zinfo, path)
+
+
+def _worth_compressing(path, min_saving, compresslevel):
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if not sample:
+        return False
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed_size <= len(sample) * (1 - min_saving)
+
+
+def _deflate(path, data_file, compresslevel):
+    crc = 0
+    size = 0
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            compressed = compressor.compress(chunk)
+            data_file.write(compressed)
+            size += len(compressed)
+    compressed = compressor.flush()
+    data_file.write(compressed)
+    size += len(compressed)
+    return crc, size
+
+
+def _crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _write_entry(zf, entry):
+    # ZipFile can't write data which has been compressed already, so the local file header and data are written
+    # directly, and the entry is registered so that it is included in the central directory. This mirrors what
+    # ZipFile.writestr does.
+    zinfo = entry.zinfo
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    if zip64 and not zf._allowZip64:
+        raise zipfile.LargeZipFile('{arcname} requires ZIP64 extensions.'.format(arcname=zinfo.filename))
+
+    with zf._lock:
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zinfo.header_offset = zf.fp.tell()
+        zf.fp.write(zinfo.FileHeader(zip64))
+        if entry.data_file:
+            shutil.copyfileobj(entry.data_file, zf.fp, READ_SIZE)
+        else:
+            with open(entry.path, 'rb') as f:
+                shutil.copyfileobj(f, zf.fp, READ_SIZE)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
@@ -1,5 +1,10 @@
 import os
+import zipfile
 import pytest
+import requests
+
+import salt_api
+from salt_api.testing import StandInServer
 
 
 BASE_URL = 'http://whatever.saao.ac.za'
@@ -18,3 +23,42 @@ def uri():
         return BASE_URL + endpoint
 
     yield _make_uri
+
+
+@pytest.fixture()
+def stand_in_server(monkeypatch):
+    """A running stand-in for the SALT API, used as the proposals base URL with a fresh session and no manifest."""
+
+    monkeypatch.setattr(salt_api, '_session', requests.Session())
+    monkeypatch.delenv('SALT_API_SUBMIT_MANIFEST', raising=False)
+    with StandInServer() as server:
+        monkeypatch.setenv('SALT_API_PROPOSALS_BASE_URL', server.base_url)
+        yield server
+
+
+@pytest.fixture()
+def zip_file(tmp_path):
+    path = tmp_path / 'proposal.zip'
+    with zipfile.ZipFile(str(path), 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+
+    yield str(path)
+
+
+@pytest.fixture()
+def proposal_dir(tmp_path):
+    """A directory with a proposal XML file referencing a compressible and an incompressible attachment."""
+
+    (tmp_path / 'attachments').mkdir()
+    (tmp_path / 'attachments' / 'finder_chart.txt').write_text('Finder chart. ' * 10000)
+    (tmp_path / 'attachments' / 'noise.fits').write_bytes(os.urandom(100000))
+    (tmp_path / 'Proposal.xml').write_text("""<?xml version="1.0"?>
+<Proposal xmlns="http://www.salt.ac.za/PIPT/Proposal/Phase2/4.8">
+    <Path>attachments/finder_chart.txt</Path>
+    <Block>
+        <Path>attachments/noise.fits</Path>
+        <Path>auto-generated</Path>
+    </Block>
+</Proposal>""")
+
+    yield tmp_path
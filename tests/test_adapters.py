@@ -0,0 +1,34 @@
+from unittest.mock import patch
+
+import requests
+
+from salt_api.adapters import TimeoutHTTPAdapter, configure_session
+
+
+def test_configure_session_from_environment(monkeypatch):
+    """configure_session mounts an adapter with the pool size and timeouts set in environment variables"""
+
+    monkeypatch.setenv('SALT_API_POOL_MAXSIZE', '32')
+    monkeypatch.setenv('SALT_API_CONNECT_TIMEOUT', '2.5')
+    monkeypatch.setenv('SALT_API_READ_TIMEOUT', '30')
+    session = requests.Session()
+
+    configure_session(session)
+
+    adapter = session.get_adapter('https://saltapi.salt.ac.za')
+    assert isinstance(adapter, TimeoutHTTPAdapter)
+    assert adapter._pool_maxsize == 32
+    assert adapter.timeout == (2.5, 30)
+
+
+def test_default_timeout_is_used():
+    """the adapter's timeout is used for requests without timeout"""
+
+    adapter = TimeoutHTTPAdapter(timeout=(1, 2))
+
+    with patch('requests.adapters.HTTPAdapter.send') as mock_send:
+        adapter.send(requests.Request('GET', 'http://example.com').prepare())
+        adapter.send(requests.Request('GET', 'http://example.com').prepare(), timeout=5)
+
+    assert mock_send.call_args_list[0][1]['timeout'] == (1, 2)
+    assert mock_send.call_args_list[1][1]['timeout'] == 5
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from salt_api import limits, SaltApiException
+from salt_api.limits import AdaptiveConcurrency, ClientLimiter
+from salt_api.tokens import store_key, TokenStore
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from salt_api import aio  # noqa: E402
+
+
+def run(coroutine_function, *args, **kwargs):
+    async def _run():
+        async with aio.AuthClientSession(username='observer', password='secret') as session:
+            return await coroutine_function(*args, session=session, **kwargs)
+
+    return asyncio.run(_run())
+
+
+def test_submit_put_with_proposal_code(stand_in_server, zip_file):
+    """submit makes an authenticated PUT request to /proposals/[proposal_code] with the file content"""
+
+    run(aio.submit, zip_file, '2018-1-SCI-042', chunk_size=16)
+
+    token_request, put_request = stand_in_server.requests
+    assert token_request['path'] == '/token'
+    assert put_request['method'] == 'PUT'
+    assert put_request['path'] == '/proposals/2018-1-SCI-042'
+    assert put_request['headers']['Authentication'] == 'Token stand-in-token'
+    assert put_request['body_size'] == os.path.getsize(zip_file)
+
+
+def test_submit_post_without_proposal_code(stand_in_server, zip_file):
+    """submit makes a POST request to /proposals if called without a proposal code"""
+
+    run(aio.submit, zip_file)
+
+    assert stand_in_server.requests[-1]['method'] == 'POST'
+    assert stand_in_server.requests[-1]['path'] == '/proposals'
+
+
+def test_submit_zips_xml_file(stand_in_server, proposal_dir):
+    """submit zips an XML file together with the files it references, like proposals.submit"""
+
+    run(aio.submit, str(proposal_dir / 'Proposal.xml'), '2018-1-SCI-042')
+
+    assert stand_in_server.requests[-1]['method'] == 'PUT'
+    assert stand_in_server.requests[-1]['body_size'] > 100000
+
+
+def test_submit_rejects_other_content(stand_in_server, tmp_path):
+    """submit raises an exception if the content is neither a zip file nor an XML file"""
+
+    (tmp_path / 'proposal.txt').write_text('Not a proposal.')
+
+    with pytest.raises(ValueError):
+        run(aio.submit, str(tmp_path / 'proposal.txt'))
+
+
+def test_requests_use_shared_limiter(stand_in_server, monkeypatch):
+    """requests made by download go through the shared limiter and adjust its window"""
+
+    concurrency = AdaptiveConcurrency(maximum=8, initial=4)
+    monkeypatch.setattr(limits, '_limiter', ClientLimiter(concurrency=concurrency))
+
+    path = run(aio.download, '2018-1-SCI-042', 'proposal')
+    os.remove(path)
+    assert concurrency.window == 4.25
+
+    stand_in_server.error_rate = 1
+    with pytest.raises(SaltApiException):
+        run(aio.download, '2018-1-SCI-042', 'proposal')
+    assert concurrency.window == 2.125
+    assert concurrency.in_flight == 0
+
+
+def test_download_block(stand_in_server):
+    """download resolves the block name and saves the block in a temporary zip file"""
+
+    stand_in_server.content = b'block content'
+
+    path = run(aio.download, '2018-1-SCI-042', 'block', 'Deep Field')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'block content'
+    os.remove(path)
+    resolve_request, block_request = stand_in_server.requests[-2:]
+    resolve_url = urlsplit(resolve_request['path'])
+    assert resolve_url.path == '/proposals/2018-1-SCI-042/blocks/resolve'
+    assert parse_qs(resolve_url.query) == {'name': ['Deep Field']}
+    assert block_request['path'] == '/proposals/2018-1-SCI-042/blocks/1'
+    assert block_request['headers']['Accept'] == 'application/zip'
+
+
+def test_concurrent_requests_share_one_token(stand_in_server):
+    """concurrent requests only request a token once"""
+
+    async def _run():
+        async with aio.AuthClientSession() as session:
+            paths = await asyncio.gather(*[aio.download('2018-1-SCI-042', 'proposal', session=session)
+                                           for _ in range(20)])
+        for path in paths:
+            os.remove(path)
+
+    asyncio.run(_run())
+
+    assert len([request for request in stand_in_server.requests if request['path'] == '/token']) == 1
+
+
+def test_default_session(stand_in_server):
+    """the default session of an event loop is reused until it is closed with close_session"""
+
+    async def _run():
+        session = aio.get_session()
+        assert aio.get_session() is session
+        os.remove(await aio.download('2018-1-SCI-042', 'Proposal'))
+        await aio.close_session()
+        assert aio.get_session() is not session
+        await aio.close_session()
+        return session
+
+    session = asyncio.run(_run())
+
+    assert session.client_session.closed
+
+
+def test_download_invalid_content_type():
+    """download raises an exception for an invalid content type"""
+
+    with pytest.raises(ValueError):
+        asyncio.run(aio.download('2018-1-SCI-042', 'observation', 'A', session=object()))
+
+
+def test_check_response_uses_error_field(stand_in_server):
+    """an exception with the server's error message is raised for an error response"""
+
+    class Response:
+        status = 400
+
+        async def json(self, content_type):
+            return {'error': 'Invalid proposal.'}
+
+    with pytest.raises(SaltApiException) as excinfo:
+        asyncio.run(aio._check_response(Response()))
+
+    assert excinfo.value.message == 'Invalid proposal.'
+
+
+def test_token_from_store(stand_in_server, tmp_path):
+    """A valid token in the token store is used instead of requesting one"""
+
+    store = TokenStore(str(tmp_path / 'tokens.json'))
+    store.put(store_key('observer', stand_in_server.base_url + '/token'), 'stored-token', time.time() + 3600)
+
+    async def _run():
+        async with aio.AuthClientSession(username='observer', password='secret', token_store=store) as session:
+            return await aio.download('2018-1-SCI-042', 'Proposal', session=session)
+
+    os.remove(asyncio.run(_run()))
+
+    assert [r['path'] for r in stand_in_server.requests] == ['/proposals/2018-1-SCI-042']
+    assert stand_in_server.requests[0]['headers']['Authentication'] == 'Token stored-token'
+
+
+TOKEN_STORE_SCRIPT = """
+import asyncio, os, sys
+from salt_api import aio
+from salt_api.tokens import TokenStore
+
+async def main():
+    async with aio.AuthClientSession(username='observer', password='secret', token_store=TokenStore(sys.argv[1])) as s:
+        os.remove(await aio.download('2018-1-SCI-042', 'Proposal', session=s))
+
+asyncio.run(main())
+"""
+
+
+def test_token_store_is_shared_by_processes(stand_in_server, tmp_path):
+    """Processes sharing a token store request a single token, even if they need one at the same time"""
+
+    stand_in_server.latency = 0.5
+    path = str(tmp_path / 'tokens.json')
+    processes = [subprocess.Popen([sys.executable, '-c', TOKEN_STORE_SCRIPT, path]) for _ in range(2)]
+    assert [process.wait() for process in processes] == [0, 0]
+
+    paths = [r['path'] for r in stand_in_server.requests]
+    assert paths.count('/token') == 1
+    assert paths.count('/proposals/2018-1-SCI-042') == 2
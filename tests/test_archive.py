@@ -0,0 +1,102 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from salt_api.archive import ProposalArchive, stream_extract, StreamingNotSupported
+
+
+class Unseekable(io.RawIOBase):
+    # ZipFile writes data descriptors to unseekable files.
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def make_zip(members, compression=zipfile.ZIP_DEFLATED, seekable=True):
+    out = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(out, 'w', compression=compression) as z:
+        for name, content in members.items():
+            z.writestr(name, content)
+    return out.getvalue() if seekable else out.buffer.getvalue()
+
+
+def chunked(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+MEMBERS = {
+    'Proposal.xml': b'<Proposal/>',
+    'Included/finder_chart.txt': b'Finder chart. ' * 1000,
+    'Included/noise.bin': os.urandom(10000),
+}
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_stream_extract(tmp_path, compression):
+    """stream_extract extracts all members from a stream of chunks"""
+
+    names = stream_extract(chunked(make_zip(MEMBERS, compression)), str(tmp_path))
+
+    assert names == list(MEMBERS)
+    for name, content in MEMBERS.items():
+        assert (tmp_path / name).read_bytes() == content
+
+
+def test_stream_extract_with_data_descriptors(tmp_path):
+    """stream_extract extracts deflated members with data descriptors"""
+
+    stream_extract(chunked(make_zip(MEMBERS, seekable=False), 1000), str(tmp_path))
+
+    for name, content in MEMBERS.items():
+        assert (tmp_path / name).read_bytes() == content
+
+
+def test_stream_extract_unknown_size(tmp_path):
+    """stream_extract can't extract stored members with data descriptors"""
+
+    with pytest.raises(StreamingNotSupported):
+        stream_extract([make_zip(MEMBERS, zipfile.ZIP_STORED, seekable=False)], str(tmp_path))
+
+
+def test_stream_extract_sanitizes_names(tmp_path):
+    """stream_extract doesn't write files outside the target directory"""
+
+    target = tmp_path / 'target'
+    stream_extract([make_zip({'../evil.txt': b'evil', '/abs/evil.txt': b'evil'})], str(target))
+
+    assert (target / 'evil.txt').read_bytes() == b'evil'
+    assert (target / 'abs' / 'evil.txt').read_bytes() == b'evil'
+    assert not (tmp_path / 'evil.txt').exists()
+
+
+def test_stream_extract_truncated(tmp_path):
+    """stream_extract raises an exception for a truncated zip file"""
+
+    with pytest.raises(zipfile.BadZipFile):
+        stream_extract([make_zip(MEMBERS)[:5000]], str(tmp_path))
+
+
+def test_proposal_archive(tmp_path):
+    """A proposal archive reads members on demand and deletes the file when it is closed"""
+
+    path = tmp_path / 'proposal.zip'
+    path.write_bytes(make_zip(MEMBERS))
+
+    with ProposalArchive(str(path), delete=True) as archive:
+        assert archive.names() == list(MEMBERS)
+        assert archive.xml_name == 'Proposal.xml'
+        assert archive.xml() == b'<Proposal/>'
+        with archive.open('Included/noise.bin') as f:
+            assert f.read() == MEMBERS['Included/noise.bin']
+        archive.extract('Included/finder_chart.txt', str(tmp_path / 'out'))
+
+    assert (tmp_path / 'out' / 'Included' / 'finder_chart.txt').read_bytes() == MEMBERS['Included/finder_chart.txt']
+    assert not path.exists()
@@ -0,0 +1,128 @@
+import io
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import salt_api.cache
+from salt_api.cache import FileCache, TTLCache
+
+
+def test_put_and_get(tmp_path):
+    """an entry can be read back with its metadata"""
+
+    cache = FileCache(str(tmp_path), max_size=1000)
+
+    cache.put('key', {'answer': 42}, io.BytesIO(b'content'))
+    metadata, f = cache.get('key')
+
+    with f:
+        assert metadata == {'answer': 42}
+        assert f.read() == b'content'
+
+
+def test_missing_entry(tmp_path):
+    """None is returned for an entry which doesn't exist"""
+
+    cache = FileCache(str(tmp_path), max_size=1000)
+
+    assert cache.get('key') == (None, None)
+    assert cache.get_metadata('key') is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """the least recently used entries are removed if the cache grows too large"""
+
+    cache = FileCache(str(tmp_path), max_size=350)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, {}, io.BytesIO(bytes(100)))
+        past = time.time() - 100 + i
+        os.utime(os.path.join(str(tmp_path), key), (past, past))
+
+    # reading an entry marks it as recently used
+    cache.get_metadata('a')
+    cache.put('d', {}, io.BytesIO(bytes(100)))
+
+    assert cache.get_metadata('a') == {}
+    assert cache.get_metadata('b') is None
+    assert cache.get_metadata('c') == {}
+    assert cache.get_metadata('d') == {}
+
+
+def test_directory_is_only_scanned_when_the_cache_may_be_full(tmp_path, monkeypatch):
+    """putting entries only scans the cache directory the first time and once the total size exceeds the limit"""
+
+    scandir = MagicMock(side_effect=os.scandir)
+    monkeypatch.setattr(salt_api.cache.os, 'scandir', scandir)
+    cache = FileCache(str(tmp_path), max_size=1050)
+
+    for i in range(10):
+        cache.put(str(i), {}, io.BytesIO(bytes(100)))
+    assert scandir.call_count == 1
+
+    cache.put('10', {}, io.BytesIO(bytes(100)))
+    assert scandir.call_count == 2
+    assert len(os.listdir(str(tmp_path))) == 10
+
+
+def test_ttl_cache_entries_expire(monkeypatch):
+    """entries are loaded again once they have expired"""
+
+    now = [1000]
+    monkeypatch.setattr(salt_api.cache.time, 'monotonic', lambda: now[0])
+    cache = TTLCache(max_size=10, ttl=60)
+    load = MagicMock(side_effect=[1, 2])
+
+    assert cache.get_or_load('key', load) == 1
+    now[0] += 59
+    assert cache.get_or_load('key', load) == 1
+    now[0] += 2
+    assert cache.get_or_load('key', load) == 2
+
+
+def test_ttl_cache_max_size():
+    """the least recently used entries are discarded"""
+
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('c', lambda: 3)
+
+    assert cache.get_or_load('a', lambda: 'reloaded') == 1
+    assert cache.get_or_load('b', lambda: 'reloaded') == 'reloaded'
+
+
+def test_ttl_cache_invalidate():
+    """entries matching a predicate can be invalidated"""
+
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.get_or_load(('A', 1), lambda: 1)
+    cache.get_or_load(('B', 1), lambda: 2)
+
+    cache.invalidate(lambda key: key[0] == 'A')
+
+    assert cache.get_or_load(('A', 1), lambda: 'reloaded') == 'reloaded'
+    assert cache.get_or_load(('B', 1), lambda: 'reloaded') == 2
+
+
+def test_ttl_cache_merges_concurrent_loads():
+    """concurrent loads of the same key are merged into one"""
+
+    cache = TTLCache(max_size=10, ttl=60)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('key', load))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [42] * 10
@@ -0,0 +1,61 @@
+import zipfile
+
+import pytest
+
+from salt_api.cli import main, SyncState
+
+
+@pytest.fixture()
+def server(stand_in_server, monkeypatch):
+    monkeypatch.delenv('SALT_API_DOWNLOAD_CACHE', raising=False)
+
+    yield stand_in_server
+
+
+def test_submit_is_incremental(server, tmp_path, capsys):
+    """salt-api submit submits the XML and zip files in a directory tree, and only changed files are resubmitted"""
+
+    (tmp_path / 'proposals' / 'A').mkdir(parents=True)
+    (tmp_path / 'proposals' / 'A' / 'finder_chart.txt').write_text('Finder chart.')
+    (tmp_path / 'proposals' / 'A' / 'Proposal.xml').write_text('<Proposal><Path>finder_chart.txt</Path></Proposal>')
+    with zipfile.ZipFile(str(tmp_path / 'proposals' / 'B.zip'), 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+    directory = str(tmp_path / 'proposals')
+
+    assert main(['submit', directory, '--jobs', '2']) == 0
+    assert len(server.requests) == 2
+    assert '2 done, 0 unchanged, 0 failed' in capsys.readouterr().err
+
+    assert main(['submit', directory]) == 0
+    assert len(server.requests) == 2
+    assert '0 done, 2 unchanged, 0 failed' in capsys.readouterr().err
+
+    (tmp_path / 'proposals' / 'A' / 'finder_chart.txt').write_text('Another finder chart.')
+    assert main(['submit', directory]) == 0
+    assert len(server.requests) == 3
+    output = capsys.readouterr().err
+    assert '1 done, 1 unchanged, 0 failed' in output
+    assert 'submit.duration' in output
+
+
+def test_submit_reports_failures(server, tmp_path, capsys):
+    """salt-api submit returns a non-zero exit code if a file can't be submitted, and doesn't record it"""
+
+    (tmp_path / 'Proposal.xml').write_text('<Proposal><Path>missing.pdf</Path></Proposal>')
+
+    assert main(['submit', str(tmp_path)]) == 1
+    assert 'failed Proposal.xml' in capsys.readouterr().err
+    assert SyncState(str(tmp_path / '.salt-api-sync.json')).get(str(tmp_path / 'Proposal.xml')) is None
+
+
+def test_download(server, tmp_path):
+    """salt-api download saves proposals and blocks listed as arguments or in a file"""
+
+    server.content = b'PK\x05\x06' + bytes(18)
+    (tmp_path / 'items.txt').write_text('# blocks\n2018-1-SCI-042:Block 1\n\n')
+
+    assert main(['download', '2018-1-SCI-042', '--from-file', str(tmp_path / 'items.txt'),
+                 '--output', str(tmp_path / 'out'), '--jobs', '2']) == 0
+
+    assert (tmp_path / 'out' / '2018-1-SCI-042.zip').read_bytes() == server.content
+    assert (tmp_path / 'out' / '2018-1-SCI-042-Block_1.zip').read_bytes() == server.content
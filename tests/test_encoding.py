@@ -0,0 +1,98 @@
+import gzip
+import io
+import os
+import zipfile
+
+import pytest
+
+import salt_api.encoding
+from salt_api.encoding import accept_encoding, compress, request_encoding
+
+
+def make_zip(compression, name='Proposal.xml', content=b'<Proposal><Target/></Proposal>' * 10000):
+    f = io.BytesIO()
+    with zipfile.ZipFile(f, 'w', compression=compression) as z:
+        z.writestr(name, content)
+    f.seek(0)
+    return f
+
+
+def test_request_encoding_defaults_to_identity(monkeypatch):
+    """request_encoding returns None unless a coding is requested"""
+
+    monkeypatch.delenv('SALT_API_REQUEST_ENCODING', raising=False)
+
+    assert request_encoding(make_zip(zipfile.ZIP_STORED)) is None
+    assert request_encoding(make_zip(zipfile.ZIP_STORED), 'identity') is None
+
+
+def test_request_encoding_reads_environment(monkeypatch):
+    """request_encoding uses the coding given by SALT_API_REQUEST_ENCODING"""
+
+    monkeypatch.setenv('SALT_API_REQUEST_ENCODING', 'gzip')
+
+    assert request_encoding(make_zip(zipfile.ZIP_STORED)) == 'gzip'
+
+
+def test_request_encoding_rejects_unknown_codings():
+    """request_encoding raises a ValueError for an unknown coding"""
+
+    with pytest.raises(ValueError):
+        request_encoding(make_zip(zipfile.ZIP_STORED), 'brotli')
+
+
+def test_request_encoding_skips_compressed_zip_files():
+    """request_encoding returns None for zip files whose members are compressed or incompressible"""
+
+    assert request_encoding(make_zip(zipfile.ZIP_DEFLATED), 'gzip') is None
+    assert request_encoding(make_zip(zipfile.ZIP_STORED, 'chart.png'), 'gzip') is None
+    assert request_encoding(make_zip(zipfile.ZIP_STORED, 'noise.fits', os.urandom(100000)), 'gzip') is None
+
+
+def test_request_encoding_keeps_file_position():
+    """request_encoding leaves the file position unchanged"""
+
+    f = make_zip(zipfile.ZIP_STORED)
+    f.seek(3)
+
+    request_encoding(f, 'gzip')
+
+    assert f.tell() == 3
+
+
+def test_request_encoding_falls_back_to_gzip(monkeypatch):
+    """request_encoding uses gzip for 'zstd' and 'auto' if zstandard isn't installed"""
+
+    monkeypatch.setattr(salt_api.encoding, 'zstandard', None)
+
+    assert request_encoding(make_zip(zipfile.ZIP_STORED), 'zstd') == 'gzip'
+    assert request_encoding(make_zip(zipfile.ZIP_STORED), 'auto') == 'gzip'
+
+
+def test_compress_gzip():
+    """compress produces a gzip stream of the chunks"""
+
+    chunks = [b'Finder chart. ' * 1000, b'', b'Finder chart. ' * 1000]
+
+    assert gzip.decompress(b''.join(compress(chunks, 'gzip'))) == b''.join(chunks)
+
+
+def test_compress_zstd():
+    """compress produces a zstd stream of the chunks"""
+
+    zstandard = pytest.importorskip('zstandard')
+    chunks = [b'Finder chart. ' * 1000, b'Finder chart. ' * 1000]
+
+    compressed = b''.join(compress(chunks, 'zstd'))
+
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == b''.join(chunks)
+
+
+def test_accept_encoding(monkeypatch):
+    """accept_encoding returns SALT_API_ACCEPT_ENCODING or the codings urllib3 can decode"""
+
+    monkeypatch.delenv('SALT_API_ACCEPT_ENCODING', raising=False)
+    assert 'gzip' in accept_encoding()
+
+    monkeypatch.setenv('SALT_API_ACCEPT_ENCODING', 'identity')
+    assert accept_encoding() == 'identity'
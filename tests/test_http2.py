@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+import requests
+
+import salt_api
+from salt_api.adapters import configure_session, TimeoutHTTPAdapter
+from salt_api.proposals import download, submit
+from salt_api.testing import HTTP2StandInServer, StandInServer
+
+pytest.importorskip('h2')
+pytest.importorskip('httpx')
+
+from salt_api.http2 import HTTP2Adapter  # noqa: E402
+
+
+@pytest.fixture()
+def http2_session(monkeypatch):
+    monkeypatch.setenv('SALT_API_HTTP2', 'prior-knowledge')
+    session = requests.Session()
+    configure_session(session)
+    monkeypatch.setattr(salt_api, '_session', session)
+
+    yield session
+
+    session.close()
+
+
+def test_configure_session_mounts_http2_adapter(http2_session):
+    """configure_session mounts an HTTP2Adapter if SALT_API_HTTP2 is set"""
+
+    adapter = http2_session.get_adapter('https://saltapi.salt.ac.za')
+    assert isinstance(adapter, HTTP2Adapter)
+    assert adapter.prior_knowledge
+    assert isinstance(adapter.fallback, TimeoutHTTPAdapter)
+
+
+def test_requests_are_multiplexed(http2_session):
+    """concurrent requests to an HTTP/2 server share a single connection"""
+
+    results = []
+
+    def get():
+        results.append(http2_session.get(server.base_url + '/proposals/2018-1-SCI-042/blocks/resolve',
+                                         params={'name': 'Block'}).json())
+
+    with HTTP2StandInServer(latency=0.2) as server:
+        threads = [threading.Thread(target=get) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [dict(code=1)] * 10
+    assert server.connections == 1
+
+
+def test_submit_and_download_over_http2(monkeypatch, http2_session, zip_file):
+    """submit and download work over HTTP/2, and session headers are sent"""
+
+    http2_session.headers['Authentication'] = 'Token stand-in-token'
+    content = b'PK\x05\x06' + bytes(18) + b'x' * 200000
+
+    with HTTP2StandInServer() as server:
+        monkeypatch.setenv('SALT_API_PROPOSALS_BASE_URL', server.base_url)
+        server.content = content
+        submit(zip_file, '2018-1-SCI-042')
+        path = download('2018-1-SCI-042', 'block', 'Block')
+
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert [request['method'] for request in server.requests] == ['OPTIONS', 'PUT', 'GET', 'GET']
+    assert all(request['http_version'] == 'HTTP/2' for request in server.requests)
+    assert server.requests[1]['headers']['authentication'] == 'Token stand-in-token'
+    assert 'connection' not in server.requests[1]['headers']
+
+
+def test_falls_back_to_http1(http2_session):
+    """requests are sent with HTTP/1.1 if the server doesn't support HTTP/2"""
+
+    with StandInServer() as server:
+        response = http2_session.get(server.base_url + '/proposals/2018-1-SCI-042/blocks/resolve')
+        http2_session.get(server.base_url + '/proposals/2018-1-SCI-042/blocks/resolve')
+
+    assert response.json() == dict(code=1)
+    assert http2_session.get_adapter(server.base_url).http_version(server.base_url) == 'HTTP/1.1'
+    assert [request['method'] for request in server.requests] == ['GET', 'GET']
@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+import salt_api
+from salt_api import limits
+from salt_api.limits import AdaptiveConcurrency, ClientLimiter, get_limiter, set_limiter, TokenBucket
+from salt_api.proposals import submit
+from salt_api.testing import StandInServer
+
+
+@pytest.fixture(autouse=True)
+def no_limiter(monkeypatch):
+    monkeypatch.setattr(limits, '_limiter', None)
+    for name in ('SALT_API_RATE_LIMIT', 'SALT_API_RATE_BURST', 'SALT_API_MAX_CONCURRENCY',
+                 'SALT_API_MIN_CONCURRENCY'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def make_response(status_code):
+    return MagicMock(status_code=status_code, headers={})
+
+
+def test_token_bucket_limits_rate():
+    """the token bucket lets a burst through and then limits the rate"""
+
+    bucket = TokenBucket(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+
+    for _ in range(10):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_window_increases_and_decreases():
+    """the window grows additively with successes and shrinks multiplicatively with throttled requests"""
+
+    concurrency = AdaptiveConcurrency(maximum=8, initial=4)
+    for _ in range(4):
+        concurrency.on_success()
+    assert 4.9 < concurrency.window < 5
+
+    concurrency.on_throttle(time.monotonic())
+    assert 2.4 < concurrency.window < 2.5
+
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.window == 8
+
+    for _ in range(10):
+        concurrency.on_throttle(time.monotonic())
+    assert concurrency.window == 1
+
+
+def test_stale_throttles_are_ignored():
+    """requests started before the last decrease don't decrease the window again"""
+
+    concurrency = AdaptiveConcurrency(maximum=8, initial=8)
+    started_at = time.monotonic()
+    time.sleep(0.001)
+    concurrency.on_throttle(started_at)
+    concurrency.on_throttle(started_at)
+
+    assert concurrency.window == 4
+
+
+def test_limiter_adjusts_window():
+    """the limiter decreases the window for throttled requests and connection errors, and increases it otherwise"""
+
+    limiter = ClientLimiter(concurrency=AdaptiveConcurrency(maximum=8, initial=4))
+
+    assert limiter.send(lambda: make_response(404)).status_code == 404
+    assert limiter.concurrency.window == 4.25
+
+    limiter.send(lambda: make_response(429))
+    assert limiter.concurrency.window == 2.125
+
+    time.sleep(0.001)
+    with pytest.raises(requests.ConnectionError):
+        limiter.send(MagicMock(side_effect=requests.ConnectionError()))
+    assert limiter.concurrency.window == 1.0625
+
+    limiter.send(lambda: make_response(500))
+    assert limiter.concurrency.window == 1.0625
+
+
+def test_operations_are_limited_by_window():
+    """no more operations than the window size run concurrently, and nested operations don't take another slot"""
+
+    limiter = ClientLimiter(concurrency=AdaptiveConcurrency(maximum=2, initial=2))
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def operation(_):
+        with limiter.operation():
+            with limiter.operation():
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.02)
+                with lock:
+                    running.pop()
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(operation, range(6)))
+
+    assert max(peak) == 2
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_limiter_from_environment(monkeypatch):
+    """the shared limiter is defined by environment variables, and requests aren't limited by default"""
+
+    assert get_limiter() is None
+
+    monkeypatch.setattr(limits, '_limiter', None)
+    monkeypatch.setenv('SALT_API_RATE_LIMIT', '20')
+    monkeypatch.setenv('SALT_API_MAX_CONCURRENCY', '16')
+    limiter = get_limiter()
+
+    assert limiter is get_limiter()
+    assert limiter.bucket.rate == 20
+    assert limiter.concurrency.maximum == 16
+    assert limiter.concurrency.window == 4
+
+    set_limiter(None)
+    assert get_limiter() is None
+
+
+def test_submissions_adapt_to_server_capacity(monkeypatch, tmp_path):
+    """concurrent submissions through the shared limiter back off when the server is overloaded and all succeed"""
+
+    monkeypatch.setattr(salt_api, '_session', requests.Session())
+    monkeypatch.setenv('SALT_API_MAX_RETRIES', '20')
+    monkeypatch.setenv('SALT_API_BACKOFF_FACTOR', '0.01')
+    monkeypatch.setenv('SALT_API_BACKOFF_MAX', '0.05')
+    path = str(tmp_path / 'proposal.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+    set_limiter(ClientLimiter(concurrency=AdaptiveConcurrency(maximum=8, initial=8)))
+
+    with StandInServer(latency=0.02, capacity=2) as server:
+        monkeypatch.setenv('SALT_API_PROPOSALS_BASE_URL', server.base_url)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: submit(path, '2018-1-SCI-042'), range(16)))
+
+    assert all(result.status_code == 200 for result in results)
+    assert get_limiter().concurrency.window < 8
+
+
+def test_async_send_and_operation():
+    """asyncio requests take tokens and adjust the window, and asyncio operations are limited by the window"""
+
+    limiter = ClientLimiter(TokenBucket(rate=100, burst=1), AdaptiveConcurrency(maximum=2, initial=2))
+    running = []
+    peak = []
+
+    async def request():
+        return MagicMock(status=200)
+
+    async def operation():
+        async with limiter.async_operation():
+            async with limiter.async_operation():
+                running.append(1)
+                peak.append(len(running))
+                await limiter.send_async(request)
+                await asyncio.sleep(0.02)
+                running.pop()
+
+    async def main():
+        await asyncio.gather(*[operation() for _ in range(6)])
+
+    start = time.monotonic()
+    asyncio.run(main())
+
+    assert max(peak) == 2
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.concurrency.window == 2
+    assert time.monotonic() - start >= 0.05
+
+
+def test_async_send_decreases_window_for_connection_errors():
+    """the given connection errors of asyncio requests decrease the window"""
+
+    limiter = ClientLimiter(concurrency=AdaptiveConcurrency(maximum=8, initial=4))
+
+    async def request():
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(limiter.send_async(request, (ConnectionResetError,)))
+    assert limiter.concurrency.window == 2
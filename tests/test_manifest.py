@@ -0,0 +1,33 @@
+from salt_api.manifest import Manifest
+
+
+def test_set_and_get(tmp_path):
+    """the recorded digests can be read back, also by another manifest instance for the same file"""
+
+    path = str(tmp_path / 'manifest.json')
+    Manifest(path).set('2018-1-SCI-042', 'abc', 'def', {'Block 1': '123'})
+
+    assert Manifest(path).get('2018-1-SCI-042') == dict(digest='abc', shell='def', blocks={'Block 1': '123'})
+    assert Manifest(path).get('2018-1-SCI-043') is None
+
+
+def test_set_block_invalidates_digest(tmp_path):
+    """recording a block keeps the other blocks and invalidates the digest of the whole content"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    manifest.set('2018-1-SCI-042', 'abc', 'def', {'Block 1': '123', 'Block 2': '456'})
+
+    manifest.set_block('2018-1-SCI-042', 'Block 2', '789')
+
+    assert manifest.get('2018-1-SCI-042') == dict(digest=None, shell='def', blocks={'Block 1': '123', 'Block 2': '789'})
+
+
+def test_remove(tmp_path):
+    """a proposal can be removed from the manifest"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    manifest.set('2018-1-SCI-042', 'abc')
+
+    manifest.remove('2018-1-SCI-042')
+
+    assert manifest.get('2018-1-SCI-042') is None
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import salt_api
+import salt_api.proposals
+import salt_api.retry
+from salt_api import metrics, SaltApiException
+from salt_api.metrics import Histogram, HistogramCollector
+from salt_api.proposals import download, submit
+
+
+@pytest.fixture()
+def measurements():
+    measurements = []
+    metrics.add_sink(measurements.append)
+
+    yield measurements
+
+    metrics.remove_sink(measurements.append)
+
+
+@pytest.fixture()
+def server(stand_in_server):
+    salt_api.proposals.get_block_ids().invalidate()
+
+    yield stand_in_server
+
+
+def test_no_measurement_without_sinks():
+    """Operations aren't measured if no sink is registered"""
+
+    assert metrics.measure('submit') is metrics._no_op
+    assert metrics.phase('upload') is metrics._no_op
+    assert metrics.current() is None
+
+
+def test_submit_measurement(server, measurements, proposal_dir):
+    """submit reports its phases, the bytes sent and the response status"""
+
+    submit(str(proposal_dir / 'Proposal.xml'), '2018-1-SCI-042')
+
+    measurement, = measurements
+    assert measurement.operation == 'submit'
+    assert {'scan', 'zip', 'upload', 'wait'} <= set(measurement.phases)
+    assert measurement.bytes_sent == server.requests[0]['body_size']
+    assert measurement.status_code == 200
+    assert measurement.error is None
+    assert measurement.duration >= sum(measurement.phases.values())
+
+
+def test_download_measurement(server, measurements):
+    """download reports its phases, the bytes received and the response status"""
+
+    server.content = b'PK' + os.urandom(100000)
+
+    os.remove(download('2018-1-SCI-042', 'Block', 'Block 1'))
+
+    measurement, = measurements
+    assert measurement.operation == 'download'
+    assert {'resolve', 'wait', 'transfer'} <= set(measurement.phases)
+    assert measurement.bytes_received == len(server.content)
+    assert measurement.status_code == 200
+
+
+def test_failure_measurement(server, measurements, zip_file, monkeypatch):
+    """Retries, the final status code and the error are reported for a failing submission"""
+
+    monkeypatch.setattr(salt_api.retry.time, 'sleep', lambda seconds: None)
+    monkeypatch.setenv('SALT_API_MAX_RETRIES', '2')
+    server.error_rate = 1
+
+    with pytest.raises(SaltApiException):
+        submit(zip_file, '2018-1-SCI-042')
+
+    measurement, = measurements
+    assert measurement.retries == 2
+    assert measurement.status_code == 503
+    assert isinstance(measurement.error, SaltApiException)
+
+
+def test_histogram_collector(server, zip_file):
+    """The histogram collector aggregates the measurements"""
+
+    collector = HistogramCollector()
+    metrics.add_sink(collector)
+    try:
+        for _ in range(3):
+            submit(zip_file, '2018-1-SCI-042')
+    finally:
+        metrics.remove_sink(collector)
+
+    summary = collector.summary()
+    assert summary['histograms']['submit.duration']['count'] == 3
+    assert summary['histograms']['submit.bytes_sent']['total'] == 3 * os.path.getsize(zip_file)
+    assert summary['status_codes'] == {'submit 200': 3}
+    assert summary['errors'] == {}
+
+
+def test_histogram_percentiles():
+    """Histogram percentiles are the upper bounds of the buckets containing them"""
+
+    histogram = Histogram((1, 2, 5, 10))
+    for value in (0.5, 1.5, 1.5, 4, 8, 20):
+        histogram.observe(value)
+
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(0.8) == 10
+    assert histogram.percentile(1) == 20
+    assert histogram.summary()['count'] == 6
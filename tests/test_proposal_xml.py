@@ -0,0 +1,124 @@
+import io
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from salt_api.proposal_xml import rewrite_paths
+
+
+NS = '{http://www.salt.ac.za/PIPT/Proposal/Phase2/4.8}'
+
+
+def test_rewrite_paths_keeps_other_content(proposal_dir):
+    """rewrite_paths only changes the text of Path elements"""
+
+    with open(str(proposal_dir / 'Proposal.xml'), 'rb') as f:
+        rewritten = rewrite_paths(f, str(proposal_dir))
+
+    with rewritten:
+        root = ET.fromstring(rewritten.xml_file.read())
+
+    assert rewritten.root_name == 'Proposal'
+    assert root.tag == NS + 'Proposal'
+    paths = [element.text for element in root.iter(NS + 'Path')]
+    assert [arcname for path, arcname in rewritten.files] == paths[:2]
+    assert paths[2] == 'auto-generated'
+
+
+def test_rewrite_paths_keeps_comments(proposal_dir):
+    """rewrite_paths keeps comments, including those in split off blocks, but drops the DOCTYPE declaration"""
+
+    xml = b"""<?xml version="1.0"?>
+<!DOCTYPE Proposal [<!-- internal subset -->]>
+<!-- before the root -->
+<Proposal>
+    <!-- in the root -->
+    <Block><Name>A</Name><!-- in a block --><Path><!-- in a path -->attachments/finder_chart.txt</Path></Block>
+    <Title><![CDATA[a < b]]></Title>
+</Proposal>"""
+
+    rewritten = rewrite_paths(io.BytesIO(xml), str(proposal_dir), split_blocks=True)
+
+    with rewritten:
+        content = rewritten.xml_file.read().decode()
+        block = rewritten.blocks['A'].xml_file.read().decode()
+
+    arcname = rewritten.files[0][1]
+    assert content == """<?xml version="1.0" encoding="utf-8"?>
+<!-- before the root --><Proposal>
+    <!-- in the root -->
+    <Block><Name>A</Name><!-- in a block --><Path>{arcname}</Path></Block>
+    <Title>a &lt; b</Title>
+</Proposal>""".format(arcname=arcname)
+    assert block == """<?xml version="1.0" encoding="utf-8"?>
+<Block><Name>A</Name><!-- in a block --><Path>{arcname}</Path></Block>""".format(arcname=arcname)
+
+
+def test_rewrite_paths_splits_blocks(proposal_dir):
+    """with split_blocks, every named top-level block is available as standalone XML"""
+
+    (proposal_dir / 'attachments' / 'other.txt').write_text('Other.')
+    xml = """<p:Proposal xmlns:p="http://x/p" xmlns="{ns}">
+    <Title>Title</Title>
+    <Block><Name>A</Name><Path>attachments/finder_chart.txt</Path></Block>
+    <Block><Name>B</Name><SubBlock><Block><Name>Nested</Name></Block></SubBlock><Path>attachments/other.txt</Path></Block>
+</p:Proposal>""".format(ns=NS[1:-1])
+
+    rewritten = rewrite_paths(io.BytesIO(xml.encode()), str(proposal_dir), split_blocks=True)
+
+    with rewritten:
+        assert sorted(rewritten.blocks) == ['A', 'B']
+        block = ET.fromstring(rewritten.blocks['B'].xml_file.read())
+        assert block.tag == NS + 'Block'
+        assert block.find(NS + 'Path').text in rewritten.blocks['B'].arcnames
+        assert len(rewritten.blocks['A'].arcnames) == 1
+
+
+def test_shell_digest_ignores_blocks(proposal_dir):
+    """the shell digest doesn't change if only a block changes"""
+
+    xml = '<Proposal><Title>{title}</Title><Block><Name>A</Name><Comment>{comment}</Comment></Block></Proposal>'
+
+    def digests(title, comment):
+        rewritten = rewrite_paths(io.BytesIO(xml.format(title=title, comment=comment).encode()), split_blocks=True)
+        with rewritten:
+            return rewritten.digest, rewritten.shell_digest, rewritten.blocks['A'].digest
+
+    original = digests('T', 'C')
+    block_changed = digests('T', 'changed')
+    title_changed = digests('changed', 'C')
+
+    assert block_changed[0] != original[0] and block_changed[1] == original[1] and block_changed[2] != original[2]
+    assert title_changed[1] != original[1] and title_changed[2] == original[2]
+
+
+def test_rewrite_paths_reports_all_missing_files(tmp_path):
+    """all missing files are reported together"""
+
+    xml = b'<Proposal><Path>a.pdf</Path><Block><Path>b.pdf</Path></Block></Proposal>'
+
+    with pytest.raises(FileNotFoundError) as excinfo:
+        rewrite_paths(io.BytesIO(xml), str(tmp_path))
+
+    assert 'a.pdf' in str(excinfo.value) and 'b.pdf' in str(excinfo.value)
+
+
+def test_rewrite_paths_memory_is_bounded(proposal_dir):
+    """rewriting large XML doesn't hold the whole document in memory"""
+
+    block = '<Block><Name>Block {i}</Name><Path>attachments/finder_chart.txt</Path><Comment>{comment}</Comment></Block>'
+    xml = '<Proposal>{blocks}</Proposal>'.format(
+        blocks=''.join(block.format(i=i, comment='x' * 500) for i in range(40000))).encode()
+    assert len(xml) > 20 * 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        rewritten = rewrite_paths(io.BytesIO(xml), str(proposal_dir))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    rewritten.close()
+
+    # the rewritten XML is spooled to disk; this allows for the spool buffer and parser buffers only
+    assert peak < 16 * 1024 * 1024
@@ -1,28 +1,1003 @@
+import email.parser
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
 from unittest.mock import MagicMock
+
+import pytest
+import requests
+
 import salt_api.proposals
-from salt_api.proposals import submit
+import salt_api.retry
+import salt_api.zipping
+from salt_api import SaltApiException
+from salt_api.cache import FileCache
+from salt_api.manifest import Manifest
+from salt_api.proposals import (download, download_archive, download_many, submit, submit_blocks, submit_many,
+                                zip_proposal_content)
+from salt_api.testing import StandInServer
+
+
+@pytest.fixture(autouse=True)
+def clear_block_ids():
+    salt_api.proposals.get_block_ids().invalidate()
+
+    yield
 
 
-def test_submit_put_with_proposal_code(monkeypatch, uri):
+def test_submit_put_with_proposal_code(monkeypatch, uri, zip_file):
     """submit makes a PUT request to /proposals/[proposal_code] if called with a proposal code"""
 
     mock_put = MagicMock()
     monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
 
-    submit('aaa', '2018-1-SCI-042')
+    submit(zip_file, '2018-1-SCI-042')
 
     mock_put.assert_called()
     assert mock_put.call_args[0][0] == uri('/proposals/2018-1-SCI-042')
 
 
-def test_submit_post_without_proposal_code(monkeypatch, uri):
+def test_submit_post_without_proposal_code(monkeypatch, uri, zip_file):
     """submit makes a POST request to /proposals if called without a proposal code"""
 
     mock_post = MagicMock()
     monkeypatch.setattr(salt_api.proposals.session, 'post', mock_post)
 
-    submit('aaaa')
+    submit(zip_file)
 
     mock_post.assert_called()
     assert mock_post.call_args[0][0] == uri('/proposals')
 
+
+def test_submit_streams_file_in_chunks(monkeypatch, zip_file):
+    """submit sends the file content as a generator of chunks of the requested size if memory mapping is disabled"""
+
+    monkeypatch.setenv('SALT_API_MEMORY_MAP', '0')
+    chunks = []
+
+    def mock_post(url, data, **kwargs):
+        chunks.extend(data)
+        return MagicMock()
+
+    monkeypatch.setattr(salt_api.proposals.session, 'post', mock_post)
+
+    submit(zip_file, chunk_size=10)
+
+    with open(zip_file, 'rb') as f:
+        content = f.read()
+    assert b''.join(chunks) == content
+    assert all(len(chunk) == 10 for chunk in chunks[:-1])
+
+
+def test_submit_accepts_file_objects(monkeypatch, zip_file):
+    """submit accepts a file object and leaves it open"""
+
+    chunks = []
+
+    def mock_post(url, data, **kwargs):
+        chunks.extend(data)
+        return MagicMock()
+
+    monkeypatch.setattr(salt_api.proposals.session, 'post', mock_post)
+
+    with open(zip_file, 'rb') as f:
+        submit(f)
+        assert not f.closed
+
+    with open(zip_file, 'rb') as f:
+        assert b''.join(chunks) == f.read()
+
+
+def test_submit_missing_file(monkeypatch):
+    """submit raises an exception if the file does not exist"""
+
+    monkeypatch.setattr(salt_api.proposals.session, 'post', MagicMock())
+
+    with pytest.raises(FileNotFoundError):
+        submit('/there/is/no/such/file.zip')
+
+
+def test_submit_rejects_non_zip_content(monkeypatch, tmp_path):
+    """submit raises an exception if the file is neither a zip file nor an XML file"""
+
+    monkeypatch.setattr(salt_api.proposals.session, 'post', MagicMock())
+    path = tmp_path / 'proposal.txt'
+    path.write_text('This is no zip file.')
+
+    with pytest.raises(ValueError):
+        submit(str(path))
+
+
+def test_submit_server_error(monkeypatch, zip_file):
+    """submit raises an exception with the error message returned by the server"""
+
+    response = MagicMock(ok=False, status_code=400)
+    response.json.return_value = {'error': 'Invalid proposal.'}
+    monkeypatch.setattr(salt_api.proposals.session, 'post', MagicMock(return_value=response))
+
+    with pytest.raises(SaltApiException) as excinfo:
+        submit(zip_file)
+
+    assert excinfo.value.message == 'Invalid proposal.'
+    assert excinfo.value.status_code == 400
+
+
+SUBMIT_SCRIPT = """
+import resource
+import sys
+
+import requests
+
+import salt_api
+import salt_api.proposals
+
+salt_api._session = requests.Session()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+salt_api.proposals.submit(sys.argv[1], '2018-1-SCI-042', chunk_size=64 * 1024)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(after - before)
+"""
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='ru_maxrss is measured in kilobytes on Linux only')
+def test_submit_memory_stays_bounded(tmp_path):
+    """submitting a large file does not increase the peak memory usage by more than a few chunks"""
+
+    size = 64 * 1024 * 1024
+    path = str(tmp_path / 'large.zip')
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as z:
+        with z.open('large.bin', 'w', force_zip64=True) as member:
+            block = bytes(1024 * 1024)
+            for _ in range(size // len(block)):
+                member.write(block)
+
+    with StandInServer() as server:
+        env = dict(os.environ, SALT_API_PROPOSALS_BASE_URL=server.base_url)
+        output = subprocess.run([sys.executable, '-c', SUBMIT_SCRIPT, path],
+                                env=env,
+                                stdout=subprocess.PIPE,
+                                check=True).stdout
+
+    assert server.requests[0]['body_size'] == os.path.getsize(path)
+    assert int(output) < 16 * 1024  # kilobytes
+
+
+def test_submit_memory_maps_files(stand_in_server, monkeypatch, tmp_path):
+    """submit sends an on-disk file from memory-mapped windows with a Content-Length header"""
+
+    monkeypatch.setattr(salt_api.proposals, 'MMAP_WINDOW', 64 * 1024)
+    path = tmp_path / 'proposal.zip'
+    with zipfile.ZipFile(str(path), 'w', compression=zipfile.ZIP_STORED) as z:
+        z.writestr('noise.bin', os.urandom(200 * 1024))
+
+    with open(str(path), 'rb') as f:
+        f.seek(1000)
+        body = salt_api.proposals._memory_mapped_body(f, None)
+        window_sizes = [len(view) for view in body]
+    assert window_sizes == [64 * 1024 - 1000, 64 * 1024, 64 * 1024, path.stat().st_size - 192 * 1024]
+    submit(str(path), '2018-1-SCI-042')
+
+    request = stand_in_server.requests[0]
+    assert request['headers']['Content-Length'] == str(path.stat().st_size)
+    assert request['body_size'] == path.stat().st_size
+
+
+def test_submit_compresses_request_body(stand_in_server, monkeypatch, tmp_path):
+    """submit sends a gzip-encoded body if compression is enabled and worthwhile"""
+
+    monkeypatch.setenv('SALT_API_REQUEST_ENCODING', 'gzip')
+    path = tmp_path / 'proposal.zip'
+    with zipfile.ZipFile(str(path), 'w', compression=zipfile.ZIP_STORED) as z:
+        z.writestr('Proposal.xml', '<Proposal><Target/></Proposal>' * 10000)
+
+    submit(str(path), '2018-1-SCI-042')
+
+    request = stand_in_server.requests[0]
+    assert request['headers']['Content-Encoding'] == 'gzip'
+    assert request['body_size'] < path.stat().st_size / 10
+
+
+def test_submit_sends_compressed_zip_as_is(stand_in_server, monkeypatch, tmp_path):
+    """submit doesn't encode zip files whose members are compressed already"""
+
+    monkeypatch.setenv('SALT_API_REQUEST_ENCODING', 'gzip')
+    path = tmp_path / 'proposal.zip'
+    with zipfile.ZipFile(str(path), 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('Proposal.xml', '<Proposal><Target/></Proposal>' * 10000)
+
+    submit(str(path), '2018-1-SCI-042')
+
+    assert 'Content-Encoding' not in stand_in_server.requests[0]['headers']
+
+
+def test_download_decodes_encoded_content(stand_in_server, monkeypatch):
+    """download sends an Accept-Encoding header and saves the decoded content"""
+
+    monkeypatch.setenv('SALT_API_ACCEPT_ENCODING', 'gzip')
+    content = b'PK\x05\x06' + bytes(18) * 1000
+
+    stand_in_server.content = content
+    stand_in_server.compress_responses = True
+    path = download('2018-1-SCI-042', 'proposal')
+
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    os.remove(path)
+    assert stand_in_server.requests[0]['headers']['Accept-Encoding'] == 'gzip'
+
+
+def make_response(status_code=200, chunks=(), headers=None, json=None):
+    response = MagicMock(ok=status_code < 400, status_code=status_code, headers=headers or {})
+    response.iter_content.return_value = iter(chunks)
+    response.json.return_value = json
+    return response
+
+
+def test_download_proposal(monkeypatch, uri):
+    """download requests a proposal as a zip file and saves it in a temporary zip file"""
+
+    mock_get = MagicMock(return_value=make_response(chunks=[b'PK', b'content']))
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    path = download('2018-1-SCI-042', 'Proposal')
+
+    try:
+        assert mock_get.call_args[0][0] == uri('/proposals/2018-1-SCI-042')
+        assert mock_get.call_args[1]['headers']['Accept'] == 'application/zip'
+        assert mock_get.call_args[1]['stream']
+        assert os.path.isabs(path)
+        assert path.endswith('.zip')
+        with open(path, 'rb') as f:
+            assert f.read() == b'PKcontent'
+    finally:
+        os.remove(path)
+
+
+def test_download_block(monkeypatch, uri):
+    """download resolves the block name and requests the block with the resolved id"""
+
+    mock_get = MagicMock(side_effect=[make_response(json={'code': 17}), make_response(chunks=[b'block'])])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    path = download('2018-1-SCI-042', 'BLOCK', 'Deep Field')
+    os.remove(path)
+
+    resolve_call, block_call = mock_get.call_args_list
+    assert resolve_call[0][0] == uri('/proposals/2018-1-SCI-042/blocks/resolve')
+    assert resolve_call[1]['params'] == {'name': 'Deep Field'}
+    assert block_call[0][0] == uri('/proposals/2018-1-SCI-042/blocks/17')
+    assert block_call[1]['headers']['Accept'] == 'application/zip'
+
+
+@pytest.mark.parametrize('content_type,name', [('observation', 'A'), ('block', None), ('block', '')])
+def test_download_invalid_arguments(content_type, name):
+    """download raises an exception for an invalid content type or a block without name"""
+
+    with pytest.raises(ValueError):
+        download('2018-1-SCI-042', content_type, name)
+
+
+def test_download_server_error(monkeypatch):
+    """download raises an exception with the error message returned by the server and removes the temporary file"""
+
+    mock_get = MagicMock(return_value=make_response(status_code=404, json={'error': 'No such proposal.'}))
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+    mock_remove = MagicMock(side_effect=os.remove)
+    monkeypatch.setattr(salt_api.proposals.os, 'remove', mock_remove)
+
+    with pytest.raises(SaltApiException) as excinfo:
+        download('2018-1-SCI-042', 'proposal')
+
+    assert excinfo.value.message == 'No such proposal.'
+    assert not os.path.exists(mock_remove.call_args[0][0])
+
+
+def test_download_resumes_after_connection_drop(monkeypatch):
+    """download resumes an interrupted download with a Range request"""
+
+    def interrupted_chunks():
+        yield b'0123'
+        raise requests.exceptions.ChunkedEncodingError()
+
+    first = make_response(headers={'Content-Length': '10', 'ETag': '"abc"'})
+    first.iter_content.return_value = interrupted_chunks()
+    second = make_response(status_code=206, chunks=[b'456789'], headers={'Content-Length': '6'})
+    mock_get = MagicMock(side_effect=[first, second])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    path = download('2018-1-SCI-042', 'proposal')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    os.remove(path)
+    assert mock_get.call_args[1]['headers']['Range'] == 'bytes=4-'
+    assert mock_get.call_args[1]['headers']['If-Range'] == '"abc"'
+
+
+def test_download_resumes_after_read_timeout(monkeypatch):
+    """download is resumed if the response doesn't arrive within the read timeout"""
+
+    response = make_response(chunks=[b'0123456789'], headers={'Content-Length': '10'})
+    mock_get = MagicMock(side_effect=[requests.ReadTimeout(), response])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    path = download('2018-1-SCI-042', 'proposal')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    os.remove(path)
+    assert mock_get.call_count == 2
+
+
+def test_download_restarts_if_range_is_ignored(monkeypatch):
+    """download starts from scratch if the server ignores the Range header"""
+
+    first = make_response(chunks=[b'0123'], headers={'Content-Length': '10'})
+    second = make_response(status_code=200, chunks=[b'0123456789'], headers={'Content-Length': '10'})
+    monkeypatch.setattr(salt_api.proposals.session, 'get', MagicMock(side_effect=[first, second]))
+
+    path = download('2018-1-SCI-042', 'proposal')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    os.remove(path)
+
+
+def test_download_restarts_encoded_content(monkeypatch):
+    """download starts from scratch rather than resuming if the interrupted response had a content coding"""
+
+    def interrupted_chunks():
+        yield b'0123'
+        raise requests.exceptions.ChunkedEncodingError()
+
+    first = make_response(headers={'Content-Encoding': 'gzip', 'Content-Length': '8'})
+    first.iter_content.return_value = interrupted_chunks()
+    second = make_response(chunks=[b'0123456789'], headers={'Content-Length': '10'})
+    mock_get = MagicMock(side_effect=[first, second])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    path = download('2018-1-SCI-042', 'proposal')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    os.remove(path)
+    assert 'Range' not in mock_get.call_args[1]['headers']
+
+
+def test_download_gives_up_after_max_resumes(monkeypatch):
+    """download raises an exception if the connection keeps dropping"""
+
+    mock_get = MagicMock(side_effect=requests.ConnectionError())
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    with pytest.raises(requests.ConnectionError):
+        download('2018-1-SCI-042', 'proposal', max_resumes=2)
+
+    assert mock_get.call_count == 3
+
+
+def test_submit_many_returns_result_or_exception_per_item(monkeypatch, zip_file):
+    """submit_many returns a result for every submission, in order, and a failure doesn't abort the batch"""
+
+    def mock_put(url, data, **kwargs):
+        if url.endswith('2018-1-SCI-002'):
+            return make_response(status_code=500, json={'error': 'Oops.'})
+        return make_response()
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    items = [(zip_file, '2018-1-SCI-001'), (zip_file, '2018-1-SCI-002'), ('/no/such/file.zip', '2018-1-SCI-003')]
+    results = submit_many(items, max_workers=3)
+
+    assert [result.item for result in results] == items
+    assert results[0].exception is None and results[0].result.ok
+    assert isinstance(results[1].exception, SaltApiException)
+    assert isinstance(results[2].exception, FileNotFoundError)
+
+
+def test_download_many(monkeypatch):
+    """download_many downloads every requested item"""
+
+    monkeypatch.setattr(salt_api.proposals.session, 'get',
+                        MagicMock(side_effect=lambda *args, **kwargs: make_response(chunks=[b'zip'])))
+
+    results = download_many([('2018-1-SCI-001', 'proposal'), ('2018-1-SCI-002', 'proposal')])
+
+    for result in results:
+        assert result.exception is None
+        os.remove(result.result)
+
+
+def slow_post(max_in_flight):
+    # A mock POST method taking 50 ms, which appends the number of requests in flight to max_in_flight.
+    lock = threading.Lock()
+    in_flight = []
+
+    def mock_post(url, data, **kwargs):
+        with lock:
+            in_flight.append(1)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.pop()
+        return make_response()
+
+    return mock_post
+
+
+def test_batch_caps_requests_per_host(monkeypatch, zip_file):
+    """submit_many makes no more concurrent requests to a host than allowed"""
+
+    max_in_flight = []
+    monkeypatch.setattr(salt_api.proposals.session, 'post', slow_post(max_in_flight))
+
+    submit_many([zip_file] * 10, max_workers=10, max_per_host=3)
+
+    assert max(max_in_flight) <= 3
+
+
+def test_batch_uses_its_own_limit_per_host(monkeypatch, zip_file):
+    """a batch isn't limited by the max_per_host of an earlier batch for the same host"""
+
+    max_in_flight = []
+    monkeypatch.setattr(salt_api.proposals.session, 'post', slow_post(max_in_flight))
+
+    submit_many([zip_file] * 4, max_workers=4, max_per_host=2)
+    assert max(max_in_flight) == 2
+
+    del max_in_flight[:]
+    submit_many([zip_file] * 10, max_workers=10, max_per_host=5)
+    assert max(max_in_flight) == 5
+
+
+def parse_multipart(content_type, body):
+    message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n'
+                                                    + body)
+    return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+
+def test_submit_blocks_sends_one_multipart_request(monkeypatch, zip_file, tmp_path):
+    """submit_blocks sends all blocks as zip parts of a single streamed request and maps the results to the blocks"""
+
+    block_xml = tmp_path / 'Block.xml'
+    block_xml.write_text('<Block><Name>Block 2</Name></Block>')
+    requests_made = []
+
+    def mock_put(url, data, headers, **kwargs):
+        assert not isinstance(data, bytes)
+        requests_made.append((url, parse_multipart(headers['Content-Type'], b''.join(data))))
+        return make_response(json={'blocks': {'block-0': {'code': 7}, 'block-1': {'error': 'Invalid block.'}}})
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    results = submit_blocks('2018-1-SCI-042', [zip_file, str(block_xml)])
+
+    assert len(requests_made) == 1
+    url, parts = requests_made[0]
+    assert url.endswith('/proposals/2018-1-SCI-042')
+    with open(zip_file, 'rb') as f:
+        assert parts['block-0'] == f.read()
+    with zipfile.ZipFile(io.BytesIO(parts['block-1'])) as z:
+        assert b'<Name>Block 2</Name>' in z.read('Block.xml')
+    assert results[0].result == {'code': 7} and results[0].exception is None
+    assert isinstance(results[1].exception, SaltApiException) and results[1].exception.message == 'Invalid block.'
+
+
+def test_submit_blocks_skips_blocks_which_cannot_be_built(monkeypatch, zip_file, tmp_path):
+    """submit_blocks leaves out blocks whose zip file can't be built and returns their exceptions"""
+
+    block_xml = tmp_path / 'Block.xml'
+    block_xml.write_text('<Block><Path>missing.pdf</Path></Block>')
+    parts = {}
+
+    def mock_put(url, data, headers, **kwargs):
+        parts.update(parse_multipart(headers['Content-Type'], b''.join(data)))
+        return make_response(json={'blocks': {'block-1': {'code': 8}}})
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    results = submit_blocks('2018-1-SCI-042', [str(block_xml), zip_file])
+
+    assert list(parts) == ['block-1']
+    assert isinstance(results[0].exception, FileNotFoundError)
+    assert results[1].result == {'code': 8}
+
+
+def test_submit_blocks_builds_parts_while_uploading(monkeypatch, zip_file):
+    """submit_blocks builds the zip file of the next block while the previous block is uploaded"""
+
+    built = [threading.Event() for _ in range(3)]
+    block_part = salt_api.proposals._block_part
+
+    def recording_block_part(block):
+        part = block_part(block)
+        built[len([event for event in built if event.is_set()])].set()
+        return part
+
+    def mock_put(url, data, headers, **kwargs):
+        data = iter(data)
+        next(data)
+        # the first part is being uploaded, and the second one is built
+        assert built[1].wait(5)
+        assert not built[2].is_set()
+        list(data)
+        return make_response(json={'blocks': {}})
+
+    monkeypatch.setattr(salt_api.proposals, '_block_part', recording_block_part)
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    submit_blocks('2018-1-SCI-042', [zip_file] * 3, max_ahead=1)
+
+    assert all(event.is_set() for event in built)
+
+
+def read_paths(xml):
+    return [element.text for element in ET.fromstring(xml).iter('{http://www.salt.ac.za/PIPT/Proposal/Phase2/4.8}Path')]
+
+
+def test_zip_proposal_content(proposal_dir, tmp_path):
+    """zip_proposal_content zips the XML and the referenced files, replacing the file paths"""
+
+    zip_path = str(tmp_path / 'out.zip')
+
+    zip_proposal_content(zip_path, str(proposal_dir / 'Proposal.xml'))
+
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None
+        paths = read_paths(z.read('Proposal.xml'))
+        assert paths[2] == 'auto-generated'
+        assert all(path.startswith('Included/') for path in paths[:2])
+        assert paths[0].endswith('.txt') and paths[1].endswith('.fits')
+        assert z.read(paths[0]) == (proposal_dir / 'attachments' / 'finder_chart.txt').read_bytes()
+        assert z.read(paths[1]) == (proposal_dir / 'attachments' / 'noise.fits').read_bytes()
+        assert z.getinfo(paths[0]).compress_type == zipfile.ZIP_DEFLATED
+        assert z.getinfo(paths[1]).compress_type == zipfile.ZIP_STORED
+
+
+def test_zip_proposal_content_reuses_cached_entries(monkeypatch, proposal_dir, tmp_path):
+    """rebuilding an unchanged proposal gives the same file names and reuses the cached compressed attachments"""
+
+    cache = FileCache(str(tmp_path / 'cache'), max_size=10 * 1024 * 1024)
+    xml = str(proposal_dir / 'Proposal.xml')
+    zip_proposal_content(str(tmp_path / 'first.zip'), xml, cache=cache)
+
+    monkeypatch.setattr(salt_api.zipping, '_deflate', MagicMock(side_effect=AssertionError('not cached')))
+    zip_proposal_content(str(tmp_path / 'second.zip'), xml, cache=cache)
+
+    with zipfile.ZipFile(str(tmp_path / 'first.zip')) as first, zipfile.ZipFile(str(tmp_path / 'second.zip')) as second:
+        assert second.testzip() is None
+        assert first.namelist() == second.namelist()
+        for name in first.namelist():
+            assert first.read(name) == second.read(name)
+
+
+def test_zip_proposal_content_reports_all_missing_files(tmp_path):
+    """zip_proposal_content raises an exception listing all the missing files"""
+
+    xml = tmp_path / 'Proposal.xml'
+    xml.write_text('<Proposal><Path>missing.pdf</Path><Path>/also/missing.pdf</Path></Proposal>')
+
+    with pytest.raises(FileNotFoundError) as excinfo:
+        zip_proposal_content(str(tmp_path / 'out.zip'), str(xml))
+
+    assert 'missing.pdf' in str(excinfo.value)
+    assert '/also/missing.pdf' in str(excinfo.value)
+
+
+def test_zip_proposal_content_rejects_relative_paths_without_parent_dir(proposal_dir, tmp_path):
+    """zip_proposal_content doesn't allow relative paths if the parent directory is unknown"""
+
+    with open(str(proposal_dir / 'Proposal.xml'), 'rb') as f:
+        with pytest.raises(ValueError):
+            zip_proposal_content(str(tmp_path / 'out.zip'), f)
+
+
+def test_zip_proposal_content_spools_in_memory(monkeypatch, proposal_dir):
+    """zip_proposal_content builds a small zip file in memory if no zip file is passed"""
+
+    monkeypatch.setattr(tempfile, 'TemporaryFile', MagicMock(side_effect=AssertionError('written to disk')))
+
+    with zip_proposal_content(None, str(proposal_dir / 'Proposal.xml')) as f:
+        assert f.tell() == 0
+        with zipfile.ZipFile(f) as z:
+            assert z.testzip() is None
+            assert len(z.namelist()) == 3
+
+
+def test_zip_proposal_content_spills_to_disk(monkeypatch, proposal_dir):
+    """zip_proposal_content moves the zip file to disk once it exceeds SALT_API_ZIP_SPOOL_SIZE"""
+
+    monkeypatch.setenv('SALT_API_ZIP_SPOOL_SIZE', '1024')
+    temporary_file = MagicMock(wraps=tempfile.TemporaryFile)
+    monkeypatch.setattr(tempfile, 'TemporaryFile', temporary_file)
+
+    with zip_proposal_content(None, str(proposal_dir / 'Proposal.xml')) as f:
+        temporary_file.assert_called_once()
+        with zipfile.ZipFile(f) as z:
+            assert z.testzip() is None
+
+
+def test_submit_zips_xml_file(monkeypatch, proposal_dir):
+    """submit builds a zip file from an XML file and submits it"""
+
+    chunks = []
+
+    def mock_put(url, data, **kwargs):
+        chunks.extend(data)
+        return MagicMock()
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    submit(str(proposal_dir / 'Proposal.xml'), '2018-1-SCI-042')
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as z:
+        assert len(z.namelist()) == 3
+        assert 'Proposal.xml' in z.namelist()
+
+
+BLOCKS_XML = """<Proposal xmlns="http://www.salt.ac.za/PIPT/Proposal/Phase2/4.8">
+    <Title>{title}</Title>
+    <Block><Name>Block 1</Name><Path>attachments/finder_chart.txt</Path><Comment>{comment_1}</Comment></Block>
+    <Block><Name>Block 2</Name><Path>attachments/noise.fits</Path><Comment>{comment_2}</Comment></Block>
+</Proposal>"""
+
+
+def submit_blocks_xml(monkeypatch, proposal_dir, manifest, title='Title', comment_1='A', comment_2='B'):
+    zips = []
+
+    def mock_put(url, data, **kwargs):
+        zips.append(zipfile.ZipFile(io.BytesIO(b''.join(data))))
+        return make_response()
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+    xml = proposal_dir / 'Proposal.xml'
+    xml.write_text(BLOCKS_XML.format(title=title, comment_1=comment_1, comment_2=comment_2))
+    submit(str(xml), '2018-1-SCI-042', manifest=manifest)
+    return zips
+
+
+def test_submit_skips_unchanged_content(monkeypatch, proposal_dir, tmp_path):
+    """submit doesn't submit content which hasn't changed since the last submission"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+
+    assert len(submit_blocks_xml(monkeypatch, proposal_dir, manifest)) == 1
+    assert len(submit_blocks_xml(monkeypatch, proposal_dir, manifest)) == 0
+
+
+def test_submit_skips_unchanged_zip_file(monkeypatch, zip_file, tmp_path):
+    """submit doesn't submit a zip file which hasn't changed since the last submission"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    mock_put = MagicMock()
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    submit(zip_file, '2018-1-SCI-042', manifest=manifest)
+    assert submit(zip_file, '2018-1-SCI-042', manifest=manifest) is None
+
+    assert mock_put.call_count == 1
+
+
+def test_submit_only_changed_blocks(monkeypatch, proposal_dir, tmp_path):
+    """submit only submits the changed blocks if nothing else has changed"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    submit_blocks_xml(monkeypatch, proposal_dir, manifest)
+
+    zips = submit_blocks_xml(monkeypatch, proposal_dir, manifest, comment_2='changed')
+
+    assert len(zips) == 1
+    block_xml = zips[0].read('Block.xml')
+    assert b'Block 2' in block_xml and b'changed' in block_xml
+    assert len(zips[0].namelist()) == 2
+    assert len(submit_blocks_xml(monkeypatch, proposal_dir, manifest, comment_2='changed')) == 0
+
+
+def test_submit_whole_proposal_if_not_only_blocks_changed(monkeypatch, proposal_dir, tmp_path):
+    """submit submits the whole proposal if content outside the blocks has changed"""
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    submit_blocks_xml(monkeypatch, proposal_dir, manifest)
+
+    zips = submit_blocks_xml(monkeypatch, proposal_dir, manifest, title='New title', comment_2='changed')
+
+    assert len(zips) == 1
+    assert 'Proposal.xml' in zips[0].namelist()
+
+
+def test_download_caches_block_ids(monkeypatch, uri, zip_file):
+    """download resolves a block name only once, until a submission for the proposal is made"""
+
+    def mock_get(url, **kwargs):
+        if url.endswith('/resolve'):
+            return make_response(json={'code': 17})
+        return make_response(chunks=[b'block'])
+
+    mock_get = MagicMock(side_effect=mock_get)
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+    monkeypatch.setattr(salt_api.proposals.session, 'put', MagicMock())
+
+    def resolve_count():
+        return len([call for call in mock_get.call_args_list if call[0][0].endswith('/resolve')])
+
+    for _ in range(3):
+        os.remove(download('2018-1-SCI-042', 'block', 'Deep Field'))
+    assert resolve_count() == 1
+
+    submit(zip_file, '2018-1-SCI-042')
+    os.remove(download('2018-1-SCI-042', 'block', 'Deep Field'))
+    assert resolve_count() == 2
+
+
+def test_block_id_cache_reads_environment(monkeypatch):
+    """the block id cache is created when it is first used, with the size and time to live in the environment"""
+
+    monkeypatch.setattr(salt_api.proposals, '_block_ids', None)
+    monkeypatch.setenv('SALT_API_BLOCK_CACHE_SIZE', '10')
+    monkeypatch.setenv('SALT_API_BLOCK_CACHE_TTL', '5')
+
+    block_ids = salt_api.proposals.get_block_ids()
+
+    assert block_ids is salt_api.proposals.get_block_ids()
+    assert block_ids.max_size == 10
+    assert block_ids.ttl == 5
+
+
+def test_download_uses_cached_content_if_not_modified(monkeypatch, tmp_path):
+    """download sends the cached ETag and Last-Modified and uses the cached content if the server responds with 304"""
+
+    last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    mock_get = MagicMock(side_effect=[
+        make_response(chunks=[b'zip content'], headers={'ETag': '"v1"', 'Last-Modified': last_modified}),
+        make_response(status_code=304)])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+    cache = FileCache(str(tmp_path / 'cache'), max_size=1024 * 1024)
+
+    paths = [download('2018-1-SCI-042', 'proposal', cache=cache) for _ in range(2)]
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read() == b'zip content'
+        os.remove(path)
+    assert 'If-None-Match' not in mock_get.call_args_list[0][1]['headers']
+    assert mock_get.call_args_list[1][1]['headers']['If-None-Match'] == '"v1"'
+    assert mock_get.call_args_list[1][1]['headers']['If-Modified-Since'] == last_modified
+
+
+def test_download_updates_modified_content_in_cache(monkeypatch, tmp_path):
+    """download replaces the cached content if it has been modified"""
+
+    mock_get = MagicMock(side_effect=[make_response(chunks=[b'old'], headers={'ETag': '"v1"'}),
+                                      make_response(chunks=[b'new'], headers={'ETag': '"v2"'}),
+                                      make_response(status_code=304)])
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+    cache = FileCache(str(tmp_path / 'cache'), max_size=1024 * 1024)
+
+    paths = [download('2018-1-SCI-042', 'proposal', cache=cache) for _ in range(3)]
+
+    with open(paths[2], 'rb') as f:
+        assert f.read() == b'new'
+    for path in paths:
+        os.remove(path)
+    assert mock_get.call_args_list[2][1]['headers']['If-None-Match'] == '"v2"'
+
+
+def test_submit_retries_put_requests(monkeypatch, zip_file):
+    """a PUT request is retried after a 503 response, sending the whole file again"""
+
+    monkeypatch.setattr(salt_api.retry.time, 'sleep', lambda delay: None)
+    bodies = []
+    responses = [make_response(status_code=503), make_response()]
+
+    def mock_put(url, data, **kwargs):
+        bodies.append(b''.join(data))
+        return responses.pop(0)
+
+    monkeypatch.setattr(salt_api.proposals.session, 'put', mock_put)
+
+    submit(zip_file, '2018-1-SCI-042')
+
+    with open(zip_file, 'rb') as f:
+        assert bodies == [f.read()] * 2
+
+
+def test_submit_does_not_retry_post_requests(monkeypatch, zip_file):
+    """a POST request is not retried, as it isn't idempotent"""
+
+    mock_post = MagicMock(return_value=make_response(status_code=503, json={'error': 'Unavailable.'}))
+    monkeypatch.setattr(salt_api.proposals.session, 'post', mock_post)
+
+    with pytest.raises(SaltApiException):
+        submit(zip_file)
+
+    assert mock_post.call_count == 1
+
+
+def test_download_extract_to(stand_in_server, monkeypatch, tmp_path):
+    """download extracts the zip file into a directory while it is downloaded if extract_to is passed"""
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+        z.writestr('Included/chart.txt', 'Finder chart. ' * 1000)
+
+    stand_in_server.content = content.getvalue()
+    directory = download('2018-1-SCI-042', 'Proposal', extract_to=str(tmp_path / 'proposal'))
+
+    assert directory == str(tmp_path / 'proposal')
+    assert (tmp_path / 'proposal' / 'Proposal.xml').read_text() == '<Proposal/>'
+    assert (tmp_path / 'proposal' / 'Included' / 'chart.txt').read_text() == 'Finder chart. ' * 1000
+    assert len(stand_in_server.requests) == 1
+
+
+def test_download_extract_to_falls_back(stand_in_server, monkeypatch, tmp_path):
+    """download falls back to downloading the whole zip file if it can't be extracted while downloading"""
+
+    monkeypatch.setattr(salt_api.proposals, 'stream_extract',
+                        MagicMock(side_effect=salt_api.proposals.StreamingNotSupported()))
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+
+    stand_in_server.content = content.getvalue()
+    download('2018-1-SCI-042', 'Proposal', extract_to=str(tmp_path))
+
+    assert (tmp_path / 'Proposal.xml').read_text() == '<Proposal/>'
+    assert len(stand_in_server.requests) == 2
+
+
+def test_download_extract_to_falls_back_after_timeout(monkeypatch, tmp_path):
+    """download falls back to downloading the whole zip file if the stream times out, without partial files"""
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+        z.writestr('Included/noise.fits', os.urandom(100000))
+    content = content.getvalue()
+
+    def timed_out_chunks():
+        yield content[:len(content) // 2]
+        raise requests.ReadTimeout()
+
+    first = make_response()
+    first.iter_content.return_value = timed_out_chunks()
+    second = make_response(chunks=[content], headers={'Content-Length': str(len(content))})
+    responses = [first, second]
+    directory = tmp_path / 'proposal'
+    existing = []
+
+    def get(*args, **kwargs):
+        existing.append(directory.exists())
+        return responses.pop(0)
+
+    monkeypatch.setattr(salt_api.proposals.session, 'get', get)
+
+    download('2018-1-SCI-042', 'Proposal', extract_to=str(directory))
+
+    assert existing == [False, False]
+    assert (directory / 'Proposal.xml').read_text() == '<Proposal/>'
+    assert (directory / 'Included' / 'noise.fits').stat().st_size == 100000
+    assert os.listdir(str(tmp_path)) == ['proposal']
+
+
+def test_download_archive(monkeypatch):
+    """download_archive returns a lazy view of the downloaded zip file"""
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+    mock_get = MagicMock(return_value=make_response(chunks=[content.getvalue()]))
+    monkeypatch.setattr(salt_api.proposals.session, 'get', mock_get)
+
+    with download_archive('2018-1-SCI-042', 'Proposal') as archive:
+        assert archive.xml() == b'<Proposal/>'
+        path = archive.path
+
+    assert not os.path.exists(path)
+
+
+@pytest.fixture()
+def large_zip_file(tmp_path):
+    path = tmp_path / 'large.zip'
+    with zipfile.ZipFile(str(path), 'w') as z:
+        z.writestr('Proposal.xml', '<Proposal/>')
+        z.writestr('Included/noise.fits', os.urandom(100000))
+
+    yield str(path)
+
+
+@pytest.fixture()
+def resumable_server(stand_in_server, monkeypatch):
+    monkeypatch.setenv('SALT_API_RESUMABLE_UPLOAD_SIZE', '50000')
+    monkeypatch.setenv('SALT_API_UPLOAD_CHUNK_SIZE', '16384')
+    monkeypatch.setenv('SALT_API_MAX_RETRIES', '0')
+
+    yield stand_in_server
+
+
+def chunk_requests(server):
+    return [request for request in server.requests if '/chunks/' in request['path']]
+
+
+def test_submit_uses_resumable_upload_for_large_files(resumable_server, zip_file, large_zip_file):
+    """files of at least SALT_API_RESUMABLE_UPLOAD_SIZE bytes are uploaded in checksummed chunks"""
+
+    response = submit(large_zip_file, '2018-1-SCI-042')
+
+    with open(large_zip_file, 'rb') as f:
+        content = f.read()
+    assert response.json() == {'received': len(content)}
+    upload, = resumable_server.uploads.values()
+    assert upload['content'] == content
+    assert upload['description']['proposal_code'] == '2018-1-SCI-042'
+    assert len(chunk_requests(resumable_server)) == len(upload['description']['chunks']) == 7
+
+    submit(zip_file, '2018-1-SCI-042')
+    assert resumable_server.requests[-1]['path'] == '/proposals/2018-1-SCI-042'
+
+
+def fail_chunks_once(monkeypatch, session, indices):
+    # the first PUT request for each of the chunks raises a connection error
+    put = session.put
+    failing = {'/chunks/{index}'.format(index=index) for index in indices}
+
+    def failing_put(url, **kwargs):
+        path = url[url.rindex('/chunks/'):]
+        if path in failing:
+            failing.remove(path)
+            raise requests.ConnectionError()
+        return put(url, **kwargs)
+
+    monkeypatch.setattr(session, 'put', failing_put)
+
+
+def test_resumable_upload_resumes_after_failures(monkeypatch, resumable_server, large_zip_file):
+    """a failed resumable upload is resumed, and only the missing chunks are sent again"""
+
+    fail_chunks_once(monkeypatch, salt_api._session, [2, 5])
+
+    submit(large_zip_file, '2018-1-SCI-042')
+
+    upload, = resumable_server.uploads.values()
+    with open(large_zip_file, 'rb') as f:
+        assert upload['content'] == f.read()
+    assert len(chunk_requests(resumable_server)) == 7
+    assert len([request for request in resumable_server.requests if request['path'] == '/uploads']) == 2
+
+
+def test_interrupted_resumable_upload_is_resumed(monkeypatch, resumable_server, large_zip_file):
+    """the next submission of the same content resumes an interrupted resumable upload"""
+
+    monkeypatch.setenv('SALT_API_UPLOAD_RESUMES', '0')
+    fail_chunks_once(monkeypatch, salt_api._session, [3])
+    with pytest.raises(requests.ConnectionError):
+        submit(large_zip_file, '2018-1-SCI-042')
+    upload, = resumable_server.uploads.values()
+    assert sorted(upload['chunks']) == [0, 1, 2, 4, 5, 6]
+
+    del resumable_server.requests[:]
+    submit(large_zip_file, '2018-1-SCI-042')
+
+    with open(large_zip_file, 'rb') as f:
+        assert upload['content'] == f.read()
+    assert [request['path'] for request in chunk_requests(resumable_server)] == [
+        '/uploads/{id}/chunks/3'.format(id=upload['id'])]
+
+
+def test_resumable_upload_gives_up_after_max_resumes(monkeypatch, resumable_server, large_zip_file):
+    """a resumable upload is resumed up to SALT_API_UPLOAD_RESUMES times"""
+
+    monkeypatch.setenv('SALT_API_UPLOAD_RESUMES', '2')
+    resumable_server.error_rate = 1
+
+    with pytest.raises(SaltApiException):
+        submit(large_zip_file, '2018-1-SCI-042')
+
+    assert len(resumable_server.requests) == 3
@@ -0,0 +1,85 @@
+import time
+from email.utils import formatdate
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+import salt_api.retry
+from salt_api.retry import call_with_retries, retry_after
+
+
+@pytest.fixture()
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(salt_api.retry.time, 'sleep', sleeps.append)
+
+    yield sleeps
+
+
+def make_response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+def test_retries_temporary_errors(sleeps):
+    """requests are retried on 503 responses and connection errors with exponential backoff"""
+
+    request = MagicMock(side_effect=[make_response(503), requests.ConnectionError(), make_response(200)])
+
+    response = call_with_retries(request, max_retries=3, backoff_factor=1, backoff_max=10)
+
+    assert response.status_code == 200
+    assert request.call_count == 3
+    assert 0 <= sleeps[0] <= 1
+    assert 0 <= sleeps[1] <= 2
+
+
+def test_honours_retry_after(sleeps):
+    """the Retry-After header is used as delay"""
+
+    request = MagicMock(side_effect=[make_response(429, {'Retry-After': '7'}), make_response(200)])
+
+    call_with_retries(request, max_retries=3)
+
+    assert sleeps == [7]
+
+
+def test_long_retry_after_is_not_waited_for(sleeps):
+    """a response asking to retry after more than RETRY_AFTER_MAX seconds is returned without retrying"""
+
+    request = MagicMock(side_effect=[make_response(503, {'Retry-After': '3600'}), make_response(200)])
+
+    response = call_with_retries(request, max_retries=3)
+
+    assert response.status_code == 503
+    assert request.call_count == 1
+    assert sleeps == []
+
+
+def test_retry_after_date():
+    """a Retry-After header may contain an HTTP date"""
+
+    delay = retry_after(make_response(503, {'Retry-After': formatdate(time.time() + 60, usegmt=True)}))
+
+    assert 55 <= delay <= 60
+
+
+def test_gives_up_after_max_retries(sleeps):
+    """the last response is returned if the maximum number of retries is reached"""
+
+    request = MagicMock(return_value=make_response(503))
+
+    response = call_with_retries(request, max_retries=2, backoff_factor=0.1)
+
+    assert response.status_code == 503
+    assert request.call_count == 3
+
+
+def test_does_not_retry_other_errors(sleeps):
+    """client errors are not retried"""
+
+    request = MagicMock(return_value=make_response(400))
+
+    call_with_retries(request, max_retries=3)
+
+    assert request.call_count == 1
@@ -1,3 +1,11 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import salt_api
 from salt_api import session
 from token_auth_requests import AuthSession
 
@@ -6,3 +14,86 @@ def test_session_exists():
     """The salt_api package has a session object of type AuthSession."""
 
     assert type(session) == AuthSession
+
+
+def test_session_is_shared():
+    """The same session object is returned every time."""
+
+    assert salt_api.session is salt_api.get_session()
+    assert salt_api.session is session
+
+
+def test_session_is_created_lazily():
+    """Importing the package neither creates a session nor imports requests."""
+
+    script = 'import sys, salt_api, salt_api.proposals; print("requests" in sys.modules, salt_api._session is None)'
+    output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True).stdout
+
+    assert output.decode().split() == ['False', 'True']
+
+
+def test_asyncio_is_not_imported():
+    """Importing the proposals module doesn't import asyncio."""
+
+    script = 'import sys, salt_api.proposals; print("asyncio" in sys.modules)'
+    output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True).stdout
+
+    assert output.decode().strip() == 'False'
+
+
+def test_import_time():
+    """Importing the proposals module takes less than 250 ms."""
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import salt_api.proposals'],
+                            stderr=subprocess.PIPE,
+                            check=True).stderr
+    cumulative_times = {}
+    for line in output.decode().splitlines():
+        if line.startswith('import time:') and '|' in line:
+            self_time, cumulative_time, module = line[len('import time:'):].split('|')
+            if cumulative_time.strip().isdigit():
+                cumulative_times[module.strip()] = int(cumulative_time)
+
+    assert cumulative_times['salt_api.proposals'] < 250000  # microseconds
+
+
+def test_thread_local_sessions(monkeypatch):
+    """Every thread has its own session if SALT_API_SESSION_SCOPE is 'thread'"""
+
+    monkeypatch.setenv('SALT_API_SESSION_SCOPE', 'thread')
+    monkeypatch.setattr(salt_api, '_thread_local', threading.local())
+    monkeypatch.setattr(salt_api, '_create_session', object)
+
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append((salt_api.get_session(), salt_api.get_session())))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(first is second for first, second in sessions)
+    assert len({id(first) for first, second in sessions}) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork is not available')
+def test_session_is_not_inherited_by_forked_process(monkeypatch):
+    """A process created with fork creates its own session"""
+
+    monkeypatch.delenv('SALT_API_SESSION_SCOPE', raising=False)
+    monkeypatch.setattr(salt_api, '_create_session', object)
+    parent_session = salt_api.get_session()
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child_session = salt_api.get_session()
+            os.write(write_fd, b'1' if child_session is not parent_session else b'0')
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd, 'rb') as f:
+        assert f.read() == b'1'
+    assert salt_api.get_session() is parent_session
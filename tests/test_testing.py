@@ -0,0 +1,78 @@
+import hashlib
+import time
+
+import requests
+
+from salt_api.testing import StandInServer
+
+
+def test_latency():
+    """The stand-in server delays its responses by the given latency"""
+
+    with StandInServer(latency=0.2) as server:
+        start = time.monotonic()
+        requests.get(server.base_url + '/proposals/2018-1-SCI-042')
+
+    assert time.monotonic() - start >= 0.2
+
+
+def test_bandwidth():
+    """The stand-in server limits the rate at which content is sent"""
+
+    with StandInServer(bandwidth=1024 * 1024) as server:
+        server.content = bytes(512 * 1024)
+        start = time.monotonic()
+        response = requests.get(server.base_url + '/proposals/2018-1-SCI-042')
+
+    assert len(response.content) == 512 * 1024
+    assert time.monotonic() - start >= 0.5
+
+
+def test_error_injection():
+    """The stand-in server answers the given fraction of requests with an error"""
+
+    with StandInServer(error_rate=0.5, error_status=502, seed=42) as server:
+        status_codes = [requests.get(server.base_url + '/proposals/2018-1-SCI-042').status_code for _ in range(40)]
+
+    assert set(status_codes) == {200, 502}
+    assert 10 <= status_codes.count(502) <= 30
+
+
+def test_range_request():
+    """The stand-in server returns partial content for a Range header"""
+
+    with StandInServer() as server:
+        server.content = b'PK0123456789'
+        response = requests.get(server.base_url + '/proposals/2018-1-SCI-042', headers={'Range': 'bytes=4-'})
+
+    assert response.status_code == 206
+    assert response.content == b'23456789'
+    assert response.headers['Content-Range'] == 'bytes 4-11/12'
+
+
+def test_resumable_upload():
+    """The stand-in server verifies the chunks of a resumable upload and assembles the content"""
+
+    chunks = [b'a' * 4, b'b' * 2]
+    description = dict(proposal_code=None, size=6, chunk_size=4, sha256=hashlib.sha256(b''.join(chunks)).hexdigest(),
+                       chunks=[hashlib.sha256(chunk).hexdigest() for chunk in chunks])
+
+    with StandInServer() as server:
+        upload = requests.post(server.base_url + '/uploads', json=description).json()
+        url = server.base_url + '/uploads/' + upload['id']
+        assert upload['received'] == []
+
+        response = requests.put(url + '/chunks/0', data=b'c' * 4, headers={'X-Chunk-SHA256': description['chunks'][0]})
+        assert response.status_code == 400
+        response = requests.put(url + '/chunks/0', data=chunks[0], headers={'X-Chunk-SHA256': description['chunks'][0]})
+        assert response.status_code == 200
+        resumed = requests.post(server.base_url + '/uploads', json=description).json()
+        assert resumed == dict(id=upload['id'], received=[0])
+        response = requests.post(url + '/complete')
+        assert response.status_code == 409
+        assert response.json()['missing'] == [1]
+
+        requests.put(url + '/chunks/1', data=chunks[1], headers={'X-Chunk-SHA256': description['chunks'][1]})
+        assert requests.post(url + '/complete').json() == dict(received=6)
+
+    assert server.uploads[upload['id']]['content'] == b'aaaabb'
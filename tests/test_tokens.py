@@ -0,0 +1,130 @@
+import time
+
+import pytest
+import requests
+
+import salt_api
+import salt_api.tokens
+from salt_api import limits
+from salt_api.limits import AdaptiveConcurrency, ClientLimiter, TokenBucket
+from salt_api.tokens import TokenAuth, TokenManager, TokenStore
+
+
+def token_requests(server):
+    return [r for r in server.requests if r['path'] == '/token']
+
+
+def make_manager(server, store=None, background_refresh=False):
+    return TokenManager('observer', 'secret', server.base_url + '/token', store=store,
+                        background_refresh=background_refresh)
+
+
+def test_token_is_reused(stand_in_server):
+    """A token is requested once and then reused until it expires"""
+
+    manager = make_manager(stand_in_server)
+
+    assert manager.token() == 'stand-in-token'
+    assert manager.token() == 'stand-in-token'
+    assert len(token_requests(stand_in_server)) == 1
+    assert token_requests(stand_in_server)[0]['method'] == 'POST'
+
+
+def test_token_request_times_out(stand_in_server, monkeypatch):
+    """A token request times out with the session's read timeout rather than blocking indefinitely"""
+
+    monkeypatch.setenv('SALT_API_READ_TIMEOUT', '0.2')
+    monkeypatch.setenv('SALT_API_MAX_RETRIES', '0')
+    stand_in_server.latency = 1
+    manager = make_manager(stand_in_server)
+
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        manager.token()
+    assert time.monotonic() - start < 0.9
+
+
+def test_token_requests_bypass_limiter(stand_in_server, monkeypatch):
+    """Token requests neither take tokens from the shared limiter's bucket nor adjust its window"""
+
+    limiter = ClientLimiter(TokenBucket(rate=1, burst=1), AdaptiveConcurrency(maximum=8, initial=4))
+    monkeypatch.setattr(limits, '_limiter', limiter)
+    manager = make_manager(stand_in_server)
+
+    manager.token()
+    manager.token(invalid_token='stand-in-token')
+
+    assert len(token_requests(stand_in_server)) == 2
+    assert limiter.bucket.reserve() == 0
+    assert limiter.concurrency.window == 4
+
+
+def test_background_refresh(stand_in_server, monkeypatch):
+    """Tokens are refreshed in the background before they expire"""
+
+    monkeypatch.setattr(salt_api.tokens, 'TOKEN_EXPIRY_MARGIN', 0)
+    stand_in_server.token_lifetime = 1
+    manager = make_manager(stand_in_server, background_refresh=True)
+    try:
+        assert manager.token() == 'stand-in-token'
+        stand_in_server.token = 'new-token'
+        time.sleep(0.8)
+
+        assert len(token_requests(stand_in_server)) == 2
+        assert manager.token() == 'new-token'
+        assert len(token_requests(stand_in_server)) == 2
+    finally:
+        manager.close()
+
+
+def test_token_store_is_shared(stand_in_server, tmp_path):
+    """Token managers sharing a token store request a single token"""
+
+    path = str(tmp_path / 'tokens.json')
+    managers = [make_manager(stand_in_server, TokenStore(path)) for _ in range(3)]
+
+    assert [manager.token() for manager in managers] == ['stand-in-token'] * 3
+    assert len(token_requests(stand_in_server)) == 1
+
+
+def test_token_store_replaces_invalid_token(stand_in_server, tmp_path):
+    """A stored token rejected by the server is replaced"""
+
+    store = TokenStore(str(tmp_path / 'tokens.json'))
+    manager = make_manager(stand_in_server, store)
+    manager.token()
+    stand_in_server.token = 'new-token'
+
+    assert manager.token(invalid_token='stand-in-token') == 'new-token'
+    assert make_manager(stand_in_server, store).token() == 'new-token'
+    assert len(token_requests(stand_in_server)) == 2
+
+
+def test_token_auth_resends_after_401(stand_in_server):
+    """A request rejected with a 401 error is sent again with a new token"""
+
+    stand_in_server.check_tokens = True
+    session = requests.Session()
+    session.auth = TokenAuth(make_manager(stand_in_server))
+    assert session.get(stand_in_server.base_url + '/proposals/2018-1-SCI-042').status_code == 200
+
+    stand_in_server.token = 'new-token'
+    response = session.get(stand_in_server.base_url + '/proposals/2018-1-SCI-042')
+
+    assert response.status_code == 200
+    assert response.request.headers['Authentication'] == 'Token new-token'
+    assert len(token_requests(stand_in_server)) == 2
+
+
+def test_session_uses_token_manager(monkeypatch):
+    """The session uses a token manager if a username is defined by the environment"""
+
+    monkeypatch.setattr(salt_api, '_session', None)
+    monkeypatch.setattr(salt_api, '_token_manager', None)
+    monkeypatch.setenv('SALT_API_USERNAME', 'observer')
+    monkeypatch.setenv('SALT_API_PASSWORD', 'secret')
+
+    session = salt_api.get_session()
+
+    assert isinstance(session.auth, TokenAuth)
+    assert session.auth.manager.username == 'observer'
@@ -0,0 +1,46 @@
+import os
+import zipfile
+
+from salt_api.zipping import write_files
+
+
+def test_write_files_compresses_in_parallel(tmp_path):
+    """write_files writes many files in the given order, compressing only those worth compressing"""
+
+    files = []
+    for i in range(50):
+        path = tmp_path / 'file-{}.txt'.format(i)
+        content = ('line {}\n'.format(i) * 1000).encode() if i % 2 else os.urandom(10000)
+        path.write_bytes(content)
+        files.append((str(path), 'Included/{}.txt'.format(i)))
+    (tmp_path / 'image.png').write_bytes(b'\0' * 10000)
+    files.append((str(tmp_path / 'image.png'), 'Included/image.png'))
+
+    zip_path = str(tmp_path / 'out.zip')
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        write_files(z, files, max_workers=4)
+
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None
+        assert z.namelist() == [arcname for path, arcname in files]
+        for i, info in enumerate(z.infolist()[:50]):
+            assert info.compress_type == (zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED)
+        # png files are stored even though they would compress well
+        assert z.getinfo('Included/image.png').compress_type == zipfile.ZIP_STORED
+
+
+def test_write_files_min_saving(tmp_path):
+    """files which don't shrink by at least the requested fraction are stored"""
+
+    path = tmp_path / 'half_random.dat'
+    path.write_bytes(os.urandom(50000) + b'\0' * 50000)
+    zip_path = str(tmp_path / 'out.zip')
+
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        write_files(z, [(str(path), 'a.dat')], min_saving=0.1)
+        write_files(z, [(str(path), 'b.dat')], min_saving=0.9)
+
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None
+        assert z.getinfo('a.dat').compress_type == zipfile.ZIP_DEFLATED
+        assert z.getinfo('b.dat').compress_type == zipfile.ZIP_STORED